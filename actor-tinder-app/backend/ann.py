@@ -0,0 +1,154 @@
+"""
+File: backend/ann.py
+Description: approximate nearest neighbour search for large catalogs (IVFIndex), built and stored next to the film
+embeddings by RecommenderEngine.build_ann_index.
+"""
+import os
+
+import numpy as np
+from scipy import sparse  # One-hot cluster assignments while building the centroids
+
+from vectors import normalize_rows
+
+ANN_VERSION = 1  # layout of the approximate nearest neighbour index files
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour index for large catalogs (inverted file over k-means centroids).
+    Films are split into clusters with spherical k-means on their unit vectors; a query only scores the films of
+    its nprobe closest clusters instead of the whole catalog.
+    """
+
+    def __init__(self, centroids, list_offsets, list_ids, nprobe=8, fingerprint=""):
+        """
+        param centroids: 2D array, one unit vector per cluster
+        param list_offsets: films of cluster c are list_ids[list_offsets[c]:list_offsets[c + 1]]
+        param list_ids: film indices grouped by cluster
+        param nprobe: number of clusters searched per query (more is slower but closer to exact search)
+        param fingerprint: identifies the embeddings the index was built from
+        """
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, nprobe=8, n_iter=10, sample_size=50000, seed=0, fingerprint=""):
+        """
+        Cluster the film vectors with spherical k-means
+        param embeddings: 2D array of unit film vectors
+        param n_lists: number of clusters (about sqrt(number of films) by default)
+        param nprobe: default number of clusters searched per query
+        param n_iter: k-means iterations
+        param sample_size: number of films the centroids are trained on, all films are assigned afterwards
+        param seed: random seed, the same seed gives the same index
+        param fingerprint: identifies the embeddings, stored with the index
+        return: the index
+        """
+        n = len(embeddings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(seed)
+
+        sample = embeddings[np.sort(rng.choice(n, size=min(n, max(sample_size, n_lists)), replace=False))]
+        centroids = np.array(sample[rng.choice(len(sample), size=n_lists, replace=False)], dtype=np.float32)
+        for _ in range(n_iter):
+            assignment = cls._assign(sample, centroids)
+            # Sum the vectors of each cluster with a sparse one-hot matrix, then back to unit length
+            one_hot = sparse.csr_matrix((np.ones(len(sample), dtype=np.float32), (assignment, np.arange(len(sample)))),
+                                        shape=(n_lists, len(sample)))
+            sums = np.asarray(one_hot @ sample)
+            empty = np.flatnonzero(np.einsum('ij,ij->i', sums, sums) == 0)
+            sums[empty] = sample[rng.choice(len(sample), size=len(empty))]  # restart empty clusters on random films
+            centroids = normalize_rows(sums)
+
+        assignment = cls._assign(embeddings, centroids)
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+        return cls(centroids, list_offsets, list_ids, nprobe, fingerprint)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=65536):
+        """
+        return: index of the closest centroid of every vector (computed in chunks to bound memory)
+        """
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        return assignment
+
+    def search(self, query, min_candidates=1, nprobe=None, mask=None):
+        """
+        param query: 1D query vector
+        param min_candidates: more clusters are searched until at least this many films are found
+        param nprobe: number of clusters to search (self.nprobe by default)
+        param mask: boolean array over the films; only the marked ones are returned and count towards min_candidates
+        return: sorted array with the indices of the candidate films
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        order = np.argsort(-(self.centroids @ np.asarray(query, dtype=np.float32)), kind='stable')
+        if mask is None:
+            sizes = np.diff(self.list_offsets)[order]
+        else:
+            # Films of each cluster that pass the mask
+            passing = np.concatenate([[0], np.cumsum(mask[self.list_ids])])
+            sizes = (passing[self.list_offsets[1:]] - passing[self.list_offsets[:-1]])[order]
+        # Always take the nprobe closest clusters, and more if they hold fewer than min_candidates films
+        enough = np.searchsorted(np.cumsum(sizes), min_candidates) + 1
+        lists = order[:max(nprobe, min(enough, self.n_lists))]
+        candidates = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists])
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        return np.sort(candidates)
+
+    def with_rows(self, kept, new_vectors, fingerprint=""):
+        """
+        Patch the index after a catalog delta without running k-means again: the films that stay keep their cluster
+        and new films join the cluster of their closest centroid
+        param kept: indices of the films that stay, in their new order
+        param new_vectors: 2D array of unit vectors of the films appended after them
+        param fingerprint: identifies the patched embeddings
+        return: a new index (self is left untouched, so running requests can keep using it)
+        """
+        assignment = np.empty(len(self.list_ids), dtype=np.int64)
+        assignment[self.list_ids] = np.repeat(np.arange(self.n_lists), np.diff(self.list_offsets))
+        assignment = np.concatenate([assignment[kept], self._assign(new_vectors, self.centroids)])
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))])
+        return IVFIndex(self.centroids, list_offsets.astype(np.int64), list_ids, self.nprobe, fingerprint)
+
+    def save(self, path):
+        """
+        Store the index in a single .npz file (written atomically)
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=ANN_VERSION, centroids=self.centroids, list_offsets=self.list_offsets,
+                     list_ids=self.list_ids, nprobe=self.nprobe, fingerprint=self.fingerprint)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """
+        param path: file written by save
+        param fingerprint: when given, the index is only returned if it was built from the same embeddings
+        return: the index, or None if there is no valid index at path
+        """
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != ANN_VERSION:
+                    return None
+                if fingerprint is not None and str(data['fingerprint']) != fingerprint:
+                    return None
+                return cls(data['centroids'], data['list_offsets'], data['list_ids'], int(data['nprobe']),
+                           str(data['fingerprint']))
+        except (OSError, KeyError, ValueError):
+            return None
@@ -0,0 +1,108 @@
+"""
+File: backend/batching.py
+Description: dynamic micro-batching for the server. Concurrent /recommend requests wait a few milliseconds (or until
+max_batch of them are queued) and then go through RecommenderEngine.recommend_batch together: one model.encode for
+all their queries and one similarity product, instead of one small encode per request fighting over the torch threads.
+"""
+import asyncio
+
+# Longest time a request waits for others to join its batch, in milliseconds
+MAX_WAIT_MS = 5.0
+# Largest number of requests processed together
+MAX_BATCH = 32
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from concurrent coroutines and processes them in batches in a worker thread.
+    A batch starts when max_batch items are queued, when the oldest item has waited max_wait_ms, or as soon as the
+    previous batch finishes if items queued up meanwhile (so batches grow with the load).
+    """
+
+    def __init__(self, process, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, max_in_flight=1):
+        """
+        param process: function list of items -> list of results in the same order, run in a worker thread
+        param max_batch: largest batch (1 processes every item alone)
+        param max_wait_ms: longest wait for a batch to fill up
+        param max_in_flight: number of batches processed at the same time
+        """
+        if max_batch < 1 or max_in_flight < 1:
+            raise ValueError("max_batch and max_in_flight must be at least 1")
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.batches = 0  # number of batches processed, items / batches is the average batch size
+        self.items = 0
+        self._loop = None
+        self._pending = []  # (item, future) waiting for a batch
+        self._timer = None
+        self._in_flight = 0
+
+    async def submit(self, item):
+        """
+        param item: one item for process
+        return: its result (or raises the exception process raised for it)
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Futures belong to one event loop, a new loop (e.g. a server restart in the same process) starts afresh
+            self._loop, self._pending, self._timer, self._in_flight = loop, [], None, 0
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        """
+        Start batches with the pending items, as many as max_in_flight allows
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending and self._in_flight < self.max_in_flight:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self._in_flight += 1
+            self._loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.to_thread(self._process_isolated, items)
+        except Exception as e:
+            results = [e] * len(items)
+        finally:
+            self._in_flight -= 1
+            self.batches += 1
+            self.items += len(items)
+        for (_, future), result in zip(batch, results):
+            if future.done():  # the request was cancelled (client gone)
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        if self._pending:
+            # These items waited for the batch that just finished, they should not wait any longer
+            self._flush()
+
+    def _process_isolated(self, items):
+        """
+        return: the results of process, or one result / exception per item when the batch fails, so that one invalid
+        item does not fail the whole batch
+        """
+        try:
+            return self.process(items)
+        except Exception as e:
+            if len(items) == 1:
+                return [e]
+        results = []
+        for item in items:
+            try:
+                results.append(self.process([item])[0])
+            except Exception as e:
+                results.append(e)
+        return results
@@ -0,0 +1,5 @@
+"""
+File: backend/benchmarks/__init__.py
+Description: offline reports and benchmarks for the recommendation engine, run from the backend folder with
+python -m benchmarks.<name>
+"""
@@ -0,0 +1,97 @@
+"""
+File: backend/benchmarks/ann_recall.py
+Description: recall@k versus latency report of the IVF approximate nearest neighbour index against exact search,
+on a synthetic clustered catalog (or on the real film embeddings with --real).
+Usage (from the backend folder): python -m benchmarks.ann_recall --films 200000 --queries 200
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embeddings3 import IVFIndex, RecommenderEngine, normalize_rows, top_k_indices
+
+
+def synthetic_catalog(n_films, dim, n_topics, seed):
+    """
+    Unit vectors drawn around n_topics random directions, a rough stand-in for film embeddings
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    catalog = np.empty((n_films, dim), dtype=np.float32)
+    for start in range(0, n_films, 100000):
+        end = min(start + 100000, n_films)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32)
+        catalog[start:end] = topics[rng.integers(0, n_topics, size=end - start)] + 0.8 * noise
+    return normalize_rows(catalog)
+
+def sample_queries(embeddings, n_queries, seed):
+    """
+    Queries close to random films, like a preference vector built from a few liked films
+    """
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, len(embeddings), size=(n_queries, 3))
+    return normalize_rows(embeddings[picks].sum(axis=1))
+
+def measure(embeddings, queries, k, n_lists, nprobes):
+    """
+    return: list of dictionaries with recall@k and per query latency for exact search and every nprobe
+    """
+    start = time.perf_counter()
+    exact = [top_k_indices(embeddings @ q, k) for q in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    rows = [{"method": "exact", "nprobe": None, "recall_at_k": 1.0, "latency_ms": exact_ms, "candidates": len(embeddings)}]
+
+    start = time.perf_counter()
+    index = IVFIndex.build(embeddings, n_lists=n_lists)
+    build_seconds = time.perf_counter() - start
+
+    for nprobe in nprobes:
+        recalls, sizes = [], []
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            candidates = index.search(q, min_candidates=k, nprobe=nprobe)
+            found = candidates[top_k_indices(embeddings[candidates] @ q, k)]
+            recalls.append(len(np.intersect1d(found, truth)) / k)
+            sizes.append(len(candidates))
+        latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+        rows.append({"method": "ivf", "nprobe": nprobe, "recall_at_k": float(np.mean(recalls)),
+                     "latency_ms": latency_ms, "candidates": float(np.mean(sizes))})
+    return rows, build_seconds, index.n_lists
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=200000, help="size of the synthetic catalog")
+    parser.add_argument("--dim", type=int, default=384, help="vector length (384 like all-MiniLM-L6-v2)")
+    parser.add_argument("--topics", type=int, default=500, help="number of directions the synthetic films gather around")
+    parser.add_argument("--real", action="store_true", help="use the real film embeddings instead")
+    parser.add_argument("--encoder", default="minilm", help="encoder backend for --real (minilm or hashing)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=15)
+    parser.add_argument("--lists", type=int, default=None, help="number of clusters (sqrt(films) by default)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.real:
+        embeddings = np.asarray(RecommenderEngine.from_csv(encoder=args.encoder).embeddings)
+    else:
+        embeddings = synthetic_catalog(args.films, args.dim, args.topics, args.seed)
+    queries = sample_queries(embeddings, args.queries, args.seed)
+
+    rows, build_seconds, n_lists = measure(embeddings, queries, args.top_k, args.lists, args.nprobe)
+
+    print(f"{len(embeddings)} films, {n_lists} clusters, index built in {build_seconds:.1f} s")
+    print(f"{'method':>8} {'nprobe':>7} {'recall@k':>9} {'ms/query':>9} {'candidates':>11}")
+    for row in rows:
+        print(f"{row['method']:>8} {str(row['nprobe'] or '-'):>7} {row['recall_at_k']:>9.3f} "
+              f"{row['latency_ms']:>9.3f} {row['candidates']:>11.0f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"films": len(embeddings), "n_lists": n_lists, "build_seconds": build_seconds,
+                       "top_k": args.top_k, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+File: backend/benchmarks/catalog_loading.py
+Description: benchmark of catalog loading: the row by row loader (ast.literal_eval on every Cast string,
+create_movie_text with DataFrame.apply, loops over every film for the actor mapping and the genre / director indexes)
+against the vectorized loader (load_catalog without cache) and a start from the preprocessed .npz cache.
+The catalog is final_films.csv repeated --scale times (with distinct Codes), to see how each loader grows.
+Usage (from the backend folder): python -m benchmarks.catalog_loading --scale 20
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from embeddings3 import (ACTORS_CSV, FILMS_CSV, build_actor_mapping, create_movie_text, load_catalog, parse_cast,
+                         split_field)
+
+
+def legacy_load(films_path, actors_path):
+    """
+    The loader before vectorization, step by step as RecommenderEngine.from_csv used to run it
+    """
+    actor_map = {}
+    for c in pd.read_csv(actors_path).itertuples(index=False):
+        actor_map[c[0]] = c[1]
+    films = pd.read_csv(films_path)
+    films.columns = films.columns.str.strip()
+    films['Actor_Names'] = films['Cast'].apply(parse_cast, args=(actor_map,))
+    films['description'] = films.apply(create_movie_text, axis=1)
+
+    actor_to_directors, actor_to_genres = defaultdict(set), defaultdict(list)
+    for j, row in films.iterrows():
+        for actor in row['Actor_Names']:
+            for d in split_field(row['Director']):
+                actor_to_directors[actor].add(d)
+            for g in split_field(row['Genres']):
+                actor_to_genres[actor].append(g)
+
+    genre_index, rows, columns = {}, [], []
+    for i, genres in enumerate(films['Genres']):
+        for g in split_field(genres):
+            rows.append(i)
+            columns.append(genre_index.setdefault(g, len(genre_index)))
+    sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(films), len(genre_index)))
+    director_index = {}
+    film_directors = np.full(len(films), -1, dtype=np.int32)
+    for i, director in enumerate(films['Director']):
+        if isinstance(director, str):
+            film_directors[i] = director_index.setdefault(director, len(director_index))
+    return films
+
+def vectorized_load(films_path, actors_path, cache_dir=None):
+    """
+    The current loader (from the cache when cache_dir holds one), plus the actor mapping the engine builds
+    """
+    films, actor_map, indexes = load_catalog(films_path, actors_path, cache_dir)
+    build_actor_mapping(films)
+    return films
+
+def scaled_catalog(scale, folder):
+    """
+    Write final_films.csv repeated scale times (Codes made unique) into folder
+    return: path of the new CSV
+    """
+    films = pd.read_csv(FILMS_CSV)
+    copies = [films.assign(Code=films['Code'] + (f"-{i}" if i else "")) for i in range(scale)]
+    path = os.path.join(folder, "films.csv")
+    pd.concat(copies, ignore_index=True).to_csv(path, index=False)
+    return path
+
+def timed(function, repeat):
+    """
+    return: best wall time of repeat calls, in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="number of copies of final_films.csv")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        films_path = scaled_catalog(args.scale, folder) if args.scale > 1 else FILMS_CSV
+        cache_dir = os.path.join(folder, "cache")
+        vectorized_load(films_path, ACTORS_CSV, cache_dir)  # writes the cache
+
+        # Same table from every loader
+        legacy, current = legacy_load(films_path, ACTORS_CSV), vectorized_load(films_path, ACTORS_CSV, cache_dir)
+        assert legacy['description'].tolist() == current['description'].tolist()
+        assert legacy['Actor_Names'].tolist() == current['Actor_Names'].tolist()
+
+        rows = [
+            {"loader": "legacy", "seconds": timed(lambda: legacy_load(films_path, ACTORS_CSV), args.repeat)},
+            {"loader": "vectorized", "seconds": timed(lambda: vectorized_load(films_path, ACTORS_CSV), args.repeat)},
+            {"loader": "npz cache",
+             "seconds": timed(lambda: vectorized_load(films_path, ACTORS_CSV, cache_dir), args.repeat)},
+        ]
+        cache_mb = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir)) / 2 ** 20
+    finally:
+        shutil.rmtree(folder)
+
+    print(f"{len(current)} films, cache file {cache_mb:.1f} MB, best of {args.repeat}")
+    print(f"{'loader':>12} {'seconds':>9} {'speedup':>8}")
+    for row in rows:
+        row["speedup"] = rows[0]["seconds"] / row["seconds"]
+        print(f"{row['loader']:>12} {row['seconds']:>9.3f} {row['speedup']:>7.1f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"films": len(current), "cache_mb": cache_mb, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
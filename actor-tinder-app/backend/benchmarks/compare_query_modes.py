@@ -0,0 +1,91 @@
+"""
+File: backend/benchmarks/compare_query_modes.py
+Description: offline report comparing the rankings of the "precomputed" query mode (averaged actor, director and
+genre vectors) against the "encode" mode (the model encodes every request's queries) on simulated swipe sessions.
+Usage (from the backend folder): python -m benchmarks.compare_query_modes --users 500 --top-k 15
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from embeddings3 import RecommenderEngine, QueryCache, num_actors_to_show
+from server import DEFAULT_WEIGHTS
+
+
+def simulate_swipes(all_actors, rng, like_probability):
+    """
+    Simulate one session: the user swipes on num_actors_to_show random actors
+    return: (liked_actors, disliked_actors)
+    """
+    liked, disliked = [], []
+    for actor in rng.sample(all_actors, min(num_actors_to_show, len(all_actors))):
+        (liked if rng.random() < like_probability else disliked).append(actor)
+    return liked, disliked
+
+def timed_recommend(engine, liked, disliked, top_k):
+    """
+    return: (list of recommended titles, seconds spent)
+    """
+    start = time.perf_counter()
+    recs = engine.recommend(liked, disliked, DEFAULT_WEIGHTS, top_k)
+    return recs["Title"].tolist(), time.perf_counter() - start
+
+def compare(engine, users, top_k, like_probability, seed):
+    """
+    Run both modes on the same simulated sessions
+    return: dictionary with the agreement between the modes and their latencies
+    """
+    rng = random.Random(seed)
+    overlaps, top1_agreements = [], []
+    latencies = {"encode": [], "precomputed": []}
+    for _ in range(users):
+        liked, disliked = simulate_swipes(engine.all_actors, rng, like_probability)
+
+        engine.query_mode = "encode"
+        encoded, seconds = timed_recommend(engine, liked, disliked, top_k)
+        latencies["encode"].append(seconds)
+
+        engine.query_mode = "precomputed"
+        precomputed, seconds = timed_recommend(engine, liked, disliked, top_k)
+        latencies["precomputed"].append(seconds)
+
+        overlaps.append(len(set(encoded) & set(precomputed)) / max(len(encoded), 1))
+        top1_agreements.append(bool(encoded) and bool(precomputed) and encoded[0] == precomputed[0])
+
+    report = {
+        "users": users,
+        "top_k": top_k,
+        "mean_overlap_at_k": float(np.mean(overlaps)),
+        "min_overlap_at_k": float(np.min(overlaps)),
+        "top1_agreement": float(np.mean(top1_agreements)),
+    }
+    for mode, values in latencies.items():
+        report[f"{mode}_p50_ms"] = float(np.percentile(values, 50) * 1000)
+        report[f"{mode}_p99_ms"] = float(np.percentile(values, 99) * 1000)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500, help="number of simulated sessions")
+    parser.add_argument("--top-k", type=int, default=15)
+    parser.add_argument("--like-probability", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoder", default="minilm", help="encoder backend (minilm or hashing)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    engine = RecommenderEngine.from_csv(encoder=args.encoder, query_mode="precomputed")
+    engine.query_cache = QueryCache(maxsize=0)  # measure the real cost of encoding every request
+    report = compare(engine, args.users, args.top_k, args.like_probability, args.seed)
+
+    for key, value in report.items():
+        print(f"{key:>22}: {value:.4f}" if isinstance(value, float) else f"{key:>22}: {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
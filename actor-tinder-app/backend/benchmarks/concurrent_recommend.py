@@ -0,0 +1,94 @@
+"""
+File: backend/benchmarks/concurrent_recommend.py
+Description: throughput of /recommend under concurrent load, with one recommend (and one model.encode) per request
+(max_batch 1, what the sync route did on the thread pool) against the micro-batching of batching.MicroBatcher with
+several max_batch / max_wait settings. Clients are coroutines sending simulated swipe sessions back to back, so
+the numbers leave out HTTP and JSON but keep the scheduling of the server.
+Usage (from the backend folder): python -m benchmarks.concurrent_recommend --clients 64 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from batching import MicroBatcher
+from benchmarks.compare_query_modes import simulate_swipes
+from embeddings3 import QueryCache, RecommenderEngine, recommend_movies, recommend_movies_batch
+from server import DEFAULT_WEIGHTS
+
+
+async def unbatched_client(engine, sessions):
+    """
+    One request at a time on the default thread pool, as the sync /recommend route ran
+    """
+    for liked, disliked in sessions:
+        await asyncio.to_thread(recommend_movies, liked, disliked, DEFAULT_WEIGHTS, 15, engine)
+
+async def batched_client(batcher, sessions):
+    for liked, disliked in sessions:
+        await batcher.submit({"liked_actors": liked, "disliked_actors": disliked, "weights": DEFAULT_WEIGHTS,
+                              "top_k": 15})
+
+def run_load(engine, sessions_per_client, max_batch=None, max_wait_ms=None):
+    """
+    param max_batch: None to run every request alone, otherwise the settings of the MicroBatcher
+    return: dictionary with the throughput and the average batch size
+    """
+    engine.query_cache = QueryCache(engine.query_cache.maxsize)  # every run encodes the same queries from scratch
+    batcher = None
+    if max_batch is not None:
+        batcher = MicroBatcher(lambda requests: recommend_movies_batch(requests, engine=engine),
+                               max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    async def run():
+        if batcher is None:
+            await asyncio.gather(*(unbatched_client(engine, s) for s in sessions_per_client))
+        else:
+            await asyncio.gather(*(batched_client(batcher, s) for s in sessions_per_client))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    seconds = time.perf_counter() - start
+    n_requests = sum(len(s) for s in sessions_per_client)
+    return {
+        "max_batch": max_batch or 1,
+        "max_wait_ms": max_wait_ms or 0.0,
+        "requests_per_second": n_requests / seconds,
+        "mean_batch": batcher.items / batcher.batches if batcher else 1.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--encoder", default="minilm", help="see embeddings3.ENCODERS")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--like-probability", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    engine = RecommenderEngine.from_csv(encoder=args.encoder)
+    rng = random.Random(args.seed)
+    sessions_per_client = [
+        [simulate_swipes(engine.all_actors, rng, args.like_probability) for _ in range(args.requests)]
+        for _ in range(args.clients)
+    ]
+
+    rows = [run_load(engine, sessions_per_client)]
+    for max_batch, max_wait_ms in [(8, 2.0), (32, 5.0), (64, 10.0)]:
+        rows.append(run_load(engine, sessions_per_client, max_batch, max_wait_ms))
+
+    print(f"{args.clients} clients x {args.requests} requests, encoder {args.encoder}")
+    print(f"{'max_batch':>9} {'wait ms':>8} {'mean batch':>11} {'req/s':>9} {'speedup':>8}")
+    for row in rows:
+        row["speedup"] = row["requests_per_second"] / rows[0]["requests_per_second"]
+        print(f"{row['max_batch']:>9} {row['max_wait_ms']:>8.1f} {row['mean_batch']:>11.1f} "
+              f"{row['requests_per_second']:>9.1f} {row['speedup']:>7.1f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"clients": args.clients, "requests": args.requests, "encoder": args.encoder,
+                       "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
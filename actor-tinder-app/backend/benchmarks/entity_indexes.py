@@ -0,0 +1,116 @@
+"""
+File: backend/benchmarks/entity_indexes.py
+Description: benchmark of the integer-coded CSR actor / director / genre indexes against the dictionaries keyed by
+actor name they replace (actor_to_directors, actor_to_genres with one genre per film, a Counter per request and
+np.isin over every film for the director bonus): memory kept by the indexes, time to build them and per-request
+overhead of the preferences and bonus (everything in recommend_movies except the model and the similarity product).
+The catalog is final_films.csv repeated --scale times, so actors have --scale times more films.
+Usage (from the backend folder): python -m benchmarks.entity_indexes --scale 20
+"""
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+from embeddings3 import ACTORS_CSV, RecommenderEngine, build_actor_mapping, build_entity_indexes, load_catalog
+from benchmarks.catalog_loading import scaled_catalog
+
+
+def legacy_bonus(engine, maps, liked_actors):
+    """
+    Preferences and bonus of one user as they were computed with the name keyed dictionaries
+    """
+    actor_to_directors, actor_to_genres = maps
+    bonus_directors = set()
+    for actor in liked_actors:
+        bonus_directors.update(actor_to_directors.get(actor, []))
+    genre_counter = Counter()
+    for actor in liked_actors:
+        genre_counter.update(actor_to_genres.get(actor, []))
+    total_genres = sum(genre_counter.values()) or 1
+    genre_distribution = {genre: count / total_genres for genre, count in genre_counter.items()}
+    sorted(bonus_directors)
+
+    bonus = engine.genre_matrix @ engine.genre_weights(genre_distribution)
+    director_codes = [engine.director_index[d] for d in bonus_directors if d in engine.director_index]
+    if director_codes:
+        bonus[np.isin(engine.film_directors, director_codes)] += 0.1
+    return bonus
+
+def indexed_bonus(engine, liked_actors):
+    """
+    Same computation with the CSR indexes, as recommend_batch does it
+    """
+    preferences = engine.build_preferences(liked_actors, [])
+    bonus = engine.genre_matrix @ preferences["genre_weights"]
+    bonus[preferences["director_films"]] += 0.1
+    return bonus
+
+def retained_bytes(build):
+    """
+    return: (result of build(), bytes still allocated by it once it returns)
+    """
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def per_request_microseconds(function, users):
+    start = time.perf_counter()
+    for liked in users:
+        function(liked)
+    return (time.perf_counter() - start) / len(users) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="number of copies of final_films.csv")
+    parser.add_argument("--users", type=int, default=500, help="number of simulated users")
+    parser.add_argument("--liked", type=int, default=12, help="liked actors per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        films, actor_map, indexes = load_catalog(scaled_catalog(args.scale, folder), ACTORS_CSV, cache_dir=None)
+    finally:
+        shutil.rmtree(folder)
+    engine = RecommenderEngine(films, None, None, indexes=indexes, actor_map=actor_map)
+
+    start = time.perf_counter()
+    maps, maps_bytes = retained_bytes(lambda: build_actor_mapping(films))
+    maps_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    _, csr_bytes = retained_bytes(lambda: build_entity_indexes(films, engine.genre_index, engine.director_index,
+                                                               engine.film_directors, actor_map))
+    csr_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed)
+    names = sorted(set(actor_map.values()))
+    users = [rng.sample(names, args.liked) for _ in range(args.users)]
+    for liked in users[:20]:
+        assert np.allclose(legacy_bonus(engine, maps, liked), indexed_bonus(engine, liked))
+    rows = [
+        {"indexes": "name dictionaries", "retained_mb": maps_bytes / 2 ** 20, "build_seconds": maps_seconds,
+         "request_us": per_request_microseconds(lambda liked: legacy_bonus(engine, maps, liked), users)},
+        {"indexes": "CSR", "retained_mb": csr_bytes / 2 ** 20, "build_seconds": csr_seconds,
+         "request_us": per_request_microseconds(lambda liked: indexed_bonus(engine, liked), users)},
+    ]
+
+    print(f"{len(films)} films, {args.users} users liking {args.liked} actors")
+    print(f"{'indexes':>18} {'MB':>8} {'build s':>8} {'us/request':>11}")
+    for row in rows:
+        print(f"{row['indexes']:>18} {row['retained_mb']:>8.2f} {row['build_seconds']:>8.3f} {row['request_us']:>11.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"films": len(films), "users": args.users, "liked": args.liked, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+File: backend/benchmarks/quantization.py
+Description: benchmark of the compact film vector storage modes (float16, int8 with per-row scales) against
+float32: memory of the scoring matrix, scoring throughput (approximate scoring plus float32 rescoring of the best
+candidates) and top-k overlap with exact float32 search.
+Usage (from the backend folder): python -m benchmarks.quantization --films 200000 --queries 100
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embeddings3 import RESCORE_K, quantize_embeddings, quantized_scores, top_k_indices
+from benchmarks.ann_recall import sample_queries, synthetic_catalog
+
+
+def search(embeddings, quantized, scales, query, k, rescore_k):
+    """
+    Top k films of one query, like RecommenderEngine.recommend_batch does for each storage mode
+    """
+    if quantized is None:
+        return top_k_indices(embeddings @ query, k)
+    approximate = quantized_scores(quantized, scales, query[None, :])[0]
+    candidates = np.sort(top_k_indices(approximate, max(rescore_k, k)))
+    return candidates[top_k_indices(embeddings[candidates] @ query, k)]
+
+def measure(embeddings, queries, k, rescore_k):
+    """
+    return: list of dictionaries (one per storage mode) with memory, throughput and overlap with float32
+    """
+    exact = [top_k_indices(embeddings @ q, k) for q in queries]
+    rows = []
+    for mode in ("float32", "float16", "int8"):
+        if mode == "float32":
+            quantized, scales, nbytes = None, None, embeddings.nbytes
+        else:
+            quantized, scales = quantize_embeddings(embeddings, mode)
+            nbytes = quantized.nbytes + (scales.nbytes if scales is not None else 0)
+
+        start = time.perf_counter()
+        found = [search(embeddings, quantized, scales, q, k, rescore_k) for q in queries]
+        seconds = time.perf_counter() - start
+
+        # Batched scoring, as recommend_batch does for up to SCORE_CHUNK_SIZE users: the conversion of the compact
+        # rows back to float32 is shared by all queries of the batch
+        start = time.perf_counter()
+        if quantized is None:
+            queries @ embeddings.T
+        else:
+            quantized_scores(quantized, scales, queries)
+        batched_seconds = time.perf_counter() - start
+
+        overlaps = [len(np.intersect1d(a, b)) / k for a, b in zip(found, exact)]
+        rows.append({"storage": mode, "matrix_mb": nbytes / 2 ** 20,
+                     "memory_saved": 1 - nbytes / embeddings.nbytes,
+                     "queries_per_second": len(queries) / seconds,
+                     "batched_queries_per_second": len(queries) / batched_seconds,
+                     "mean_overlap_at_k": float(np.mean(overlaps)), "min_overlap_at_k": float(np.min(overlaps))})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=200000, help="size of the synthetic catalog")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=15)
+    parser.add_argument("--rescore-k", type=int, default=RESCORE_K)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    embeddings = synthetic_catalog(args.films, args.dim, args.topics, args.seed)
+    queries = sample_queries(embeddings, args.queries, args.seed)
+    rows = measure(embeddings, queries, args.top_k, args.rescore_k)
+
+    print(f"{len(embeddings)} films x {embeddings.shape[1]} dims, top {args.top_k}, rescoring {args.rescore_k}")
+    print(f"{'storage':>8} {'MB':>9} {'saved':>6} {'queries/s':>10} {'batched/s':>10} {'overlap@k':>10} {'min':>6}")
+    for row in rows:
+        print(f"{row['storage']:>8} {row['matrix_mb']:>9.1f} {row['memory_saved']:>6.0%} "
+              f"{row['queries_per_second']:>10.1f} {row['batched_queries_per_second']:>10.1f} "
+              f"{row['mean_overlap_at_k']:>10.3f} {row['min_overlap_at_k']:>6.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"films": len(embeddings), "dim": embeddings.shape[1], "top_k": args.top_k,
+                       "rescore_k": args.rescore_k, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+File: backend/benchmarks/run_suite.py
+Description: benchmark suite meant to run before every release. For synthetic catalogs of growing size (10k, 100k and
+1M films by default, with a stub encoder so no model is loaded) it measures:
+    startup: import of embeddings3 / server in a fresh interpreter, engine build from the CSV files with an empty
+             cache (parsing, encoding, indexes) and with a warm cache (.npz catalog and embeddings artifact)
+    stages:  RecommenderEngine.rank_batch for one user, in total and per stage as recorded by its
+             RECOMMEND_STAGE_SECONDS histogram (preferences, encode, similarity, bonus, top-k), and the result table
+    latency: p50 / p99 of POST /recommend through the FastAPI TestClient
+    throughput: users per second of recommend_movies_batch
+Results are written as JSON; with --baseline, every time that got slower than the baseline by more than --tolerance
+is reported and the exit code is 1, so the suite can guard a release.
+Usage (from the backend folder): python -m benchmarks.run_suite --sizes 10000,100000 --json results.json
+                                 python -m benchmarks.run_suite --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import embeddings3
+from embeddings3 import RecommenderEngine, normalize_rows, recommend_movies_batch
+from metrics import RECOMMEND_STAGE_SECONDS
+from server import DEFAULT_WEIGHTS
+
+SUITE_VERSION = 2
+GENRES = ["Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Documentary", "Drama", "Family",
+          "Fantasy", "History", "Horror", "Music", "Musical", "Mystery", "Romance", "Sci-Fi", "Sport", "Thriller",
+          "War", "Western"]
+# Number of actors users swipe on, like top_1000.csv
+N_SWIPE_ACTORS = 1000
+
+
+class StubEncoder:
+    """
+    Deterministic encoder without a model: every text gets the sum of two rows of a fixed random table, picked by
+    a checksum of the text. Vectors have the size of MiniLM's but cost next to nothing, so the suite measures the
+    engine and not the model.
+    """
+
+    def __init__(self, dim=384, table_size=4096, seed=0):
+        self.dim = dim
+        self.name = f"stub-{dim}"
+        self.table = np.random.default_rng(seed).standard_normal((table_size, dim)).astype(np.float32)
+
+    def encode(self, texts, show_progress_bar=False):
+        checksums = np.fromiter((zlib.crc32(t.encode()) for t in texts), dtype=np.int64, count=len(texts))
+        n = len(self.table)
+        return normalize_rows(self.table[checksums % n] + self.table[(checksums // n) % n])
+
+
+def synthetic_catalog(n_films, folder, seed=0):
+    """
+    Write a films CSV with the columns of final_films.csv and an actors CSV like top_1000.csv.
+    Actor and director popularity is skewed (a few appear in many films), casts list 3 to 10 actors of which only
+    the N_SWIPE_ACTORS most popular are in the actors CSV, as in the real data.
+    return: (films path, actors path)
+    """
+    rng = np.random.default_rng(seed)
+    n_actors = max(N_SWIPE_ACTORS * 2, n_films // 2)
+    n_directors = max(100, n_films // 8)
+
+    cast_sizes = rng.integers(3, 11, n_films)
+    actor_ids = np.minimum(rng.zipf(1.3, cast_sizes.sum()) - 1, n_actors - 1)
+    cast_ends = np.cumsum(cast_sizes)
+    names = np.array([f"'nm{a:07d}'" for a in range(n_actors)], dtype=object)
+    cast_words = names[actor_ids]
+    casts = ["[" + ", ".join(cast_words[end - size:end]) + "]" for size, end in zip(cast_sizes, cast_ends)]
+
+    genre_counts = rng.integers(1, 4, n_films)
+    genre_picks = rng.integers(0, len(GENRES), (n_films, 3))
+    genre_names = np.array(GENRES, dtype=object)
+    genres = [",".join(dict.fromkeys(genre_names[picks[:count]])) for picks, count in zip(genre_picks, genre_counts)]
+
+    films = pd.DataFrame({
+        "Code": [f"tt{i:08d}" for i in range(n_films)],
+        "Title": [f"Film {i}" for i in range(n_films)],
+        "Runtime": rng.integers(70, 200, n_films),
+        "Genres": genres,
+        "AverageRating": np.round(rng.uniform(1, 10, n_films), 1),
+        "Cast": casts,
+        "Director": [f"nm{9_000_000 + d:07d}" for d in np.minimum(rng.zipf(1.5, n_films) - 1, n_directors - 1)],
+        "releaseYear": rng.integers(1920, 2025, n_films),
+    })
+    actors = pd.DataFrame({"Const": [f"nm{a:07d}" for a in range(N_SWIPE_ACTORS)],
+                           "Name": [f"Actor {a}" for a in range(N_SWIPE_ACTORS)]})
+    films_path, actors_path = os.path.join(folder, "films.csv"), os.path.join(folder, "actors.csv")
+    films.to_csv(films_path, index=False)
+    actors.to_csv(actors_path, index=False)
+    return films_path, actors_path
+
+def import_seconds(module):
+    """
+    return: time to import module in a fresh interpreter (what every worker and every test run pays)
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return float(output.stdout.strip().splitlines()[-1])
+
+def percentiles_ms(seconds):
+    """
+    return: dictionary with the p50, p99 and mean of a list of durations, in milliseconds
+    """
+    ms = np.asarray(seconds) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p99": float(np.percentile(ms, 99)), "mean": float(ms.mean())}
+
+def simulated_users(engine, n_users, seed):
+    """
+    return: list of requests like the ones recommend_movies_batch takes, from 20 swipes each
+    """
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n_users):
+        swiped = rng.sample(engine.all_actors, min(20, len(engine.all_actors)))
+        requests.append({"liked_actors": swiped[:10], "disliked_actors": swiped[10:], "weights": DEFAULT_WEIGHTS,
+                         "top_k": 15})
+    return requests
+
+def stage_seconds(engine, request, stages=("preferences", "encode", "similarity", "bonus", "top_k", "ann")):
+    """
+    One user through RecommenderEngine.rank_batch; its stages are read from what it adds to RECOMMEND_STAGE_SECONDS
+    param stages: stages of the histogram to report (the ones rank_batch did not go through are left out)
+    return: dictionary stage -> seconds, with rank_batch for the whole call and result_table for the records
+    """
+    before = {stage: (RECOMMEND_STAGE_SECONDS.count(stage=stage), RECOMMEND_STAGE_SECONDS.total(stage=stage))
+              for stage in stages}
+    start = time.perf_counter()
+    ranked = engine.rank_batch([request])
+    times = {"rank_batch": time.perf_counter() - start}
+    for stage, (count, total) in before.items():
+        if RECOMMEND_STAGE_SECONDS.count(stage=stage) > count:
+            times[stage] = RECOMMEND_STAGE_SECONDS.total(stage=stage) - total
+    start = time.perf_counter()
+    engine.catalog.records(ranked[0])
+    times["result_table"] = time.perf_counter() - start
+    return times
+
+def measure_size(n_films, args):
+    """
+    Run every measurement on a synthetic catalog of n_films films
+    return: dictionary of results
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        films_path, actors_path = synthetic_catalog(n_films, folder, args.seed)
+        model = StubEncoder(args.dim)
+        cache_dir = os.path.join(folder, "cache")
+
+        start = time.perf_counter()
+        RecommenderEngine.from_csv(films_path, actors_path, model=model, cache_dir=cache_dir)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        engine = RecommenderEngine.from_csv(films_path, actors_path, model=model, cache_dir=cache_dir)
+        warm = time.perf_counter() - start
+
+        requests = simulated_users(engine, args.users, args.seed)
+        # Stages with a cold query cache, as for new swipe combinations
+        stages = [stage_seconds(engine, request) for request in requests]
+        stages_ms = {stage: percentiles_ms([s[stage] for s in stages]) for stage in stages[0]}
+
+        latency = http_latency_seconds(engine, requests)
+
+        start = time.perf_counter()
+        recommend_movies_batch(requests, engine=engine)
+        throughput = len(requests) / (time.perf_counter() - start)
+    finally:
+        shutil.rmtree(folder)
+    return {
+        "films": n_films,
+        "startup_seconds": {"engine_cold": cold, "engine_warm": warm},
+        "stages_ms": stages_ms,
+        "recommend_http_ms": percentiles_ms(latency),
+        "batch_users_per_second": throughput,
+    }
+
+def http_latency_seconds(engine, requests):
+    """
+    return: duration of every POST /recommend through the TestClient, one user after the other
+    """
+    from fastapi.testclient import TestClient
+    from server import app
+
+    embeddings3.set_engine(engine)
+    try:
+        client = TestClient(app)
+        client.post("/recommend", json={"liked_actors": [], "disliked_actors": []})  # first call sets up the client
+        durations = []
+        for request in requests:
+            start = time.perf_counter()
+            response = client.post("/recommend", json={"liked_actors": request["liked_actors"],
+                                                       "disliked_actors": request["disliked_actors"]})
+            durations.append(time.perf_counter() - start)
+            response.raise_for_status()
+        return durations
+    finally:
+        embeddings3.set_engine(None)
+
+def timings(report):
+    """
+    return: dictionary metric name -> value of every "lower is better" number of a report, for comparisons
+    """
+    values = {f"import.{module}": seconds for module, seconds in report["import_seconds"].items()}
+    for result in report["results"]:
+        prefix = f"{result['films']}"
+        for name, seconds in result["startup_seconds"].items():
+            values[f"{prefix}.startup.{name}"] = seconds
+        for stage, stats in result["stages_ms"].items():
+            values[f"{prefix}.stage.{stage}.p50"] = stats["p50"]
+        for stat in ("p50", "p99"):
+            values[f"{prefix}.recommend_http.{stat}"] = result["recommend_http_ms"][stat]
+        values[f"{prefix}.batch_seconds_per_user"] = 1 / result["batch_users_per_second"]
+    return values
+
+def regressions(report, baseline, tolerance, floor_ms=0.05):
+    """
+    param floor_ms: stages faster than this in both reports are noise, not regressions
+    return: list of (metric, baseline value, new value) that got slower by more than tolerance
+    """
+    new, old = timings(report), timings(baseline)
+    slower = []
+    for metric, value in new.items():
+        if metric not in old:
+            continue
+        if ".stage." in metric and max(value, old[metric]) < floor_ms:
+            continue
+        if value > old[metric] * (1 + tolerance):
+            slower.append((metric, old[metric], value))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated numbers of films")
+    parser.add_argument("--dim", type=int, default=384, help="vector size of the stub encoder")
+    parser.add_argument("--users", type=int, default=200, help="simulated users per catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": {"dim": args.dim, "users": args.users, "seed": args.seed},
+        "import_seconds": {module: import_seconds(module) for module in ("embeddings3", "server")},
+        "results": [],
+    }
+    print(f"import embeddings3 {report['import_seconds']['embeddings3']:.2f}s, "
+          f"import server {report['import_seconds']['server']:.2f}s")
+    for n_films in (int(size) for size in args.sizes.split(",")):
+        result = measure_size(n_films, args)
+        report["results"].append(result)
+        stages = ", ".join(f"{stage} {stats['p50']:.2f}" for stage, stats in result["stages_ms"].items())
+        print(f"{n_films} films: engine cold {result['startup_seconds']['engine_cold']:.1f}s, "
+              f"warm {result['startup_seconds']['engine_warm']:.1f}s | stages p50 ms: {stages} | "
+              f"/recommend p50 {result['recommend_http_ms']['p50']:.1f} ms, "
+              f"p99 {result['recommend_http_ms']['p99']:.1f} ms | batch {result['batch_users_per_second']:.0f} users/s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        for metric, old, new in slower:
+            print(f"REGRESSION {metric}: {old:.4g} -> {new:.4g}")
+        if slower:
+            sys.exit(1)
+        print(f"No regression above {args.tolerance:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+File: backend/benchmarks/worker_memory.py
+Description: resident (RSS) and proportional (PSS, shared pages divided among the processes sharing them) memory of
+each worker with `uvicorn server:app --workers N` (every worker builds its own engine) against `serve.py --workers N`
+(one engine built before the fork). Servers are started on a free port, warmed up with /recommend traffic, then
+measured from /proc/<pid>/smaps_rollup (Linux only).
+Usage (from the backend folder): python -m benchmarks.worker_memory --workers 4 [--encoder hashing]
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def children(pid):
+    """
+    return: pids of the direct children of pid
+    """
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the parent pid is the 2nd field after the ")" that closes the command name
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    found.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return found
+
+def memory_kb(pid):
+    """
+    return: dictionary with the Rss and Pss of the process, in kB
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key.lower()] = int(rest.split()[0])
+    return values
+
+def request(url, payload=None, timeout=5):
+    data = None if payload is None else json.dumps(payload).encode()
+    headers = {} if payload is None else {"Content-Type": "application/json"}
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=timeout) as r:
+        return json.loads(r.read())
+
+def wait_until_served(url, workers, timeout):
+    """
+    Wait until /ready answers 200 many times in a row, so that every worker (the kernel spreads connections over
+    them) has its engine
+    """
+    deadline, streak = time.time() + timeout, 0
+    while streak < 10 * workers:
+        if time.time() > deadline:
+            raise TimeoutError("the server did not become ready")
+        try:
+            request(f"{url}/ready")
+            streak += 1
+        except (urllib.error.URLError, ConnectionError, OSError):
+            streak = 0
+            time.sleep(0.5)
+
+def measure(command, workers, requests, timeout, env):
+    """
+    Start a server, send it traffic and measure its workers
+    return: dictionary with the memory of every worker and of the whole process tree
+    """
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(command + ["--port", str(port)], env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        wait_until_served(url, workers, timeout)
+        rng = random.Random(0)
+        actors = request(f"{url}/actor-batch")["actors"]
+        for _ in range(requests):
+            liked = rng.sample(actors, min(5, len(actors)))
+            request(f"{url}/recommend", {"liked_actors": liked, "disliked_actors": []}, timeout=60)
+        time.sleep(1)
+        # uvicorn may also start a multiprocessing helper, workers are the children that serve the app
+        worker_pids = [pid for pid in children(process.pid) if memory_kb(pid).get("rss", 0) > 50_000]
+        workers_memory = [memory_kb(pid) for pid in worker_pids]
+        parent = memory_kb(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    total_pss = parent["pss"] + sum(m["pss"] for m in workers_memory)
+    return {
+        "workers": len(workers_memory),
+        "worker_rss_mb": [m["rss"] / 1024 for m in workers_memory],
+        "worker_pss_mb": [m["pss"] / 1024 for m in workers_memory],
+        "parent_pss_mb": parent["pss"] / 1024,
+        "total_pss_mb": total_pss / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--encoder", default=os.environ.get("ENCODER", "minilm"))
+    parser.add_argument("--requests", type=int, default=50, help="/recommend calls before measuring")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the servers")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    env = {**os.environ, "ENCODER": args.encoder}
+    modes = {
+        "uvicorn --workers": [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                              "--workers", str(args.workers)],
+        "serve.py (pre-fork)": [sys.executable, "serve.py", "--host", "127.0.0.1", "--workers", str(args.workers)],
+    }
+    rows = []
+    for mode, command in modes.items():
+        rows.append({"mode": mode, **measure(command, args.workers, args.requests, args.timeout, env)})
+
+    print(f"{args.workers} workers, encoder {args.encoder}, after {args.requests} /recommend calls (MB)")
+    print(f"{'mode':>20} {'RSS/worker':>11} {'PSS/worker':>11} {'parent PSS':>11} {'total PSS':>10}")
+    for row in rows:
+        rss = sum(row["worker_rss_mb"]) / max(row["workers"], 1)
+        pss = sum(row["worker_pss_mb"]) / max(row["workers"], 1)
+        print(f"{row['mode']:>20} {rss:>11.1f} {pss:>11.1f} {row['parent_pss_mb']:>11.1f} {row['total_pss_mb']:>10.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"workers": args.workers, "encoder": args.encoder, "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -5,31 +5,50 @@ Description: this file contains the main recommendation algorithm and functions
 """
 import numpy as np
 import pandas as pd  # Manipulate data tables
-from sentence_transformers import SentenceTransformer  # Creating text embeddings
-from sklearn.metrics.pairwise import cosine_similarity  # Measuring the similarity of the embeddings
+from scipy import sparse  # Sparse films x genres matrix for the bonus scores
 import ast  # Converting string representations of Python lists or dictionaries into real Python lists or dictionaries to safely evaluate them
-from collections import Counter, defaultdict  # Some functions for working with dictionaries
+from collections import Counter, OrderedDict, defaultdict  # Some functions for working with dictionaries
+import copy
+import hashlib  # Hashing film descriptions to detect which embeddings are still valid
+import json
+import logging
+import os
 import random
+import re
+import sys
+import threading
+import time
+import zlib  # Stable hashing of tokens for the lightweight encoder
+from functools import lru_cache
 
-# Read actor and films databases
-films = pd.read_csv('final_films.csv')
-actors = pd.read_csv('top_1000.csv')
+from ann import IVFIndex
+from metrics import CATALOG_LOAD_SECONDS, RECOMMEND_BATCH_SIZE, RECOMMEND_STAGE_SECONDS
+from sampling import ActorSampler
+from vectors import (RESCORE_K, STORAGE_MODES, as_unit_rows, normalize_rows, quantize_embeddings, quantized_scores,
+                     top_k_indices)
 
-# Retrieve actors' info (c[0]=Const, c[1]=Name) and store it into actor_map dictionary
-actor_map = {}
-for c in actors.itertuples(index=False):
-    actor_map[c[0]] = c[1]
+logger = logging.getLogger(__name__)
 
-# Creates a list all_actors with shuffled actor names
-all_actors = list(actor_map.values())
-random.shuffle(all_actors)
+# Actor and films databases live next to this file
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+FILMS_CSV = os.path.join(DATA_DIR, 'final_films.csv')
+ACTORS_CSV = os.path.join(DATA_DIR, 'top_1000.csv')
 
 num_actors_to_show = 30
 
-def parse_cast(cast_str):
+def load_actor_map(actors):
+    """
+    Retrieve actors' info (c[0]=Const, c[1]=Name) and store it into a dictionary
+    param actors: actors table (top_1000.csv)
+    return: dictionary actor ID -> actor's name
+    """
+    return dict(zip(actors.iloc[:, 0], actors.iloc[:, 1]))
+
+def parse_cast(cast_str, actor_map):
     """
     Converts actor ID's from strings into Python lists
     param cast_str: a string that consists of 1 or multiple IDs (actor's personal ID numbers)
+    param actor_map: dictionary actor ID -> actor's name
     return: actor's name
     """
     try:
@@ -38,9 +57,31 @@ def parse_cast(cast_str):
     except Exception:
         return []
 
-# Creates Actor_Names column in the film table with readable actor names (instead of IDs) for the cast
-films['Actor_Names'] = films['Cast'].apply(parse_cast)
-films.columns = films.columns.str.strip()  # remove empty spaces in columns' names for easier access
+# An ID of the Cast column, like 'nm0000134' in "['nm0000134', 'nm0000197']"
+CAST_ID_PATTERN = r"""['"]([^'"]+)['"]"""
+
+def parse_cast_column(cast, actor_map):
+    """
+    Vectorized parse_cast for a whole Cast column (IDs are quoted strings, as in final_films.csv)
+    param cast: Cast column
+    param actor_map: dictionary actor ID -> actor's name
+    return: list with the actor names of each film, unknown IDs are skipped
+    """
+    ids = cast.reset_index(drop=True).astype(object).str.findall(CAST_ID_PATTERN).explode()
+    names = ids.map(actor_map).dropna()
+    # names is in film order, so the names of film i are one slice of it
+    offsets = np.searchsorted(names.index.to_numpy(dtype=np.int64), np.arange(len(cast) + 1))
+    names = names.tolist()
+    return [names[offsets[i]:offsets[i + 1]] for i in range(len(cast))]
+
+def text_column(column):
+    """
+    param column: a column of the films table
+    return: the column as strings, missing values become empty strings
+    """
+    if pd.api.types.is_numeric_dtype(column):  # a column with only missing values
+        return pd.Series("", index=column.index, dtype=object)
+    return column.astype(object).where(column.notna(), "").astype(str)
 
 def create_movie_text(row):
     """
@@ -53,13 +94,614 @@ def create_movie_text(row):
     director = row['Director'] if isinstance(row['Director'], str) else ""
     return f"Genres: {genres}. Director: {director}. Actors: {actors}."
 
-# Creates Description column in film table with str information about each film
-films['description'] = films.apply(create_movie_text, axis=1)  # specifying axis to address rows of the table
+def movie_texts(films):
+    """
+    Vectorized create_movie_text for the whole films table
+    param films: films table with Genres, Director and Actor_Names columns
+    return: column with one description per film
+    """
+    actors = films['Actor_Names'].apply(", ".join)
+    return ("Genres: " + text_column(films['Genres']) + ". Director: " + text_column(films['Director'])
+            + ". Actors: " + actors + ".")
+
+def prepare_films(films, actor_map):
+    """
+    Add the columns the recommendation algorithm works with to the raw films table
+    param films: films table as read from final_films.csv
+    param actor_map: dictionary actor ID -> actor's name
+    return: a new table with Actor_Names and description columns and a clean 0..n-1 index
+    """
+    films = films.reset_index(drop=True)
+    films.columns = films.columns.str.strip()  # remove empty spaces in columns' names for easier access
+    # Creates Actor_Names column in the film table with readable actor names (instead of IDs) for the cast
+    films['Actor_Names'] = parse_cast_column(films['Cast'], actor_map)
+    # Creates Description column in film table with str information about each film
+    films['description'] = movie_texts(films)
+    return films
+
+# Filters a request can put on the films: name -> column of final_films.csv. A request gives bounds as
+# {"min_<name>": value, "max_<name>": value}, e.g. {"max_runtime": 120, "min_year": 1990, "min_rating": 7}
+FILTER_COLUMNS = {"runtime": "Runtime", "year": "releaseYear", "rating": "AverageRating"}
+
+def build_filter_columns(films):
+    """
+    param films: films table (or its Catalog)
+    return: dictionary filter name -> float32 array with the value of each film (NaN where it is missing, or for
+    every film if the table has no such column), so that a filter is a few vectorized comparisons
+    """
+    columns = {}
+    for name, column in FILTER_COLUMNS.items():
+        if column in films:
+            values = pd.to_numeric(pd.Series(films[column]), errors='coerce').to_numpy(dtype=np.float32,
+                                                                                      na_value=np.nan)
+        else:
+            values = np.full(len(films), np.nan, dtype=np.float32)
+        columns[name] = values
+    return columns
+
+def filter_items(filters):
+    """
+    param filters: dictionary of bounds (see FILTER_COLUMNS) or None; bounds set to None are ignored
+    return: sorted tuple of the (bound, value) pairs that apply, so equivalent filters compare equal
+    """
+    return tuple(sorted((bound, value) for bound, value in (filters or {}).items() if value is not None))
+
+# A catalog delta is a table with the columns of final_films.csv (Code identifies the film) and an optional Action
+# column: "upsert" (the default) adds the film or replaces the film with the same Code, "delete" removes it.
+DELTA_ACTIONS = ("upsert", "delete")
+
+def split_delta(delta):
+    """
+    param delta: catalog delta table (see DELTA_ACTIONS)
+    return: table of the films to add or replace (without the Action column) and the set of Codes to remove
+    """
+    delta = delta.reset_index(drop=True)
+    delta.columns = delta.columns.str.strip()
+    if 'Code' not in delta.columns:
+        raise ValueError("A catalog delta needs a Code column")
+    if 'Action' not in delta.columns:
+        return delta.drop_duplicates('Code', keep='last').reset_index(drop=True), set()
+    actions = delta['Action'].fillna("upsert").astype(str).str.strip().str.lower()
+    unknown = set(actions) - set(DELTA_ACTIONS)
+    if unknown:
+        raise ValueError(f"Unknown delta actions {sorted(unknown)}, expected one of {DELTA_ACTIONS}")
+    removed = set(delta.loc[actions == "delete", 'Code'])
+    upserts = delta[actions == "upsert"].drop(columns='Action')
+    return upserts.drop_duplicates('Code', keep='last').reset_index(drop=True), removed
+
+def apply_delta_to_table(films, delta):
+    """
+    param films: raw films table (final_films.csv)
+    param delta: catalog delta table (see DELTA_ACTIONS)
+    return: the patched table, unchanged films keep their order and new or changed films are appended
+    """
+    films = films.copy()
+    films.columns = films.columns.str.strip()
+    upserts, removed = split_delta(delta)
+    kept = films[~films['Code'].isin(removed | set(upserts['Code']))]
+    return pd.concat([kept, upserts.reindex(columns=films.columns)], ignore_index=True)
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# On-disk artifact with the film embeddings, so that restarts do not re-encode the whole catalog.
+# Bump EMBEDDINGS_VERSION whenever the layout or the meaning of the stored vectors changes.
+# Version 2: vectors are stored L2-normalized.
+EMBEDDINGS_VERSION = 2
+EMBEDDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embeddings_cache')
+
+
+def description_hash(text):
+    """
+    Hash a film description, used to decide whether a stored embedding can be reused
+    param text: the description of a film (see create_movie_text)
+    return: 20 bytes sha1 digest
+    """
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def embeddings_artifact_paths(model_name, cache_dir=EMBEDDINGS_DIR, kind='films'):
+    """
+    Build the file names of the embeddings artifact for a given model
+    param model_name: name of the model that produced the vectors
+    param cache_dir: folder where the artifact is stored
+    param kind: what the vectors are ('films' descriptions or 'entities' queries)
+    return: paths of the vectors (.npy), the description hashes (.npy) and the manifest (.json)
+    """
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+    base = os.path.join(cache_dir, f"{kind}-{safe_name}-v{EMBEDDINGS_VERSION}")
+    return base + '.npy', base + '.hashes.npy', base + '.json'
+
+
+def load_embeddings_artifact(model_name, cache_dir=EMBEDDINGS_DIR, kind='films'):
+    """
+    Load a previously saved embeddings artifact as a read-only memory map
+    param model_name: name of the model that produced the vectors
+    param cache_dir: folder where the artifact is stored
+    param kind: what the vectors are ('films' or 'entities')
+    return: (vectors, hashes) or (None, None) if there is no valid artifact for this model and version
+    """
+    vectors_path, hashes_path, manifest_path = embeddings_artifact_paths(model_name, cache_dir, kind)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != EMBEDDINGS_VERSION or manifest.get('model') != model_name:
+            return None, None
+        vectors = np.load(vectors_path, mmap_mode='r')
+        hashes = np.load(hashes_path)
+    except (OSError, ValueError):
+        return None, None
+    if len(vectors) != len(hashes) or len(vectors) != manifest.get('count'):
+        return None, None  # a half written or foreign artifact, rebuild it
+    return vectors, hashes
+
+
+def _save_atomically(path, array):
+    """
+    Write a numpy array next to its final location and move it in place, so readers never see a partial file
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def save_embeddings_artifact(vectors, hashes, model_name, cache_dir=EMBEDDINGS_DIR, kind='films'):
+    """
+    Store film vectors and the hashes of the descriptions they were computed from
+    param vectors: 2D array, one row per film
+    param hashes: 1D array of description hashes (same order as vectors)
+    param model_name: name of the model that produced the vectors
+    param cache_dir: folder where the artifact is stored
+    param kind: what the vectors are ('films' or 'entities')
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    vectors_path, hashes_path, manifest_path = embeddings_artifact_paths(model_name, cache_dir, kind)
+    _save_atomically(vectors_path, np.ascontiguousarray(vectors, dtype=np.float32))
+    _save_atomically(hashes_path, hashes)
+    manifest = {"version": EMBEDDINGS_VERSION, "model": model_name,
+                "count": int(len(vectors)), "dim": int(vectors.shape[1])}
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)  # the manifest goes last, it is what marks the artifact as complete
+
+
+def load_or_encode_embeddings(descriptions, encode, model_name, cache_dir=EMBEDDINGS_DIR, kind='films'):
+    """
+    Return one vector per description, reusing the stored artifact and only encoding new or changed descriptions
+    param descriptions: list of film descriptions
+    param encode: function that turns a list of texts into a 2D array of vectors
+    param model_name: name of the model behind encode (part of the artifact key)
+    param cache_dir: folder where the artifact is stored
+    param kind: what the vectors are ('films' or 'entities'), each kind has its own artifact
+    return: read-only memory mapped array with the film vectors
+    """
+    hashes = np.array([description_hash(text) for text in descriptions], dtype='S20')
+    old_vectors, old_hashes = load_embeddings_artifact(model_name, cache_dir, kind)
+
+    # Nothing changed since the last run, startup only costs the file I/O
+    if old_vectors is not None and np.array_equal(old_hashes, hashes):
+        return old_vectors
+
+    # Map each stored description hash to its row in the old artifact
+    old_rows = {} if old_hashes is None else {h: i for i, h in enumerate(old_hashes.tolist())}
+    hash_list = hashes.tolist()
+    reuse_positions = [i for i, h in enumerate(hash_list) if h in old_rows]
+    missing_positions = [i for i, h in enumerate(hash_list) if h not in old_rows]
+
+    new_vectors = None
+    if missing_positions:
+        new_vectors = np.asarray(encode([descriptions[i] for i in missing_positions]), dtype=np.float32)
+    dim = old_vectors.shape[1] if old_vectors is not None else new_vectors.shape[1]
+
+    vectors = np.empty((len(descriptions), dim), dtype=np.float32)
+    if reuse_positions:
+        vectors[reuse_positions] = old_vectors[[old_rows[hash_list[i]] for i in reuse_positions]]
+    if missing_positions:
+        vectors[missing_positions] = new_vectors
+
+    save_embeddings_artifact(vectors, hashes, model_name, cache_dir, kind)
+    reloaded, _ = load_embeddings_artifact(model_name, cache_dir, kind)
+    return reloaded if reloaded is not None else vectors
+
+
+# Preprocessed catalog cache: the films table as prepare_films returns it, with the cast, genres and directors
+# stored as integer codes, so restarts skip CSV parsing. It is rebuilt whenever one of the CSV files changes.
+# Bump CATALOG_VERSION whenever the layout of the cache changes.
+CATALOG_VERSION = 2
+_STRING_SEPARATOR = "\x1f"  # ASCII unit separator, strings are stored joined by it in one UTF-8 buffer
+
+def files_fingerprint(*paths):
+    """
+    return: hex digest of the content of the files
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def catalog_cache_path(films_path, cache_dir=EMBEDDINGS_DIR):
+    """
+    return: path of the preprocessed catalog cache of the films CSV
+    """
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.splitext(os.path.basename(films_path))[0])
+    return os.path.join(cache_dir, f"catalog-{safe_name}-v{CATALOG_VERSION}.npz")
+
+def _pack_strings(values):
+    """
+    return: the strings as one UTF-8 byte array (decoded back by _unpack_strings)
+    """
+    values = list(map(str, values.tolist() if isinstance(values, pd.Series) else values))
+    joined = _STRING_SEPARATOR.join(values)
+    if joined.count(_STRING_SEPARATOR) != max(len(values) - 1, 0):
+        raise ValueError("Catalog strings cannot contain the \\x1f character")
+    return np.frombuffer(joined.encode('utf-8'), dtype=np.uint8)
+
+def _unpack_strings(data, count):
+    """
+    return: list of the count strings packed by _pack_strings
+    """
+    if count == 0:
+        return []
+    return data.tobytes().decode('utf-8').split(_STRING_SEPARATOR)
+
+# Arrays of catalog_arrays, besides the column_<i> and missing_<i> ones
+_CATALOG_ARRAYS = ("columns", "n_columns", "actor_names", "n_actor_names", "cast_codes", "cast_offsets", "description")
+
+def catalog_arrays(films):
+    """
+    param films: table returned by prepare_films
+    return: dictionary of NumPy arrays holding the whole table (read back by catalog_frame): numeric columns as they
+    are, text columns packed (see _pack_strings) with their missing values marked, casts as integer codes
+    """
+    arrays = {}
+    raw_columns = [c for c in films.columns if c not in ('Actor_Names', 'description')]
+    arrays["columns"], arrays["n_columns"] = _pack_strings(raw_columns), len(raw_columns)
+    for i, column in enumerate(raw_columns):
+        values = films[column]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays[f"column_{i}"] = values.to_numpy()
+        else:
+            arrays[f"column_{i}"] = _pack_strings(text_column(values))
+            arrays[f"missing_{i}"] = values.isna().to_numpy()
 
-# Generate vectors from movies' descriptions using a pretrained model and store them in embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')
-embeddings = model.encode(films['description'].tolist(), show_progress_bar=True)
-embeddings = np.array(embeddings)
+    # Cast as integer codes into a vocabulary of actor names: film i has codes[offsets[i]:offsets[i + 1]]
+    actor_names, cast_codes = extend_index({}, np.array([a for names in films['Actor_Names'] for a in names],
+                                                        dtype=object))
+    arrays["actor_names"], arrays["n_actor_names"] = _pack_strings(actor_names), len(actor_names)
+    arrays["cast_codes"] = cast_codes.astype(np.int32)
+    arrays["cast_offsets"] = np.concatenate([[0], np.cumsum(films['Actor_Names'].map(len).to_numpy(dtype=np.int64))])
+    arrays["description"] = _pack_strings(films['description'])
+    return arrays
+
+def _catalog_column(arrays, i, n_films):
+    """
+    return: column i of the arrays of catalog_arrays, as an array (numbers) or a list (text, None where missing)
+    """
+    if f"missing_{i}" in arrays:
+        values = _unpack_strings(arrays[f"column_{i}"], n_films)
+        for j in np.flatnonzero(arrays[f"missing_{i}"]):
+            values[j] = None
+        return values
+    return arrays[f"column_{i}"]
+
+def _catalog_casts(arrays, n_films):
+    """
+    return: list with the list of actor names of each film, from the arrays of catalog_arrays
+    """
+    names = np.array(_unpack_strings(arrays['actor_names'], int(arrays['n_actor_names'])), dtype=object)
+    cast = names[arrays['cast_codes']].tolist()
+    offsets = arrays['cast_offsets']
+    return [cast[offsets[i]:offsets[i + 1]] for i in range(n_films)]
+
+def catalog_frame(arrays, n_films):
+    """
+    param arrays: dictionary returned by catalog_arrays (or an .npz file holding it)
+    param n_films: number of films
+    return: the films table, as prepare_films returned it
+    """
+    raw_columns = _unpack_strings(arrays['columns'], int(arrays['n_columns']))
+    films = {}
+    for i, column in enumerate(raw_columns):
+        values = _catalog_column(arrays, i, n_films)
+        films[column] = pd.Series(values) if isinstance(values, list) else values
+    films = pd.DataFrame(films, index=pd.RangeIndex(n_films))
+    films['Actor_Names'] = _catalog_casts(arrays, n_films)
+    films['description'] = pd.Series(_unpack_strings(arrays['description'], n_films))
+    return films
+
+
+class Catalog:
+    """
+    Films table as the engine keeps it once built, without pandas: the arrays of catalog_arrays (under 1 MB for
+    final_films.csv, where the DataFrame holds a Python object per cell) and the titles interned, each distinct title
+    stored once and every film holding its code. Requests only read titles (records); the paths that need the whole
+    table (catalog deltas, evaluation) rebuild it with to_frame.
+    """
+    __slots__ = ("n_films", "arrays", "columns", "titles", "title_codes")
+
+    def __init__(self, arrays, n_films):
+        """
+        param arrays: dictionary returned by catalog_arrays
+        param n_films: number of films
+        """
+        self.n_films = n_films
+        self.arrays = arrays
+        self.columns = _unpack_strings(arrays['columns'], int(arrays['n_columns']))
+        title_index, title_codes = extend_index({}, np.array(self.column('Title'), dtype=object))
+        self.titles = list(title_index)
+        self.title_codes = title_codes.astype(np.int32)
+
+    @classmethod
+    def from_frame(cls, films):
+        """
+        param films: table returned by prepare_films (any table with Title, Actor_Names and description columns)
+        return: its Catalog
+        """
+        return cls(catalog_arrays(films.reset_index(drop=True)), len(films))
+
+    def __len__(self):
+        return self.n_films
+
+    def __contains__(self, column):
+        return column in self.columns or column in ('Actor_Names', 'description')
+
+    def __getitem__(self, column):
+        """
+        return: the values of a column (see column), so that a catalog reads like a table where only columns are needed
+        """
+        if column == 'Actor_Names':
+            return self.casts()
+        if column == 'description':
+            return _unpack_strings(self.arrays['description'], self.n_films)
+        return self.column(column)
+
+    def column(self, name):
+        """
+        param name: name of a raw column of the table (see casts for Actor_Names)
+        return: array of its values (numbers) or list of strings (text, None where missing)
+        """
+        if name not in self.columns:
+            raise KeyError(name)
+        return _catalog_column(self.arrays, self.columns.index(name), self.n_films)
+
+    def casts(self):
+        """
+        return: list with the list of actor names of each film (Actor_Names)
+        """
+        return _catalog_casts(self.arrays, self.n_films)
+
+    def records(self, positions):
+        """
+        param positions: positions of films
+        return: list of {"Title": title} records of these films, in the same order (the JSON of the responses)
+        """
+        titles = self.titles
+        return [{"Title": titles[code]} for code in self.title_codes[positions].tolist()]
+
+    def to_frame(self):
+        """
+        return: the whole films table, rebuilt (about 10 ms for final_films.csv)
+        """
+        return catalog_frame(self.arrays, self.n_films)
+
+def save_catalog_cache(path, films, actor_map, indexes, fingerprint):
+    """
+    Store a prepared films table and its indexes in a single .npz file (written atomically)
+    param films: table returned by prepare_films
+    param actor_map: dictionary actor ID -> actor's name
+    param indexes: dictionary with genre_index, genre_matrix, director_index, film_directors and the entity indexes
+    (see build_entity_indexes)
+    param fingerprint: identifies the CSV files the catalog was read from
+    """
+    arrays = {"version": CATALOG_VERSION, "fingerprint": fingerprint, "n_films": len(films)}
+    arrays.update(catalog_arrays(films))
+    arrays["actor_ids"] = _pack_strings(actor_map.keys())
+    arrays["actor_map_names"] = _pack_strings(actor_map.values())
+    arrays["n_actors"] = len(actor_map)
+
+    genre_matrix = indexes["genre_matrix"].tocsr()
+    arrays["genres"], arrays["n_genres"] = _pack_strings(indexes["genre_index"]), len(indexes["genre_index"])
+    arrays["genre_indptr"], arrays["genre_indices"] = genre_matrix.indptr, genre_matrix.indices
+    arrays["genre_counts"] = genre_matrix.data
+    arrays["directors"] = _pack_strings(indexes["director_index"])
+    arrays["n_directors"] = len(indexes["director_index"])
+    arrays["film_directors"] = indexes["film_directors"]
+
+    arrays["entity_actor_names"] = _pack_strings(indexes["actor_names"])
+    arrays["n_entity_actors"] = len(indexes["actor_names"])
+    if indexes["actor_ids"] is not None:
+        arrays["entity_actor_ids"] = _pack_strings(indexes["actor_ids"])
+    arrays["director_names"] = _pack_strings(indexes["director_names"])
+    arrays["n_director_names"] = len(indexes["director_names"])
+    for name in ENTITY_POSTING_LISTS:
+        arrays[f"{name}_offsets"], arrays[f"{name}_items"] = indexes[name].offsets, indexes[name].items
+        if indexes[name].counts is not None:
+            arrays[f"{name}_counts"] = indexes[name].counts
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def load_catalog_cache(path, fingerprint=None, compact=False):
+    """
+    param path: file written by save_catalog_cache
+    param fingerprint: when given, the cache is only used if it was built from the same CSV files
+    param compact: give the films as a Catalog read from the arrays of the file, without building the table
+    return: (films table, actor map, indexes) like load_catalog, or None if there is no valid cache at path
+    """
+    try:
+        with np.load(path) as data:
+            if int(data['version']) != CATALOG_VERSION:
+                return None
+            if fingerprint is not None and str(data['fingerprint']) != fingerprint:
+                return None
+            n_films = int(data['n_films'])
+            if compact:
+                films = Catalog({name: data[name] for name in data.files if name in _CATALOG_ARRAYS
+                                 or name.startswith(("column_", "missing_"))}, n_films)
+            else:
+                films = catalog_frame(data, n_films)
+            n_actors = int(data['n_actors'])
+            actor_map = dict(zip(_unpack_strings(data['actor_ids'], n_actors),
+                                 _unpack_strings(data['actor_map_names'], n_actors)))
+            genres = _unpack_strings(data['genres'], int(data['n_genres']))
+            genre_matrix = sparse.csr_matrix((data['genre_counts'], data['genre_indices'], data['genre_indptr']),
+                                             shape=(n_films, len(genres)))
+            directors = _unpack_strings(data['directors'], int(data['n_directors']))
+            indexes = {
+                "genre_index": {g: i for i, g in enumerate(genres)},
+                "genre_matrix": genre_matrix,
+                "director_index": {d: i for i, d in enumerate(directors)},
+                "film_directors": data['film_directors'],
+            }
+
+            n_entity_actors = int(data['n_entity_actors'])
+            indexes["actor_names"] = np.array(_unpack_strings(data['entity_actor_names'], n_entity_actors),
+                                              dtype=object)
+            indexes["actor_ids"] = (np.array(_unpack_strings(data['entity_actor_ids'], n_entity_actors), dtype=object)
+                                    if "entity_actor_ids" in data else None)
+            indexes["director_names"] = np.array(_unpack_strings(data['director_names'],
+                                                                 int(data['n_director_names'])), dtype=object)
+            for name in ENTITY_POSTING_LISTS:
+                counts = data[f"{name}_counts"] if f"{name}_counts" in data else None
+                indexes[name] = PostingLists(data[f"{name}_offsets"], data[f"{name}_items"], counts)
+            return films, actor_map, indexes
+    except (OSError, KeyError, ValueError):
+        return None
+
+def load_catalog(films_path=FILMS_CSV, actors_path=ACTORS_CSV, cache_dir=EMBEDDINGS_DIR, compact=False):
+    """
+    Read and prepare the catalog, from the preprocessed cache when the CSV files did not change
+    param films_path, actors_path: paths to final_films.csv and top_1000.csv
+    param cache_dir: folder of the catalog cache (no cache is used if None)
+    param compact: return the films as a Catalog; read from the cache, the table is then never built
+    return: (films table as prepare_films returns it, actor map, dictionary of the genre / director / entity indexes
+    that RecommenderEngine takes)
+    """
+    if cache_dir is not None:
+        fingerprint = files_fingerprint(films_path, actors_path)
+        path = catalog_cache_path(films_path, cache_dir)
+        cached = load_catalog_cache(path, fingerprint, compact)
+        if cached is not None:
+            return cached
+
+    actor_map = load_actor_map(pd.read_csv(actors_path))
+    films = prepare_films(pd.read_csv(films_path), actor_map)
+    genre_index, genre_matrix = build_genre_matrix(films)
+    director_index, film_directors = build_director_index(films)
+    indexes = {"genre_index": genre_index, "genre_matrix": genre_matrix,
+               "director_index": director_index, "film_directors": film_directors}
+    indexes.update(build_entity_indexes(films, genre_index, director_index, film_directors, actor_map))
+    if cache_dir is not None:
+        save_catalog_cache(path, films, actor_map, indexes, fingerprint)
+    return (Catalog.from_frame(films) if compact else films), actor_map, indexes
+
+def embeddings_fingerprint(descriptions):
+    """
+    param descriptions: list of film descriptions, in catalog order
+    return: hex digest identifying the film embeddings (changes when any film or their order changes)
+    """
+    digest = hashlib.sha1()
+    for text in descriptions:
+        digest.update(description_hash(text))
+    return digest.hexdigest()
+
+def ann_index_path(model_name, n_lists, cache_dir=EMBEDDINGS_DIR):
+    """
+    return: path of the ANN index file, next to the embeddings artifact of the same model
+    """
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+    return os.path.join(cache_dir, f"ann-{safe_name}-v{EMBEDDINGS_VERSION}-{n_lists}.npz")
+
+def load_model(model_name=MODEL_NAME):
+    """
+    Load the pretrained sentence embedding model
+    param model_name: name of the SentenceTransformer model
+    return: the model
+    """
+    # Imported here and not at the top: pulling in torch takes seconds and is only needed once the engine is built
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+# Encoders turn a list of texts into a 2D array of vectors with encode(texts). Every encoder has a name, which is
+# also the key of its embeddings artifacts (vectors of different encoders are never mixed).
+
+class SentenceTransformerEncoder:
+    """
+    The pretrained all-MiniLM-L6-v2 model (needs torch and the model weights)
+    """
+
+    def __init__(self, model_name=MODEL_NAME):
+        self.name = model_name
+        self.model = load_model(model_name)
+
+    def encode(self, texts, show_progress_bar=False):
+        return self.model.encode(texts, show_progress_bar=show_progress_bar)
+
+# Words of the query and description templates that say nothing about a film
+HASHING_STOP_WORDS = frozenset(["movies", "movie", "featuring", "actors", "like", "directed", "by", "director",
+                                "in", "genres", "generic", "query"])
+
+@lru_cache(maxsize=1 << 16)
+def _hashed_feature(feature, dim):
+    """
+    return: (column, sign) of a token or word pair, stable between processes (unlike hash())
+    """
+    h = zlib.crc32(feature.encode('utf-8'))
+    return h % dim, 1.0 if (h // dim) % 2 == 0 else -1.0
+
+class HashingEncoder:
+    """
+    Lightweight encoder in pure NumPy/SciPy: a hashed bag of words and of neighbouring word pairs
+    (so that "Tom Hanks" and "Tom Cruise" only share half of their features).
+    It needs no torch and no model weights, which keeps workers small and lets the tests run offline.
+    """
+
+    def __init__(self, dim=1024):
+        """
+        param dim: number of hashed features (length of the vectors)
+        """
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def features(self, text):
+        """
+        param text: a description or a query
+        return: list of words and word pairs, pairs never cross a comma or a period (they separate names)
+        """
+        features = []
+        for phrase in re.split(r'[,.:;]', text.lower()):
+            words = [w for w in re.findall(r"[\w'-]+", phrase) if w not in HASHING_STOP_WORDS]
+            features.extend(words)
+            features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        return features
+
+    def encode(self, texts, show_progress_bar=False):
+        rows, columns, values = [], [], []
+        for i, text in enumerate(texts):
+            for feature, count in Counter(self.features(text)).items():
+                column, sign = _hashed_feature(feature, self.dim)
+                rows.append(i)
+                columns.append(column)
+                values.append(sign * (1.0 + np.log(count)))  # sublinear term frequency
+        matrix = sparse.csr_matrix((values, (rows, columns)), shape=(len(texts), self.dim), dtype=np.float32)
+        return normalize_rows(matrix.toarray())
+
+ENCODERS = {"minilm": SentenceTransformerEncoder, "hashing": HashingEncoder}
+
+def load_encoder(name="minilm"):
+    """
+    param name: backend name, a key of ENCODERS
+    return: the encoder
+    """
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder {name!r}, expected one of {sorted(ENCODERS)}")
+    return ENCODERS[name]()
 
 def build_actor_mapping(database):
     """
@@ -71,105 +713,1345 @@ def build_actor_mapping(database):
     actor_to_directors = defaultdict(set)  # a set to avoid repeating directors
     actor_to_genres = defaultdict(list)  # a list so that the same genre could appear twice
 
-    # Map actors to directors and genres
-    for j, row in database.iterrows():
-        for actor in row['Actor_Names']:
-            if isinstance(row['Director'], str):
-                for d in [director.strip() for director in row['Director'].split(",") if director.strip()]:  # some movies have more than 1 director
-                    actor_to_directors[actor].add(d)
-            if isinstance(row['Genres'], str):
-                for g in [genre.strip() for genre in row['Genres'].split(",") if genre.strip()]:
-                    actor_to_genres[actor].append(g)
+    # One row per (film, actor) and per (film, genre / director), joined on the film
+    actors = pd.DataFrame({'film': np.repeat(np.arange(len(database)),
+                                               database['Actor_Names'].map(len).to_numpy(dtype=np.int64)),
+                           'actor': [actor for names in database['Actor_Names'] for actor in names]})
+    for column, mapping in (('Director', actor_to_directors), ('Genres', actor_to_genres)):
+        rows, values = explode_field(database[column])  # some movies have more than 1 director
+        pairs = actors.merge(pd.DataFrame({'film': rows, 'value': values}), on='film', sort=False)
+        # A stable sort by actor keeps the film order inside each actor, so genres come in table order
+        codes, names = pd.factorize(pairs['actor'])
+        order = np.argsort(codes, kind='stable')
+        grouped = pairs['value'].to_numpy()[order].tolist()
+        offsets = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        for k, actor in enumerate(names):
+            part = grouped[offsets[k]:offsets[k + 1]]
+            mapping[actor] = set(part) if mapping is actor_to_directors else part
 
     return actor_to_directors, actor_to_genres
 
-actor_to_directors, actor_to_genres = build_actor_mapping(films)
+def split_field(value):
+    """
+    Split a comma separated field of the films table (Genres, Director)
+    param value: the field, anything else than a string counts as empty
+    return: list of the non empty, stripped parts
+    """
+    if not isinstance(value, str):
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+def explode_field(column):
+    """
+    Vectorized split_field for a whole column
+    param column: Genres or Director column
+    return: (array of film positions, array of the stripped parts), one entry per part in table order
+    """
+    parts = text_column(column.reset_index(drop=True)).str.split(",").explode().str.strip()
+    parts = parts[parts.notna() & (parts != "")]
+    return parts.index.to_numpy(dtype=np.int64), parts.to_numpy(dtype=object)
+
+def extend_index(index, values):
+    """
+    param index: dictionary value -> code, copied and extended with the new values in order of appearance
+    param values: array of values
+    return: (the extended dictionary, array with the code of each value)
+    """
+    index = dict(index or {})
+    for value in pd.unique(values):
+        index.setdefault(value, len(index))
+    return index, pd.Index(list(index)).get_indexer(values).astype(np.int64)
+
+def build_genre_matrix(database, genre_index=None):
+    """
+    Build a films x genres indicator matrix, so genre bonuses become one sparse matrix-vector product
+    :param database: main movie dataset
+    :param genre_index: existing dictionary genre -> column to extend (a copy is made), for catalog deltas
+    :return: dictionary genre -> column and a sparse matrix (a film listing a genre twice counts it twice)
+    """
+    rows, genres = explode_field(database['Genres'])
+    genre_index, columns = extend_index(genre_index, genres)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(database), len(genre_index)))
+    return genre_index, matrix
+
+def build_director_index(database, director_index=None):
+    """
+    Give every distinct Director value an integer code
+    :param database: main movie dataset
+    :param director_index: existing dictionary Director value -> code to extend (a copy is made), for catalog deltas
+    :return: dictionary Director value -> code and an array with the code of each film (-1 if missing)
+    """
+    directors = database['Director'].reset_index(drop=True).astype(object)
+    known = np.flatnonzero(directors.map(lambda d: isinstance(d, str)).to_numpy(dtype=bool))
+    director_index, codes = extend_index(director_index, directors.to_numpy()[known])
+    film_directors = np.full(len(database), -1, dtype=np.int32)
+    film_directors[known] = codes
+    return director_index, film_directors
+
+class PostingLists:
+    """
+    Integer-coded inverted index in compressed sparse row layout: the items of key k are
+    items[offsets[k]:offsets[k + 1]], so lookups are NumPy slicing instead of dictionaries of Python lists
+    """
+
+    def __init__(self, offsets, items, counts=None):
+        """
+        param offsets: 1D int64 array with one more entry than there are keys
+        param items: 1D int32 array with the items of all keys, grouped by key
+        param counts: optional 1D array with a count for each item
+        """
+        self.offsets = offsets
+        self.items = items
+        self.counts = counts
+
+    @classmethod
+    def from_pairs(cls, keys, items, n_keys, counts=None):
+        """
+        param keys, items: arrays with one (key, item) pair per entry, the items of a key keep their order
+        param n_keys: number of keys (keys without items get an empty list)
+        param counts: optional array with a count for each pair
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=n_keys))]).astype(np.int64)
+        return cls(offsets, np.asarray(items, dtype=np.int32)[order],
+                   None if counts is None else np.asarray(counts, dtype=np.int32)[order])
+
+    @classmethod
+    def distinct(cls, lists, items_of):
+        """
+        Posting lists of the distinct items reached through another index, e.g. the genres of each actor's films
+        param lists: PostingLists key -> intermediate items (e.g. actor -> films)
+        param items_of: PostingLists intermediate item -> items (e.g. film -> genres)
+        return: PostingLists key -> distinct items in order of first appearance, with how often each appears
+        """
+        lengths = np.diff(items_of.offsets)[lists.items]
+        keys = np.repeat(np.repeat(np.arange(len(lists)), np.diff(lists.offsets)), lengths)
+        items = items_of.gather(lists.items)
+        n_items = int(items.max()) + 1 if len(items) else 1
+        _, first, counts = np.unique(keys * n_items + items, return_index=True, return_counts=True)
+        order = np.argsort(first)  # keys are grouped, so this is also first appearance within each key
+        return cls.from_pairs(keys[first[order]], items[first[order]], len(lists), counts[order])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        return self.items[self.offsets[key]:self.offsets[key + 1]]
+
+    def positions(self, keys):
+        """
+        param keys: array of keys (a key given twice counts twice)
+        return: positions in items of the items of all the keys, in the order of keys
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        starts = self.offsets[keys]
+        lengths = self.offsets[keys + 1] - starts
+        ends = lengths.cumsum()
+        # Position of every gathered item: its rank in the output plus the shift of its key
+        return np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+    def gather(self, keys):
+        """
+        param keys: array of keys (a key given twice counts twice)
+        return: the items of all the keys concatenated, in the order of keys
+        """
+        return self.items[self.positions(keys)]
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.items.nbytes + (0 if self.counts is None else self.counts.nbytes)
+
+def build_entity_indexes(database, genre_index, director_index, film_directors, actor_map=None):
+    """
+    Integer-coded inverted indexes of the films table, used to build the preferences of a user
+    :param database: main movie dataset
+    :param genre_index, director_index, film_directors: see build_genre_matrix and build_director_index
+    :param actor_map: dictionary actor ID -> actor's name; when given and the table has a Cast column, actors are
+    identified by ID so that two actors sharing a name stay apart, otherwise by name
+    :return: dictionary with
+        actor_names: array actor code -> name, actor_ids: array actor code -> ID (None when keyed by name),
+        actor_films: PostingLists actor code -> films (once per listing in the cast, in table order),
+        actor_genres: PostingLists actor code -> genre codes (columns of the genre matrix) of their films, in order
+        of first appearance, with the number of times each one appears (the old actor_to_genres lists as a histogram),
+        director_names: array director code -> name (Director split on commas),
+        actor_directors: PostingLists actor code -> director codes of their films,
+        director_films: PostingLists Director value code -> films (for the director bonus)
+    """
+    n_films = len(database)
+    by_id = actor_map is not None and 'Cast' in database
+    if by_id:
+        ids = database['Cast'].reset_index(drop=True).astype(object).str.findall(CAST_ID_PATTERN).explode()
+        ids = ids[ids.isin(actor_map.keys())]
+        film_positions, keys = ids.index.to_numpy(dtype=np.int64), ids.to_numpy(dtype=object)
+    else:
+        film_positions = np.repeat(np.arange(n_films), database['Actor_Names'].map(len).to_numpy(dtype=np.int64))
+        keys = np.array([actor for names in database['Actor_Names'] for actor in names], dtype=object)
+    actor_index, actor_codes = extend_index({}, keys)
+    actor_names = np.array([actor_map[key] for key in actor_index] if by_id else list(actor_index), dtype=object)
+
+    genre_films, genres = explode_field(database['Genres'])
+    genre_codes = pd.Index(list(genre_index)).get_indexer(genres)
+    director_film_positions, directors = explode_field(database['Director'])
+    names_index, director_codes = extend_index({}, directors)
+    known = np.flatnonzero(film_directors >= 0)
+    actor_films = PostingLists.from_pairs(actor_codes, film_positions, len(actor_index))
+    film_genres = PostingLists.from_pairs(genre_films, genre_codes, n_films)
+    film_director_codes = PostingLists.from_pairs(director_film_positions, director_codes, n_films)
+    return {
+        "actor_names": actor_names,
+        "actor_ids": np.array(list(actor_index), dtype=object) if by_id else None,
+        "actor_films": actor_films,
+        "actor_genres": PostingLists.distinct(actor_films, film_genres),
+        "director_names": np.array(list(names_index), dtype=object),
+        "actor_directors": PostingLists.distinct(actor_films, film_director_codes),
+        "director_films": PostingLists.from_pairs(film_directors[known], known, len(director_index)),
+    }
+
+ENTITY_POSTING_LISTS = ("actor_films", "actor_genres", "actor_directors", "director_films")
+
+def build_actor_lookup(actor_names, actor_ids=None):
+    """
+    param actor_names, actor_ids: see build_entity_indexes
+    return: dictionary actor name or ID -> (name, tuple of actor codes); a name shared by several actors stands for
+    all of them, an ID for exactly one
+    """
+    actor_lookup = {}
+    for code, name in enumerate(actor_names.tolist()):
+        actor_lookup[name] = (name, actor_lookup.get(name, (name, ()))[1] + (code,))
+    if actor_ids is not None:
+        actor_lookup.update((key, (name, (code,))) for code, (key, name) in enumerate(zip(actor_ids.tolist(),
+                                                                                          actor_names.tolist())))
+    return actor_lookup
+
+# Query used when the user neither liked nor disliked anyone
+GENERIC_QUERY = "generic movie query"
+
+def actors_query(actor_names):
+    return f"Movies featuring actors like {', '.join(actor_names)}."
+
+def directors_query(directors):
+    return f"Movies directed by {', '.join(directors)}."
+
+def genres_query(genres):
+    return f"Movies in genres like {', '.join(genres)}."
+
+# How the query vectors of a request are obtained:
+# "encode" runs the model on the query texts, "precomputed" averages vectors computed once per actor, director and
+# genre at build time, so requests never run the model
+QUERY_MODES = ("encode", "precomputed")
+QUERY_CACHE_SIZE = 4096
+# Number of users scored together by rank_batch, bounds the (users x films) score matrix in memory
+SCORE_CHUNK_SIZE = 64
+# Recommendation tables kept by the ResultCache of an engine, and for how many seconds
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_TTL = 600
+# Per-signal score vectors kept by the signal cache of an engine (see SignalScores, about 20 bytes per film each)
+SIGNAL_CACHE_SIZE = 500
+# Weights of the signals of a recommendation, see RecommenderEngine.preference_vector
+DEFAULT_WEIGHTS = {
+    "liked_actors": 1.8,
+    "disliked_actors": 0.6,
+    "genres": 0.6,
+    "directors": 0.7,
+    "bonus_genre_director": 0.1  # how much the extra bonuses affect score
+}
+# How often each actor is shown (see RecommenderEngine.actor_weights): in proportion to their number of films, to the
+# sum of the ratings of their films, or uniformly
+ACTOR_WEIGHTINGS = ("films", "rating", "uniform")
+
+class QueryCache:
+    """
+    Bounded LRU cache of query vectors, keyed on the exact query text.
+    Popular swipe combinations produce the same queries, so their vectors are reused instead of re-encoded.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        """
+        param maxsize: maximum number of vectors kept, the least recently used one is dropped first
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()  # requests are served from several threads
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def get(self, text):
+        """
+        param text: query text
+        return: the cached vector or None (counts a hit or a miss)
+        """
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def put(self, text, vector):
+        """
+        param text: query text
+        param vector: 1D vector of the query
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._vectors[text] = vector
+            self._vectors.move_to_end(text)
+            while len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+
+    def stats(self):
+        """
+        return: dictionary with the number of hits, misses and cached vectors
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._vectors), "maxsize": self.maxsize}
 
-def get_actor():
+def cached_copy(result):
     """
-    Retrieve a random actor's name from the shuffled list of all actors.
+    param result: value stored in or read from a ResultCache
+    return: a shallow copy of it, or the result itself when it is a read-only array that nobody can change
+    """
+    if isinstance(result, np.ndarray) and not result.flags.writeable:
+        return result
+    return copy.copy(result)
+
+class ResultCache:
+    """
+    Bounded LRU cache of recommendations (ranked film positions) that also expire after ttl seconds, keyed on
+    result_key(request). Everyone swipes on the same actors, so the same swipe sets come back often and are answered
+    without scoring.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, clock=time.monotonic):
+        """
+        param maxsize: maximum number of results kept, the least recently used one is dropped first (0 disables)
+        param ttl: seconds a result stays valid (0 disables)
+        param clock: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()  # key -> (expiry time, result)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key, count_miss=True):
+        """
+        param key: result_key of a request
+        param count_miss: False for a first look that is followed by a counted one when it misses
+        return: a (shallow) copy of the cached result (read-only arrays are shared), or None when there is none or
+        it expired
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._results[key]
+                entry = None
+            if entry is None:
+                self.misses += count_miss
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+        return cached_copy(entry[1])
+
+    def put(self, key, result):
+        """
+        param key: result_key of a request
+        param result: its recommendations (a shallow copy is kept, callers may change theirs; read-only arrays are
+        kept as they are)
+        """
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._results[key] = (self.clock() + self.ttl, cached_copy(result))
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """
+        return: dictionary with the number of hits, misses and cached results
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._results), "maxsize": self.maxsize,
+                "ttl": self.ttl}
+
+def result_key(request):
+    """
+    param request: dictionary with liked_actors, disliked_actors, weights, top_k and optionally filters
+    return: hashable key of everything the recommendations of the request depend on (for a given engine); swipes
+    are taken in the given order, see canonical_swipes to make equivalent swipe sets share a key
+    """
+    return (tuple(request["liked_actors"]), tuple(request["disliked_actors"]),
+            tuple(sorted(request["weights"].items())), request["top_k"], filter_items(request.get("filters")))
+
+class SignalScores:
+    """
+    Score of every film against each query of one set of swipes, before any weighting. The preference is
+    sum_s sign_s * w_s * q_s, so its similarity with a film is a weighted sum of the columns of scores divided by the
+    norm of the preference, which the Gram matrix of the queries gives without touching the film vectors:
+    |p|^2 = c^T G c. Changing the weights is then a (films x 4) @ 4 product and a top-k.
+    """
+
+    SIGNALS = ("liked_actors", "disliked_actors", "directors", "genres")
+    SIGNS = {"liked_actors": 1.0, "disliked_actors": -1.0, "directors": 1.0, "genres": 1.0, "generic": 1.0}
+
+    def __init__(self, signals, queries, scores, bonus):
+        """
+        param signals: names of the queries ("generic" alone for swipes without preferences)
+        param queries: 2D array with the query vector of each signal
+        param scores: 2D float32 array (films x signals), film vectors @ queries.T
+        param bonus: float32 array with the genre / director bonus of each film
+        """
+        self.signals = signals
+        self.queries = queries
+        self.gram = queries @ queries.T
+        self.scores = scores
+        self.bonus = bonus
+        for array in (self.queries, self.gram, self.scores, self.bonus):
+            array.setflags(write=False)  # shared by every request with the same swipes
+
+    @property
+    def nbytes(self):
+        return self.queries.nbytes + self.gram.nbytes + self.scores.nbytes + self.bonus.nbytes
+
+    def coefficients(self, weights):
+        """
+        param weights: dictionary of weights for each category
+        return: (coefficient of each column of scores, unit length preference vector)
+        """
+        if self.signals == ["generic"]:
+            coefficients = np.ones(1)
+        else:
+            coefficients = np.array([self.SIGNS[name] * weights[name] for name in self.signals])
+        norm = np.sqrt(max(coefficients @ self.gram @ coefficients, 0.0)) or 1.0
+        return coefficients / norm, coefficients @ self.queries / norm
+
+class RecommenderEngine:
+    """
+    Everything the recommendation algorithm needs (films, their embeddings, the model and the integer-coded indexes
+    of actors, directors and genres). It is built once, explicitly, and then shared by all requests.
+    """
+
+    def __init__(self, films, embeddings, model, all_actors=None, query_cache_size=QUERY_CACHE_SIZE,
+                 query_mode="encode", indexes=None, actor_map=None, result_cache_size=RESULT_CACHE_SIZE,
+                 result_cache_ttl=RESULT_CACHE_TTL):
+        """
+        param films: films table already processed by prepare_films (or any table with Title, Genres, Director,
+        Actor_Names and description columns), or its Catalog
+        param embeddings: 2D array with one vector per film, in the same order as films
+        param model: object with an encode(list_of_texts) method, used for the queries
+        param all_actors: list of actor names users swipe on (by default every actor found in films, with their IDs
+        when actor_map is given)
+        param query_cache_size: number of query vectors kept in the LRU cache
+        param query_mode: "encode" or "precomputed" (see QUERY_MODES)
+        param indexes: genre / director (and optionally entity) indexes already built for films (see load_catalog),
+        built here if None
+        param actor_map: dictionary actor ID -> actor's name; with it actors are told apart by ID (see
+        build_entity_indexes) and catalog deltas can be parsed
+        param result_cache_size, result_cache_ttl: size and expiry (seconds) of the cache of recommendation tables
+        """
+        if query_mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode {query_mode!r}, expected one of {QUERY_MODES}")
+        if isinstance(films, Catalog):
+            self.catalog, films = films, None  # the table is only rebuilt if an index has to be built from it
+        else:
+            films = films.reset_index(drop=True)
+            self.catalog = Catalog.from_frame(films)  # the table itself is not kept
+        # Unit length float32 rows, stored once so every request is a single dot product
+        self.embeddings = as_unit_rows(embeddings) if embeddings is not None else None
+        self.model = model
+        self.query_cache = QueryCache(query_cache_size)
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl)
+        self.signal_cache = ResultCache(SIGNAL_CACHE_SIZE, result_cache_ttl)  # see signal_scores
+        # Built once here so the bonus of each request is vectorized instead of a loop over all films
+        if indexes is None:
+            films = self.films if films is None else films
+            self.genre_index, self.genre_matrix = build_genre_matrix(films)
+            self.director_index, self.film_directors = build_director_index(films)
+        else:
+            self.genre_index, self.genre_matrix = indexes["genre_index"], indexes["genre_matrix"]
+            self.director_index, self.film_directors = indexes["director_index"], indexes["film_directors"]
+        self.actor_map = actor_map
+        self.index_entities(indexes if indexes is not None and "actor_films" in indexes else None, films)
+        self.filter_columns = build_filter_columns(self.catalog)  # see filter_mask
+        self.query_mode = query_mode
+        self.entity_vectors = None  # filled by precompute_entity_vectors
+        self._entity_lock = threading.Lock()  # see ensure_entity_vectors
+        self.generic_vector = None
+        self.ann_index = None  # approximate search, see build_ann_index
+        self.storage_mode = "float32"
+        self.quantized, self.scales = None, None  # compact copy of embeddings, see set_storage
+        self.rescore_k = RESCORE_K
+        # Where the engine came from, so catalog deltas can keep the artifacts up to date
+        self.model_name = getattr(model, "name", None)
+        self.cache_dir = None
+        self.ann_path = None
+        self.all_actor_ids = None  # IDs of all_actors, in the same order, when they are known
+        if all_actors is None and self.actor_ids is not None:
+            order = np.argsort(self.actor_names, kind='stable')
+            all_actors, self.all_actor_ids = self.actor_names[order].tolist(), self.actor_ids[order].tolist()
+        elif all_actors is None:
+            all_actors = sorted(set(self.actor_names))
+        self.all_actors = list(all_actors)
+        self.actor_weighting = "films"  # see actor_weights
+        self._actor_sampler = None
+
+    @property
+    def films(self):
+        """
+        The films table, rebuilt from the catalog at every access: for catalog deltas, tools and tests, requests
+        read the catalog
+        """
+        return self.catalog.to_frame()
+
+    @classmethod
+    def from_csv(cls, films_path=FILMS_CSV, actors_path=ACTORS_CSV, model=None, encoder="minilm",
+                 cache_dir=EMBEDDINGS_DIR, query_mode="encode", ann_lists=0, ann_nprobe=8, storage="float32"):
+        """
+        Build the engine from the CSV files, the stored embeddings artifact and the encoder
+        param films_path, actors_path: paths to final_films.csv and top_1000.csv
+        param model: an already loaded encoder (loaded from the encoder name if None)
+        param encoder: encoder backend, a key of ENCODERS ("minilm" or "hashing")
+        param cache_dir: folder of the embeddings artifact, of the preprocessed catalog and of the ANN index (nothing
+        is read or stored if None, every film is encoded)
+        param query_mode: "encode" or "precomputed" (see QUERY_MODES)
+        param ann_lists: number of clusters of the approximate nearest neighbour index, 0 for exact search
+        param ann_nprobe: number of clusters searched per request with the index
+        param storage: "float32", "float16" or "int8" (see STORAGE_MODES)
+        return: a ready to use RecommenderEngine
+        """
+        with CATALOG_LOAD_SECONDS.time(step="catalog"):
+            films, actor_map, indexes = load_catalog(films_path, actors_path, cache_dir, compact=True)
+
+        if model is None:
+            with CATALOG_LOAD_SECONDS.time(step="model"):
+                model = load_encoder(encoder)
+        model_name = getattr(model, "name", MODEL_NAME)  # key of the embeddings artifacts
+        # Generate vectors from movies' descriptions using a pretrained model and store them in embeddings
+        # (only the films whose description changed since the last run go through the model)
+        encode = lambda texts: normalize_rows(model.encode(texts, show_progress_bar=True))
+        with CATALOG_LOAD_SECONDS.time(step="embeddings"):
+            if cache_dir is not None:
+                embeddings = load_or_encode_embeddings(films['description'], encode, model_name, cache_dir)
+            else:
+                embeddings = np.asarray(encode(list(films['description'])), dtype=np.float32)
+                embeddings.setflags(write=False)  # like the memory mapped artifact
+        start = time.perf_counter()
+
+        # Creates a list all_actors with shuffled actor names (and their IDs in the same order)
+        actor_items = list(actor_map.items())
+        random.shuffle(actor_items)
+        all_actors = [name for _, name in actor_items]
+        engine = cls(films, embeddings, model, all_actors, query_mode=query_mode, indexes=indexes,
+                     actor_map=actor_map)
+        engine.all_actor_ids = [actor_id for actor_id, _ in actor_items]
+        engine.model_name, engine.cache_dir = model_name, cache_dir
+        # Part of the warm up, not of the first request: precomputed queries and sessions need them
+        engine.ensure_entity_vectors()
+        engine.set_storage(storage)
+        if ann_lists:
+            path = ann_index_path(model_name, ann_lists, cache_dir) if cache_dir is not None else None
+            engine.build_ann_index(ann_lists, ann_nprobe, path=path, fingerprint=embeddings_fingerprint(films['description']))
+        CATALOG_LOAD_SECONDS.observe(time.perf_counter() - start, step="engine")
+        return engine
+
+    def get_actor(self, session_id=None):
+        """
+        Retrieve a random actor's name, drawn like actor_batch draws them.
+        param session_id: session that should not see the actor twice (see actor_batch)
+        return : a string with the name of the actor.
+        """
+        return self.actor_batch(1, session_id=session_id)[0]
+
+    def actor_batch(self, size=num_actors_to_show, with_ids=False, session_id=None):
+        """
+        Retrieve several different random actors at once, well known actors (see actor_weights) more often
+        param size: number of actors
+        param with_ids: also return their IDs, which tell apart actors sharing a name (None if they are not known)
+        param session_id: identifier of the user's session; actors of its previous batches are not shown again until
+        all actors were shown
+        return: list of actors' names, or (names, IDs) with with_ids
+        """
+        positions = self.actor_sampler.sample(size, session_id).tolist()
+        names = [self.all_actors[i] for i in positions]
+        if not with_ids:
+            return names
+        return names, (None if self.all_actor_ids is None else [self.all_actor_ids[i] for i in positions])
+
+    @property
+    def actor_sampler(self):
+        """
+        ActorSampler over all_actors, built on first use (from_csv sets the actor IDs after the constructor)
+        """
+        if self._actor_sampler is None:
+            self._actor_sampler = ActorSampler(self.actor_weights(self.actor_weighting))
+        return self._actor_sampler
+
+    def actor_weights(self, weighting="films"):
+        """
+        param weighting: one of ACTOR_WEIGHTINGS
+        return: array with the weight of each actor of all_actors: their number of films, the sum of the ratings of
+        their films (AverageRating, films without one count as the average), or 1; actors without films weigh 0
+        """
+        if weighting not in ACTOR_WEIGHTINGS:
+            raise ValueError(f"Unknown actor weighting {weighting!r}, expected one of {ACTOR_WEIGHTINGS}")
+        if weighting == "uniform":
+            return np.ones(len(self.all_actors))
+        lengths = np.diff(self.actor_films.offsets)
+        if weighting == "rating" and 'AverageRating' in self.catalog:
+            ratings = pd.to_numeric(pd.Series(self.catalog['AverageRating']), errors='coerce')
+            ratings = ratings.fillna(ratings.mean() if ratings.notna().any() else 1.0).to_numpy()
+            per_code = np.bincount(np.repeat(np.arange(len(lengths)), lengths),
+                                   weights=ratings[self.actor_films.items], minlength=len(lengths))
+        else:
+            per_code = lengths.astype(np.float64)
+        keys = self.all_actor_ids if self.all_actor_ids is not None else self.all_actors
+        weights = np.zeros(len(keys))
+        for i, key in enumerate(keys):
+            found = self.actor_lookup.get(key)
+            if found is not None:
+                weights[i] = per_code[list(found[1])].sum()
+        return weights
+
+    def index_entities(self, entity_indexes=None, films=None):
+        """
+        Set the integer-coded actor, director and genre indexes of the films (see build_entity_indexes)
+        param entity_indexes: indexes already built (for example by load_catalog), built here if None
+        param films: films table the indexes are built from (rebuilt from the catalog if None)
+        """
+        if entity_indexes is None:
+            films = self.films if films is None else films
+            entity_indexes = build_entity_indexes(films, self.genre_index, self.director_index, self.film_directors,
+                                                  self.actor_map)
+        self.actor_names = entity_indexes["actor_names"]
+        self.actor_ids = entity_indexes["actor_ids"]
+        self.actor_lookup = build_actor_lookup(entity_indexes["actor_names"], entity_indexes["actor_ids"])
+        self.actor_films = entity_indexes["actor_films"]
+        self.actor_genres = entity_indexes["actor_genres"]
+        self.director_names = entity_indexes["director_names"]
+        self.actor_directors = entity_indexes["actor_directors"]
+        self.director_films = entity_indexes["director_films"]
+        self.genre_names = np.array(list(self.genre_index), dtype=object)
+        # Code of the Director value equal to each director name (-1 if none), for the director bonus
+        self.director_value_codes = pd.Index(list(self.director_index)).get_indexer(self.director_names)
+        # Directors in alphabetical order and the position of each one in it
+        self.directors_by_rank = np.argsort(self.director_names)
+        self.director_ranks = np.empty(len(self.director_names), dtype=np.int64)
+        self.director_ranks[self.directors_by_rank] = np.arange(len(self.director_names))
+
+    def resolve_actors(self, actors):
+        """
+        param actors: actor IDs or names (a name shared by several actors stands for all of them)
+        return: (list of display names, array of actor codes); unknown actors keep their name and have no code
+        """
+        names, codes = [], []
+        for actor in actors:
+            found = self.actor_lookup.get(actor)
+            if found is None:
+                names.append(self.actor_map.get(actor, actor) if self.actor_map else actor)
+            else:
+                names.append(found[0])
+                codes.extend(found[1])
+        return names, np.array(codes, dtype=np.int64)
+
+    def encode_queries(self, texts):
+        """
+        Encode query texts, taking the cached ones from the LRU cache and the others from a single model call
+        param texts: list of query texts
+        return: 2D array with one vector per text (same order)
+        """
+        vectors = [self.query_cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))  # unique, in order
+
+        if missing:
+            encoded = np.asarray(self.model.encode(missing), dtype=np.float32)
+            for text, vector in zip(missing, encoded):
+                vector.setflags(write=False)  # shared between requests through the cache
+                self.query_cache.put(text, vector)
+            new_vectors = dict(zip(missing, encoded))
+            vectors = [new_vectors[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        if not vectors:
+            return np.zeros((0, self.embeddings.shape[1]), dtype=np.float32)
+        return np.vstack(vectors)
+
+    def precompute_entity_vectors(self, model_name=None, cache_dir=None):
+        """
+        Encode one query per actor, director and genre, so that query vectors can later be assembled without the model
+        param model_name, cache_dir: when given, the vectors are kept in an artifact like the film embeddings
+        return: dictionary kind -> (dictionary entity -> row, 2D array of unit vectors)
+        """
+        entities = {
+            "actors": sorted(set(self.all_actors) | set(self.actor_names)),
+            # Directors of the films with at least one known actor, the only ones a preference can mention
+            "directors": sorted(set(self.director_names[self.actor_directors.items])),
+            "genres": list(self.genre_index),
+        }
+        templates = {"actors": actors_query, "directors": directors_query, "genres": genres_query}
+        texts = [GENERIC_QUERY] + [templates[kind]([name]) for kind, names in entities.items() for name in names]
+
+        encode = lambda batch: normalize_rows(self.model.encode(batch))
+        if cache_dir is not None:
+            vectors = load_or_encode_embeddings(texts, encode, model_name, cache_dir, kind='entities')
+        else:
+            vectors = encode(texts)
+
+        entity_vectors = {}
+        start = 1
+        for kind, names in entities.items():
+            entity_vectors[kind] = ({name: i for i, name in enumerate(names)}, vectors[start:start + len(names)])
+            start += len(names)
+        # Set once complete, requests read them without the lock
+        self.generic_vector = vectors[0]
+        self.entity_vectors = entity_vectors
+        return entity_vectors
+
+    def ensure_entity_vectors(self):
+        """
+        Precompute the entity vectors (from the artifact of the engine, when it has one) unless it is done already;
+        threads asking at the same time wait for one computation
+        return: see precompute_entity_vectors
+        """
+        if self.entity_vectors is None:
+            with self._entity_lock:
+                if self.entity_vectors is None:
+                    cache_dir = self.cache_dir if self.model_name is not None else None
+                    self.precompute_entity_vectors(self.model_name, cache_dir)
+        return self.entity_vectors
+
+    def mean_entity_vector(self, kind, names):
+        """
+        param kind: "actors", "directors" or "genres"
+        param names: entities of that kind (unknown ones are ignored)
+        return: unit length mean of their precomputed vectors, or None if none of them is known
+        """
+        index, vectors = self.entity_vectors[kind]
+        rows = [index[name] for name in names if name in index]
+        if not rows:
+            return None
+        return normalize_rows(vectors[rows].mean(axis=0, keepdims=True))[0]
+
+    def query_vectors(self, preferences):
+        """
+        Get the vectors of the queries of several users
+        param preferences: list of results of build_preferences
+        return: list (one per user) of dictionaries signal name -> query vector
+        """
+        if self.query_mode == "precomputed":
+            self.ensure_entity_vectors()
+            kinds = {"liked_actors": "actors", "disliked_actors": "actors", "directors": "directors", "genres": "genres"}
+            all_vecs = []
+            for p in preferences:
+                query_vecs = {}
+                for name, entities in p["entities"].items():
+                    vector = self.generic_vector if name == "generic" else self.mean_entity_vector(kinds[name], entities)
+                    if vector is not None:
+                        query_vecs[name] = vector
+                all_vecs.append(query_vecs)
+            return all_vecs
+
+        # Encode the queries of every user in one batch
+        texts = [text for p in preferences for text in p["queries"].values()]
+        encoded = self.encode_queries(texts)
+        all_vecs = []
+        position = 0
+        for p in preferences:
+            query_vecs = {}
+            for name in p["queries"]:
+                query_vecs[name] = encoded[position]
+                position += 1
+            all_vecs.append(query_vecs)
+        return all_vecs
+
+    def filter_mask(self, filters):
+        """
+        Compile the filters of a request into a mask over the films
+        param filters: dictionary of bounds, e.g. {"max_runtime": 120, "min_year": 1990, "min_rating": 7} (see
+        FILTER_COLUMNS), or None
+        return: boolean array marking the films within every bound (films missing a bounded value are left out), or
+        None when there is no filter
+        """
+        mask = None
+        for bound, value in filter_items(filters):
+            side, _, name = bound.partition("_")
+            if side not in ("min", "max") or name not in self.filter_columns:
+                raise ValueError(f"Unknown filter {bound!r}, expected min_ or max_ followed by one of "
+                                 f"{tuple(FILTER_COLUMNS)}")
+            values = self.filter_columns[name]
+            within = values >= value if side == "min" else values <= value
+            mask = within if mask is None else np.logical_and(mask, within, out=mask)
+        return mask
+
+    def genre_weights(self, genre_distribution):
+        """
+        param genre_distribution: dictionary genre -> share of the liked actors' film history
+        return: 1D array with the share of each genre column of genre_matrix (unknown genres are ignored)
+        """
+        weights = np.zeros(len(self.genre_index))
+        for genre, share in genre_distribution.items():
+            column = self.genre_index.get(genre)
+            if column is not None:
+                weights[column] = share
+        return weights
+
+    def director_mask(self, bonus_directors, candidates=None):
+        """
+        param bonus_directors: set of directors who worked with the liked actors
+        param candidates: indices of the films to look at (all films by default)
+        return: boolean array marking the films directed by one of them, or None if there is none
+        """
+        director_codes = [self.director_index[d] for d in bonus_directors if d in self.director_index]
+        if not director_codes:
+            return None
+        mask = np.zeros(len(self.catalog), dtype=bool)
+        mask[self.director_films.gather(director_codes)] = True
+        return mask if candidates is None else mask[candidates]
+
+    def bonus_scores(self, genre_distribution, bonus_directors, candidates=None):
+        """
+        Compute the bonus of every film: the distribution value of each of its genres plus 0.1 if its director is
+        one of bonus_directors
+        param genre_distribution: dictionary genre -> share of the liked actors' film history
+        param bonus_directors: set of directors who worked with the liked actors
+        param candidates: indices of the films to compute the bonus for (all films by default)
+        return: 1D array with the bonus of each film (of each candidate)
+        """
+        genre_matrix = self.genre_matrix if candidates is None else self.genre_matrix[candidates]
+        bonus = genre_matrix @ self.genre_weights(genre_distribution)  # sum of the genre bonuses of each film
+        mask = self.director_mask(bonus_directors, candidates)
+        if mask is not None:
+            bonus[mask] += 0.1  # small director bonus
+        return bonus
+
+    def build_preferences(self, liked_actors, disliked_actors):
+        """
+        Turn the swipes of a user into text queries and bonus information (no encoding yet)
+        param liked_actors, disliked_actors: list of actor names (or IDs) the user likes or dislikes
+        return: dictionary with the queries (signal name -> text), the entities behind them (signal name -> list),
+        the genre_distribution and the bonus_directors, and the same bonus information as arrays: genre_weights (share
+        of each genre column) and director_films (films that get the director bonus)
+        """
+        # Special case — no preferences at all, a neutral query and no bonus
+        if not liked_actors and not disliked_actors:
+            return {"queries": {"generic": GENERIC_QUERY}, "entities": {"generic": []},
+                    "genre_distribution": {}, "bonus_directors": set(),
+                    "genre_weights": np.zeros(len(self.genre_names)), "director_films": np.array([], dtype=np.int32)}
+
+        liked_names, liked_codes = self.resolve_actors(liked_actors)
+        disliked_names, _ = self.resolve_actors(disliked_actors)
+
+        # Get directors that have worked with the actor the user likes
+        # (unique ranks are sorted, so the directors come out in alphabetical order)
+        director_codes = self.directors_by_rank[np.unique(self.director_ranks[self.actor_directors.gather(liked_codes)])]
+        bonus_directors = self.director_names[director_codes].tolist()
+        value_codes = self.director_value_codes[director_codes]
+        director_films = self.director_films.gather(value_codes[value_codes >= 0])
+
+        # Get genres related to actors (with counting) and create a distribution
+        positions = self.actor_genres.positions(liked_codes)  # a liked actor given twice counts twice
+        genres = self.actor_genres.items[positions]
+        counts = np.bincount(genres, weights=self.actor_genres.counts[positions], minlength=len(self.genre_names))
+        total_genres = counts.sum() or 1  # avoid division by 0 if no liked_actors input or they have no films
+        # Genres in order of first appearance, so the same swipes always give the same genres query
+        order = dict.fromkeys(genres.tolist())
+        genre_weights = counts / total_genres
+        genre_distribution = {self.genre_names[g]: genre_weights[g] for g in order}  # distribution of genre related preferences based on liked actors' film history
+
+        # Entities behind each query, the empty ones are left out
+        entities = {
+            "liked_actors": liked_names,
+            "disliked_actors": disliked_names,
+            "directors": bonus_directors,  # sorted, so the same directors always give the same query
+            "genres": list(genre_distribution.keys()),
+        }
+        entities = {name: values for name, values in entities.items() if values}
+        templates = {"liked_actors": actors_query, "disliked_actors": actors_query,
+                     "directors": directors_query, "genres": genres_query}
+        queries = {name: templates[name](values) for name, values in entities.items()}
+        return {"queries": queries, "entities": entities,
+                "genre_distribution": genre_distribution, "bonus_directors": set(bonus_directors),
+                "genre_weights": genre_weights, "director_films": director_films}
+
+    def preference_vector(self, preferences, query_vecs, weights):
+        """
+        Combine the encoded queries of a user into one single vector
+        param preferences: result of build_preferences
+        param query_vecs: dictionary signal name -> vector of its query (missing signals count as zero vectors)
+        param weights: dictionary of weights for each category
+        return: 1D preference vector
+        """
+        if "generic" in preferences["queries"]:
+            return query_vecs["generic"]
+        zero_vec = np.zeros(self.embeddings.shape[1])
+        return (
+            weights["liked_actors"] * query_vecs.get("liked_actors", zero_vec)
+            - weights["disliked_actors"] * query_vecs.get("disliked_actors", zero_vec)
+            + weights["directors"] * query_vecs.get("directors", zero_vec)
+            + weights["genres"] * query_vecs.get("genres", zero_vec)
+        )
+
+    def recommend_batch(self, requests):
+        """
+        Recommend movies to several users (see ranked_batch)
+        param requests: list of dictionaries with liked_actors, disliked_actors, weights and top_k
+        return: list of lists of {"Title": title} records of the recommended movies, in the order of requests
+        """
+        return [self.catalog.records(ranked) for ranked in self.ranked_batch(requests)]
+
+    def ranked_batch(self, requests):
+        """
+        Rank movies for several users: requests seen recently come from the result cache, the others are scored
+        together by rank_batch
+        param requests: list of dictionaries with liked_actors, disliked_actors, weights and top_k
+        return: list of read-only arrays with the positions in films of the top_k movies, best first
+        """
+        results = [self.result_cache.get(result_key(request)) for request in requests]
+        missing = [i for i, ranked in enumerate(results) if ranked is None]
+        if missing:
+            for i, ranked in zip(missing, self.rank_batch([requests[i] for i in missing])):
+                ranked.setflags(write=False)  # shared with the callers, copying it would be wasted work
+                self.result_cache.put(result_key(requests[i]), ranked)
+                results[i] = ranked
+        return results
+
+    def score_batch(self, requests):
+        """
+        Same as recommend_batch without the result cache
+        """
+        return [self.catalog.records(ranked) for ranked in self.rank_batch(requests)]
+
+    def rank_batch(self, requests):
+        """
+        Score several users in one pass, without the result cache: at most one model call for all their queries and
+        one (users x dim) @ (dim x films) product for all their similarities
+        param requests: list of dictionaries with liked_actors, disliked_actors, weights, top_k and optionally filters
+        (see filter_mask), applied to the scores before the top_k selection
+        return: list of arrays with the positions in films of the top_k movies of each user (fewer when fewer films
+        pass the filters), best first
+        """
+        if not requests:
+            return []
+        RECOMMEND_BATCH_SIZE.observe(len(requests))
+        # Seconds spent in each stage, observed once for the whole batch
+        clock = time.perf_counter()
+        stages = dict.fromkeys(("similarity", "bonus", "top_k"), 0.0)
+        preferences = [self.build_preferences(r["liked_actors"], r["disliked_actors"]) for r in requests]
+        masks = [self.filter_mask(r.get("filters")) for r in requests]
+        now = time.perf_counter()
+        RECOMMEND_STAGE_SECONDS.observe(now - clock, stage="preferences")
+        clock = now
+
+        preference_matrix = np.zeros((len(requests), self.embeddings.shape[1]))
+        for u, (request, p, query_vecs) in enumerate(zip(requests, preferences, self.query_vectors(preferences))):
+            preference_matrix[u] = self.preference_vector(p, query_vecs, request["weights"])
+        # Cosine similarity: unit length preferences against the unit length film vectors
+        preference_matrix = normalize_rows(preference_matrix)
+        now = time.perf_counter()
+        RECOMMEND_STAGE_SECONDS.observe(now - clock, stage="encode")
+        clock = now
+
+        if self.ann_index is not None:
+            results = [self.recommend_candidates(request, p, preference, mask)
+                       for request, p, preference, mask in zip(requests, preferences, preference_matrix, masks)]
+            RECOMMEND_STAGE_SECONDS.observe(time.perf_counter() - clock, stage="ann")
+            return results
+
+        results = []
+        for start in range(0, len(requests), SCORE_CHUNK_SIZE):
+            end = min(start + SCORE_CHUNK_SIZE, len(requests))
+            # Compute cosine similarity between queries and all movie embeddings (approximate with compact storage)
+            if self.quantized is not None:
+                similarity_scores = quantized_scores(self.quantized, self.scales, preference_matrix[start:end])
+            else:
+                similarity_scores = preference_matrix[start:end] @ self.embeddings.T
+            now = time.perf_counter()
+            stages["similarity"] += now - clock
+            clock = now
+
+            # Add small score bonuses for directors and genres (no bonus without preferences)
+            genre_weights = np.array([p["genre_weights"] for p in preferences[start:end]])
+            bonus_scores = (self.genre_matrix @ genre_weights.T).T
+            for row, p in enumerate(preferences[start:end]):
+                bonus_scores[row, p["director_films"]] += 0.1  # small director bonus
+            now = time.perf_counter()
+            stages["bonus"] += now - clock
+            clock = now
+
+            for row, request in enumerate(requests[start:end]):
+                # Combine base similarity and bonus adjustments
+                bonus_weight = request["weights"]["bonus_genre_director"]
+                final_scores = similarity_scores[row] + bonus_weight * bonus_scores[row]
+                top_k, n_candidates = request["top_k"], max(self.rescore_k, request["top_k"])
+                mask = masks[start + row]
+                if mask is not None:
+                    # Filtered out films can not be selected, and there may be fewer than top_k left
+                    final_scores[~mask] = -np.inf
+                    n_passing = int(np.count_nonzero(mask))
+                    top_k, n_candidates = min(top_k, n_passing), min(n_candidates, n_passing)
+
+                # Compute final scores and gets top k similar movies
+                if self.quantized is None:
+                    similar_indices = top_k_indices(final_scores, top_k)
+                else:
+                    # Rescore the best approximate films with the full precision vectors
+                    candidates = np.sort(top_k_indices(final_scores, n_candidates))
+                    final_scores = (self.embeddings[candidates] @ preference_matrix[start + row]
+                                    + bonus_weight * bonus_scores[row, candidates])
+                    similar_indices = candidates[top_k_indices(final_scores, top_k)]
+
+                # Give the final recommendation
+                results.append(similar_indices)
+            now = time.perf_counter()
+            stages["top_k"] += now - clock
+            clock = now
+        for stage, seconds in stages.items():
+            RECOMMEND_STAGE_SECONDS.observe(seconds, stage=stage)
+        return results
+
+    def signal_scores(self, requests):
+        """
+        Per-signal scores of the swipes of several users, from the signal cache or computed together: one model call
+        for their queries and one (queries x dim) @ (dim x films) product
+        param requests: list of dictionaries with liked_actors and disliked_actors
+        return: list of SignalScores, in the order of requests
+        """
+        keys = [(tuple(r["liked_actors"]), tuple(r["disliked_actors"])) for r in requests]
+        results = [self.signal_cache.get(key) for key in keys]
+        missing = [i for i, signals in enumerate(results) if signals is None]
+        if not missing:
+            return results
+
+        with RECOMMEND_STAGE_SECONDS.time(stage="signals"):
+            preferences = [self.build_preferences(requests[i]["liked_actors"], requests[i]["disliked_actors"])
+                           for i in missing]
+            names, queries = [], []
+            for p, query_vecs in zip(preferences, self.query_vectors(preferences)):
+                if "generic" in p["queries"]:
+                    names.append(["generic"])
+                else:
+                    names.append([name for name in SignalScores.SIGNALS if name in query_vecs])
+                queries.append(np.array([query_vecs[name] for name in names[-1]], dtype=np.float32)
+                               .reshape(len(names[-1]), self.embeddings.shape[1]))
+            stacked = np.concatenate(queries)
+            if self.quantized is not None:
+                scores = quantized_scores(self.quantized, self.scales, stacked).T
+            else:
+                scores = self.embeddings @ stacked.T
+            genre_weights = np.array([p["genre_weights"] for p in preferences])
+            bonus = np.asarray((self.genre_matrix @ genre_weights.T).T, dtype=np.float32)
+            start = 0
+            for row, (i, p, signal_names, query) in enumerate(zip(missing, preferences, names, queries)):
+                bonus[row, p["director_films"]] += 0.1  # small director bonus
+                # Copies, so that a cached entry does not keep the arrays of the whole batch alive
+                signals = SignalScores(signal_names, query, scores[:, start:start + len(query)].copy(),
+                                       bonus[row].copy())
+                start += len(query)
+                self.signal_cache.put(keys[i], signals)
+                results[i] = signals
+        return results
+
+    def rank_signals(self, signals, weights, top_k, mask=None):
+        """
+        Rank the films for one set of weights from per-signal scores, without the model or the film vectors (but
+        the top films are rescored with them when the scores are approximate, like rank_batch)
+        param signals: SignalScores of the swipes
+        param weights: dictionary of weights for each category
+        param top_k: number of films
+        param mask: films allowed by the filters (all if None)
+        return: array with the positions in films of the top_k movies, best first
+        """
+        coefficients, preference = signals.coefficients(weights)
+        bonus_weight = weights["bonus_genre_director"]
+        final_scores = signals.scores @ coefficients.astype(np.float32) + np.float32(bonus_weight) * signals.bonus
+        n_candidates = max(self.rescore_k, top_k)
+        if mask is not None:
+            final_scores[~mask] = -np.inf
+            n_passing = int(np.count_nonzero(mask))
+            top_k, n_candidates = min(top_k, n_passing), min(n_candidates, n_passing)
+        if self.quantized is None:
+            return top_k_indices(final_scores, top_k)
+        candidates = np.sort(top_k_indices(final_scores, n_candidates))
+        rescored = (self.embeddings[candidates] @ preference.astype(np.float32)
+                    + bonus_weight * signals.bonus[candidates])
+        return candidates[top_k_indices(rescored, top_k)]
+
+    def reweighted_batch(self, requests):
+        """
+        Like ranked_batch, but through the signal cache: the first request of a set of swipes scores each of its
+        signals once, the next ones with other weights (e.g. moving a slider) only reweight these scores. The scores
+        are the same up to rounding, so films with equal scores may come in another order than in ranked_batch. With
+        an ANN index the scores of every film are not available, so the requests go through ranked_batch instead.
+        param requests: list of dictionaries with liked_actors, disliked_actors, weights, top_k and optionally filters
+        return: list of read-only arrays with the positions in films of the top_k movies, best first
+        """
+        if self.ann_index is not None:
+            return self.ranked_batch(requests)
+        results = []
+        with RECOMMEND_STAGE_SECONDS.time(stage="reweight"):
+            for request, signals in zip(requests, self.signal_scores(requests)):
+                ranked = self.rank_signals(signals, request["weights"], request["top_k"],
+                                           self.filter_mask(request.get("filters")))
+                ranked.setflags(write=False)
+                results.append(ranked)
+        return results
+
+    def recommend_candidates(self, request, preferences, preference, mask=None):
+        """
+        Approximate version of the scoring in rank_batch: only the films returned by the ANN index are scored,
+        and the genre/director bonus is only computed for them
+        param request: dictionary with weights and top_k
+        param preferences: result of build_preferences
+        param preference: unit length preference vector
+        param mask: films allowed by the filters of the request (all if None)
+        return: array with the positions in films of the recommended movies, best first
+        """
+        candidates = self.ann_index.search(preference, min_candidates=request["top_k"], mask=mask)
+        similarity_scores = self.embeddings[candidates] @ preference
+        bonus_scores = self.genre_matrix[candidates] @ preferences["genre_weights"]
+        bonus_scores[np.isin(candidates, preferences["director_films"])] += 0.1  # small director bonus
+        final_scores = similarity_scores + request["weights"]["bonus_genre_director"] * bonus_scores
+        return candidates[top_k_indices(final_scores, request["top_k"])]
+
+    def set_storage(self, mode, rescore_k=RESCORE_K):
+        """
+        Choose how the film vectors are scored (see STORAGE_MODES)
+        param mode: "float32", "float16" or "int8"
+        param rescore_k: number of best approximate films rescored with the float32 vectors
+        """
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {mode!r}, expected one of {STORAGE_MODES}")
+        self.storage_mode = mode
+        self.rescore_k = rescore_k
+        self.result_cache.clear()  # tables scored with the previous vectors
+        self.signal_cache.clear()
+        if mode == "float32":
+            self.quantized, self.scales = None, None
+        else:
+            self.quantized, self.scales = quantize_embeddings(self.embeddings, mode)
+
+    def build_ann_index(self, n_lists=None, nprobe=8, path=None, fingerprint=""):
+        """
+        Switch the engine to approximate search with an IVF index, loaded from path if it holds a valid one
+        param n_lists, nprobe: see IVFIndex.build
+        param path: file where the index is stored next to the embeddings (nothing is stored if None)
+        param fingerprint: identifies the current embeddings (see embeddings_fingerprint)
+        return: the index
+        """
+        index = IVFIndex.load(path, fingerprint) if path is not None else None
+        if index is None:
+            index = IVFIndex.build(self.embeddings, n_lists=n_lists, nprobe=nprobe, fingerprint=fingerprint)
+            if path is not None:
+                index.save(path)
+        index.nprobe = nprobe
+        self.ann_index = index
+        self.ann_path = path
+        self.result_cache.clear()  # tables scored with exact search
+        return index
+
+    def with_delta(self, delta, actor_map=None):
+        """
+        Apply a catalog delta without rebuilding everything: only the new or changed descriptions are encoded, and the
+        embeddings, genre / director indexes, compact vectors and ANN index are patched
+        param delta: catalog delta table (see DELTA_ACTIONS), with the raw columns of final_films.csv
+        param actor_map: dictionary actor ID -> actor's name used to parse the Cast column (self.actor_map by default)
+        return: a new engine; self is left untouched so requests in flight finish on a consistent catalog
+        """
+        actor_map = self.actor_map if actor_map is None else actor_map
+        if actor_map is None:
+            raise ValueError("An actor map is needed to parse the Cast column of the delta")
+        upserts, removed = split_delta(delta)
+        old_films = self.films
+        replaced = old_films['Code'].isin(removed | set(upserts['Code'])).to_numpy()
+        kept = np.flatnonzero(~replaced)
+        old_rows = old_films.iloc[np.flatnonzero(replaced)]
+        new_rows = prepare_films(upserts, actor_map) if len(upserts) else old_films.iloc[:0]
+        new_rows = new_rows.reindex(columns=old_films.columns)
+        films = pd.concat([old_films.iloc[kept], new_rows], ignore_index=True)
+
+        # Film vectors: rows that stay are copied, replaced films whose description did not change keep their vector
+        encode = lambda texts: normalize_rows(self.model.encode(texts))
+        if self.cache_dir is not None and self.model_name is not None:
+            # Also refreshes the artifact, so the next restart does not encode these films again
+            embeddings = load_or_encode_embeddings(films['description'].tolist(), encode, self.model_name,
+                                                   self.cache_dir)
+        else:
+            previous = dict(zip(old_rows['description'], self.embeddings[np.flatnonzero(replaced)]))
+            new_vectors = np.empty((len(new_rows), self.embeddings.shape[1]), dtype=np.float32)
+            missing = [i for i, text in enumerate(new_rows['description']) if text not in previous]
+            for i, text in enumerate(new_rows['description']):
+                if text in previous:
+                    new_vectors[i] = previous[text]
+            if missing:
+                new_vectors[missing] = encode(new_rows['description'].iloc[missing].tolist())
+            embeddings = np.concatenate([self.embeddings[kept], new_vectors])
+
+        engine = copy.copy(self)
+        engine.result_cache = ResultCache(self.result_cache.maxsize, self.result_cache.ttl)  # new catalog, new results
+        engine.signal_cache = ResultCache(self.signal_cache.maxsize, self.signal_cache.ttl)
+        engine._entity_lock = threading.Lock()
+        engine.catalog = Catalog.from_frame(films)
+        engine.embeddings = as_unit_rows(embeddings)
+        new_vectors = engine.embeddings[len(kept):]
+
+        engine.genre_index, new_genres = build_genre_matrix(new_rows, self.genre_index)
+        kept_genres = self.genre_matrix[kept]
+        kept_genres.resize((len(kept), len(engine.genre_index)))
+        new_genres.resize((len(new_rows), len(engine.genre_index)))
+        engine.genre_matrix = sparse.vstack([kept_genres, new_genres]).tocsr()
+        engine.director_index, new_directors = build_director_index(new_rows, self.director_index)
+        engine.film_directors = np.concatenate([self.film_directors[kept], new_directors])
+        engine.filter_columns = build_filter_columns(films)
+        # Film positions moved, so the posting lists are rebuilt (vectorized, no model involved)
+        engine.index_entities(films=films)
+        if self._actor_sampler is not None:
+            # Film counts changed; sessions keep the actors they were already shown
+            engine._actor_sampler = ActorSampler(engine.actor_weights(self.actor_weighting), self.actor_sampler.decks)
+
+        if self.quantized is not None:
+            quantized, scales = quantize_embeddings(new_vectors, self.storage_mode)
+            engine.quantized = np.concatenate([self.quantized[kept], quantized])
+            if scales is not None:
+                engine.scales = np.concatenate([self.scales[kept], scales])
+        if self.ann_index is not None:
+            fingerprint = embeddings_fingerprint(films['description'])
+            engine.ann_index = self.ann_index.with_rows(kept, new_vectors, fingerprint)
+            if self.ann_path is not None:
+                engine.ann_index.save(self.ann_path)
+        if self.entity_vectors is not None:
+            # New actors, directors or genres need a vector; the artifact (if any) keeps the known ones
+            engine.precompute_entity_vectors(self.model_name, self.cache_dir)
+        return engine
+
+    def recommend(self, liked_actors, disliked_actors, weights, top_k, filters=None):
+        """
+        param liked_actors, disliked_actors: list of actor names the user likes or dislikes
+        weights: dictionary of weights for each category
+        param top_k: number of top recommendations to return
+        param filters: bounds on the recommended films (see filter_mask)
+        return: list of {"Title": title} records of the recommended movies, best first
+        """
+        request = {"liked_actors": liked_actors, "disliked_actors": disliked_actors, "weights": weights,
+                   "top_k": top_k, "filters": filters}
+        return self.recommend_batch([request])[0]
+
+
+# Engine shared by the server and the command line version, built by init_engine()
+_engine = None
+_engine_lock = threading.Lock()
+
+def init_engine(**kwargs):
+    """
+    Build the shared engine if it does not exist yet (safe to call from several threads)
+    param kwargs: passed to RecommenderEngine.from_csv
+    return: the shared engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RecommenderEngine.from_csv(**kwargs)
+    return _engine
+
+def set_engine(engine):
+    """
+    Replace the shared engine (for example with a small one in tests)
+    param engine: a RecommenderEngine or None
+    """
+    global _engine
+    _engine = engine
+
+def get_engine():
+    """
+    return: the shared engine, raises RuntimeError if init_engine() was not called yet
+    """
+    if _engine is None:
+        raise RuntimeError("Recommendation engine is not initialized, call init_engine() first")
+    return _engine
+
+def is_ready():
+    """
+    return: True once the shared engine is built
+    """
+    return _engine is not None
+
+def get_actor(engine=None, session_id=None):
+    """
+    Retrieve a random actor's name (see RecommenderEngine.actor_batch).
+    param engine: engine to use (the shared one by default)
+    param session_id: session that should not see the actor twice
     return : a string with the name of the actor.
     """
-    return all_actors[random.randint(0, len(all_actors) - 1)]
+    return (engine or get_engine()).get_actor(session_id)
 
-def recommend_movies(liked_actors, disliked_actors, weights, top_k):
+def recommend_movies(liked_actors, disliked_actors, weights, top_k, engine=None, filters=None):
     """
     param liked_actors, disliked_actors: list of actor names the user likes or dislikes
     weights: dictionary of weights for each category
     param top_k: number of top recommendations to return
+    param engine: engine to use (the shared one by default)
+    param filters: bounds on the recommended films, e.g. {"max_runtime": 120, "min_year": 1990, "min_rating": 7}
+    return: list of {"Title": title} records of the recommended movies, best first
+    """
+    return (engine or get_engine()).recommend(liked_actors, disliked_actors, weights, top_k, filters)
+
+def ranked_movies_batch(requests, engine=None):
+    """
+    param requests: list of dictionaries with liked_actors, disliked_actors, weights, top_k and optionally filters
+    (one per user)
+    param engine: engine to use (the shared one by default)
+    return: list of (Catalog, read-only array of the positions in it of the top_k movies), in the order of
+    requests; the catalog is the one of the engine that ranked them, which a catalog delta may replace afterwards
+    """
+    engine = engine or get_engine()
+    return [(engine.catalog, ranked) for ranked in engine.ranked_batch(requests)]
+
+def reweighted_movies_batch(requests, engine=None):
+    """
+    Same as ranked_movies_batch through the signal cache, for weights that change between requests (see
+    RecommenderEngine.reweighted_batch)
+    """
+    engine = engine or get_engine()
+    return [(engine.catalog, ranked) for ranked in engine.reweighted_batch(requests)]
 
+def recommend_movies_batch(requests, engine=None):
+    """
+    param requests: list of dictionaries with liked_actors, disliked_actors, weights and top_k (one per user)
+    param engine: engine to use (the shared one by default)
+    return: list of lists of {"Title": title} records, in the order of requests
     """
-    # Create 2 text queries from actor names
-    like_actor_text = ", ".join(liked_actors) if liked_actors else ""
-    dislike_actor_text = ", ".join(disliked_actors) if disliked_actors else ""
-
-    # Special case — no preferences at all
-    if not liked_actors and not disliked_actors:
-        # Neutral embedding
-        preference_vec = model.encode(["generic movie query"])
-        similarity_scores = cosine_similarity(preference_vec, embeddings)[0]
-        similar_indices = np.argsort(similarity_scores)[::-1][:top_k]
-
-        return films.iloc[similar_indices][['Title']]
-
-    # Encode the actors related queries
-    like_actors_vec = model.encode([f"Movies featuring actors like {like_actor_text}."]) \
-        if like_actor_text else np.zeros((1, embeddings.shape[1]))
-    dislike_actors_vec = model.encode([f"Movies featuring actors like {dislike_actor_text}."]) \
-        if dislike_actor_text else np.zeros((1, embeddings.shape[1]))
-
-    # Get directors that have worked with the actor the user likes
-    bonus_directors = set()
-    for actor in liked_actors:
-        bonus_directors.update(actor_to_directors.get(actor, []))
-
-    # Get genres related to actors (with counting) and create a distribution
-    genre_counter = Counter()
-    for act in liked_actors:
-        genre_counter.update(actor_to_genres.get(act, []))
-    total_genres = sum(genre_counter.values()) or 1  # avoid division by 0 if no liked_actors input or they are not in the actors_to_genres dict
-    genre_distribution = {genre: count / total_genres for genre, count in genre_counter.items()}  # distribution of genre related preferences based on liked actors' film history
-
-    directors_text = ", ".join(bonus_directors)
-    genres_text = ", ".join(genre_distribution.keys())
-
-    # Encode directors and genres related queries into vectors
-    directors_vec = model.encode([f"Movies directed by {directors_text}."]) \
-        if directors_text else np.zeros((1, embeddings.shape[1]))
-    genres_vec = model.encode([f"Movies in genres like {genres_text}."]) \
-        if genres_text else np.zeros((1, embeddings.shape[1]))
-
-    # Combine preference vectors into one single vector
-    preference_vec = (
-        weights["liked_actors"] * like_actors_vec
-        - weights["disliked_actors"] * dislike_actors_vec
-        + weights["directors"] * directors_vec
-        + weights["genres"] * genres_vec
-    )
-
-    # Compute cosine similarity between query and all movie embeddings
-    similarity_scores = cosine_similarity(preference_vec, embeddings)[0]
-
-    # Add small score bonuses for directors and genres
-    bonus_scores = np.zeros_like(similarity_scores)  # zero vector, same size as similarity_scores vector
-    for i, row in films.iterrows():
-        if isinstance(row['Genres'], str):
-            for g in [x.strip() for x in row['Genres'].split(",") if x.strip()]:
-                bonus_scores[i] += genre_distribution.get(g, 0)  # bonus equals to the distribution value of the genre
-        if row['Director'] in bonus_directors:
-            bonus_scores[i] += 0.1  # small director bonus
-
-    # Combine base similarity and bonus adjustments
-    final_scores = similarity_scores + weights["bonus_genre_director"] * bonus_scores
-
-    # Compute final scores and gets top k similar movies
-    similar_indices = np.argsort(final_scores)[::-1][:top_k]
-
-    # Give the final recommendation
-    recommendations = films.iloc[similar_indices][['Title']].copy()
-    return recommendations
+    return (engine or get_engine()).recommend_batch(requests)
+
+_delta_lock = threading.Lock()
+
+def apply_catalog_delta(delta, actor_map=None):
+    """
+    Patch the shared engine with a catalog delta while it keeps serving requests, then swap it in one assignment
+    param delta: catalog delta table (see DELTA_ACTIONS)
+    param actor_map: dictionary actor ID -> actor's name (the one the engine was built with by default)
+    return: the new shared engine
+    """
+    with _delta_lock:  # two deltas at the same time would each start from the old catalog
+        with CATALOG_LOAD_SECONDS.time(step="delta"):
+            engine = get_engine().with_delta(delta, actor_map)
+        set_engine(engine)
+    return engine
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="\n%(message)s")
+    init_engine()
     liked_actors = []
     disliked_actors = []
 
@@ -179,7 +2061,7 @@ if __name__ == "__main__":
     # Retrieve num_actors_to_show(int) actors from shuffled all_actors list
     # User will swipe on them one by one
     for i in range(num_actors_to_show) :
-        actor = get_actor()
+        actor = get_actor(session_id="cli")
 
         while True:
             response = input(f"{actor}? (y/n): ").strip().lower()
@@ -199,36 +2081,55 @@ if __name__ == "__main__":
     print(f"Liked actors ({len(liked_actors)}): {', '.join(liked_actors)}")
     print(f"Disliked actors ({len(disliked_actors)}): {', '.join(disliked_actors)}")
 
-    # Weights values
-    weights = {
-        "liked_actors": 1.8,
-        "disliked_actors": 0.5,
-        "genres": 0.6,
-        "directors": 0.7,
-        "bonus_genre_director": 0.1  # how much the extra bonuses affect score
-    }
+    # Weights values, changed with arguments like genres=0.9 (see DEFAULT_WEIGHTS for the names)
+    weights = {**DEFAULT_WEIGHTS, "disliked_actors": 0.5}
+    for argument in sys.argv[1:]:
+        name, _, value = argument.partition("=")
+        if name not in weights:
+            raise SystemExit(f"Unknown weight {name!r}, expected one of {', '.join(weights)}")
+        weights[name] = float(value)
+
+def canonical_swipes(liked_actors, disliked_actors):
+    """
+    The order of the swipes does not matter, so equivalent swipe sets are sorted the same way (and share their
+    bias correction and their place in the result cache)
+    return: (sorted liked actors, sorted disliked actors), without duplicates
+    """
+    return sorted(set(liked_actors)), sorted(set(disliked_actors))
+
+def request_seed(liked_actors, disliked_actors):
+    """
+    return: seed for bias_correction derived from the swipes, the same for every equivalent swipe set
+    """
+    liked_actors, disliked_actors = canonical_swipes(liked_actors, disliked_actors)
+    text = "\x1e".join(["\x1f".join(liked_actors), "\x1f".join(disliked_actors)])
+    return int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], "big")
 
-def bias_correction(disliked_actors, drop_fraction=0.5):
+def bias_correction(disliked_actors, drop_fraction=0.5, seed=None):
     """
-    Randomly ignores a fraction of disliked actors to reduce bias from unknown actors.
+    Ignores a fraction of disliked actors to reduce bias from unknown actors.
     Returns a filtered list of disliked actors that will actually affect recommendations.
+    The ignored actors are picked at random, but with a seed: the same swipes always give the same recommendations.
 
     param disliked_actors: list of actors the user disliked
     param drop_fraction: fraction of disliked actors to ignore
+    param seed: seed of the pick (by default derived from the disliked actors, see request_seed)
     return: filtered list of disliked actors
     """
     if not disliked_actors:
         return disliked_actors  # nothing to do
 
     num_to_drop = int(len(disliked_actors) * drop_fraction)
-    # Randomly choose actors to ignore
-    ignored = set(random.sample(disliked_actors, num_to_drop))
+    if seed is None:
+        seed = request_seed([], disliked_actors)
+    # Randomly choose actors to ignore (from a sorted list, so the order of the swipes does not matter)
+    ignored = set(random.Random(seed).sample(sorted(disliked_actors), num_to_drop))
     corrected_list = []
     for actor in disliked_actors:
         if actor not in ignored:
             corrected_list.append(actor)
 
-    print(f"\nBias correction applied: Ignoring {num_to_drop} disliked actors -> {', '.join(ignored)}")
+    logger.info("Bias correction applied: Ignoring %d disliked actors -> %s", num_to_drop, ', '.join(ignored))
     return corrected_list
 
 if __name__ == "__main__":
@@ -238,6 +2139,7 @@ if __name__ == "__main__":
     # Generate recommendations
     recs = recommend_movies(liked_actors, disliked_actors, weights, top_k=4)
     print("\nRecommended Movies Based on Weighted Preferences and Bonuses:\n")
-    print(recs.to_string(index=False))
+    for rec in recs:
+        print(rec["Title"])
 
 
@@ -0,0 +1,248 @@
+"""
+File: backend/evaluate.py
+Description: offline evaluation of the recommendation weights. A share of the films of final_films.csv is held out:
+the engine evaluated only knows the casts of the other films (see training_engine), so the genres and directors of a
+liked actor never come from a held out film, but it still ranks every film. Users are simulated from it: a user likes
+an actor and the actors of the known films of that actor, dislikes actors who never played with them, and one held out
+film of the actor is the film to find. A configuration (weights and bias_correction drop fraction) is as good as it
+ranks the held out films among the films the user does not know yet (the known films of the actor are left out of the
+ranking): hit rate (held out film in the top k) and NDCG@k (1 / log2(1 + rank) when it is).
+The per-signal scores of each user (see embeddings3.SignalScores) are computed once per drop fraction and reused for
+every weights of the grid, and users are spread over a pool of processes forked after the engine is built.
+Usage (from the backend folder): python evaluate.py --users 5000 --liked 1.2,1.8,2.4 --drop 0,0.2,0.5 [--encoder hashing]
+"""
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from embeddings3 import (DEFAULT_WEIGHTS, ResultCache, bias_correction, build_entity_indexes, get_engine,
+                         init_engine, is_ready, request_seed, set_engine)
+
+# Actors liked and disliked by each simulated user (fewer when the actor has fewer co-stars)
+LIKES = 8
+DISLIKES = 10
+# Share of the films whose cast the evaluated engine does not know
+HELD_OUT_SHARE = 0.2
+# Users evaluated together by a task of the pool
+CHUNK_SIZE = 250
+
+
+def held_out_films(engine, share=HELD_OUT_SHARE, seed=0):
+    """
+    param engine: RecommenderEngine whose films are split
+    param share: share of the films held out
+    param seed: seed of the random choice, the same seed gives the same films
+    return: sorted list of the positions in films of the held out films
+    """
+    n_films = len(engine.catalog)
+    return sorted(random.Random(seed).sample(range(n_films), round(share * n_films)))
+
+def training_engine(engine, held_out):
+    """
+    param engine: RecommenderEngine
+    param held_out: positions in films of the held out films
+    return: engine ranking the same films with the same vectors, whose actor indexes (the films, genres and directors
+    of each actor) are built as if the held out films had no cast
+    """
+    films = engine.films
+    unknown = np.zeros(len(films), dtype=bool)
+    unknown[list(held_out)] = True
+    films["Actor_Names"] = [[] if hidden else names for hidden, names in zip(unknown, films["Actor_Names"])]
+    if "Cast" in films:
+        films.loc[unknown, "Cast"] = ""
+    training = copy.copy(engine)
+    training.result_cache = ResultCache(engine.result_cache.maxsize, engine.result_cache.ttl)
+    training.signal_cache = ResultCache(engine.signal_cache.maxsize, engine.signal_cache.ttl)
+    training.index_entities(build_entity_indexes(films, engine.genre_index, engine.director_index,
+                                                 engine.film_directors, engine.actor_map))
+    return training
+
+def simulate_users(engine, n_users, held_out, likes=LIKES, dislikes=DISLIKES, seed=0):
+    """
+    param engine: RecommenderEngine whose films and actors are used
+    param n_users: number of users
+    param held_out: positions in films of the held out films (see held_out_films)
+    param likes, dislikes: most actors liked / disliked by a user
+    param seed: seed of the random choices, the same seed gives the same users
+    return: list of dictionaries with liked_actors, disliked_actors, held_out (position of the film to find in films)
+    and known (positions of the other films of the liked actor, which are not recommended)
+    """
+    rng = random.Random(seed)
+    # all_actors is shuffled by from_csv on every load, users are drawn from a sorted copy so the seed is enough
+    ordered = sorted(set(engine.all_actors))
+    swipeable = set(ordered)
+    casts = engine.catalog.casts()
+    held_out = set(held_out)
+    films_of = {}  # actor -> positions of their films
+    for position, names in enumerate(casts):
+        for name in names:
+            if name in swipeable:
+                films_of.setdefault(name, []).append(position)
+    # Actors with a film to find and a known film to find it from
+    actors = sorted(name for name, films in films_of.items()
+                    if held_out.intersection(films) and not held_out.issuperset(films))
+    if not actors:
+        raise ValueError("No actor plays in a held out film and another film, users can not be simulated")
+
+    users = []
+    for _ in range(n_users):
+        actor = rng.choice(actors)
+        target = rng.choice(sorted(held_out.intersection(films_of[actor])))
+        known = sorted(set(films_of[actor]) - held_out)
+        # Co-stars from the known films only: nothing is known about the held out films
+        co_stars = {name for f in known for name in casts[f]}
+        co_stars = sorted(co_stars & swipeable - {actor})
+        liked = [actor] + rng.sample(co_stars, min(likes - 1, len(co_stars)))
+        cast = {name for f in films_of[actor] for name in casts[f]}
+        strangers = [name for name in rng.sample(ordered, min(len(ordered), 4 * dislikes))
+                     if name not in cast]
+        users.append({"liked_actors": liked, "disliked_actors": strangers[:dislikes], "held_out": target,
+                      "known": known})
+    return users
+
+def weight_grid(values):
+    """
+    param values: dictionary weight name -> list of values to try (missing weights keep their DEFAULT_WEIGHTS value)
+    return: list of weights dictionaries, one per combination
+    """
+    names = list(DEFAULT_WEIGHTS)
+    choices = [values.get(name) or [DEFAULT_WEIGHTS[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+def evaluate_users(users, grid, drop_fraction, k, engine=None):
+    """
+    Score a chunk of users once and rank their films for every weights of the grid
+    param users: result of simulate_users
+    param grid: list of weights dictionaries
+    param drop_fraction: fraction of the disliked actors ignored by bias_correction
+    param k: length of the recommendation lists
+    param engine: engine to use (the shared one by default, see training_engine)
+    return: (hits, sum of the NDCG) arrays with one value per weights of the grid
+    """
+    engine = engine or get_engine()
+    requests = []
+    for user in users:
+        seed = request_seed(user["liked_actors"], user["disliked_actors"])
+        disliked = bias_correction(user["disliked_actors"], drop_fraction, seed=seed)
+        requests.append({"liked_actors": user["liked_actors"], "disliked_actors": disliked})
+    hits, ndcg = np.zeros(len(grid)), np.zeros(len(grid))
+    for user, signals in zip(users, engine.signal_scores(requests)):
+        unknown = np.ones(len(engine.catalog), dtype=bool)
+        unknown[user["known"]] = False
+        for g, weights in enumerate(grid):
+            ranked = engine.rank_signals(signals, weights, k, unknown)
+            found = np.flatnonzero(ranked == user["held_out"])
+            if len(found):
+                hits[g] += 1
+                ndcg[g] += 1 / np.log2(found[0] + 2)
+    return hits, ndcg
+
+def _evaluate_task(task):
+    users, grid, drop_fraction, k = task
+    return drop_fraction, evaluate_users(users, grid, drop_fraction, k)
+
+def _init_worker(options, held_out):
+    if is_ready():
+        engine = get_engine()  # forked from the process that built it
+    else:
+        engine = training_engine(init_engine(**options), held_out)
+        set_engine(engine)
+    # Every user is scored once per drop fraction, keeping their scores would only fill memory
+    engine.signal_cache = ResultCache(0)
+
+def run_grid(users, grid, drop_fractions, k, workers=1, engine_options=None, held_out=()):
+    """
+    Evaluate every combination of weights and drop fraction
+    param users: result of simulate_users
+    param grid: list of weights dictionaries
+    param drop_fractions: list of bias_correction drop fractions
+    param k: length of the recommendation lists
+    param workers: processes evaluating chunks of users in parallel (1 evaluates in this process)
+    param engine_options, held_out: arguments of init_engine and held out films of the engine of workers that can
+    not be forked from this process (see training_engine)
+    return: list of dictionaries with the weights, drop_fraction, hit_rate and ndcg of each combination
+    """
+    tasks = [(users[start:start + CHUNK_SIZE], grid, drop, k)
+             for drop in drop_fractions for start in range(0, len(users), CHUNK_SIZE)]
+    totals = {drop: (np.zeros(len(grid)), np.zeros(len(grid))) for drop in drop_fractions}
+    if workers <= 1:
+        outcomes = map(_evaluate_task, tasks)
+        pool = None
+    else:
+        # Forked workers share the engine built by this process instead of loading their own
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        pool = multiprocessing.get_context(method).Pool(workers, _init_worker, (engine_options or {}, held_out))
+        outcomes = pool.imap_unordered(_evaluate_task, tasks)
+    try:
+        for drop, (hits, ndcg) in outcomes:
+            totals[drop][0][:] += hits
+            totals[drop][1][:] += ndcg
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    results = []
+    for drop, (hits, ndcg) in totals.items():
+        for weights, hit_count, ndcg_sum in zip(grid, hits, ndcg):
+            results.append({"weights": weights, "drop_fraction": drop, "hit_rate": hit_count / len(users),
+                            "ndcg": ndcg_sum / len(users)})
+    return sorted(results, key=lambda r: (-r["ndcg"], -r["hit_rate"]))
+
+def parse_values(text):
+    return [float(value) for value in text.split(",")] if text else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10, help="length of the recommendation lists")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the held out films and of the simulated users")
+    parser.add_argument("--held-out", type=float, default=HELD_OUT_SHARE, help="share of the films held out")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--encoder", default=os.environ.get("ENCODER", "minilm"))
+    parser.add_argument("--query-mode", default=os.environ.get("QUERY_MODE", "encode"))
+    for name, flag in (("liked_actors", "--liked"), ("disliked_actors", "--disliked"), ("genres", "--genres"),
+                       ("directors", "--directors"), ("bonus_genre_director", "--bonus")):
+        parser.add_argument(flag, dest=name, help=f"comma separated values of the {name} weight "
+                                                  f"(default {DEFAULT_WEIGHTS[name]})")
+    parser.add_argument("--drop", default="0.2", help="comma separated bias_correction drop fractions")
+    parser.add_argument("--top", type=int, default=10, help="configurations printed")
+    parser.add_argument("--json", help="also write every result to this file")
+    args = parser.parse_args()
+
+    options = {"encoder": args.encoder, "query_mode": args.query_mode}
+    start = time.perf_counter()
+    engine = init_engine(**options)
+    held_out = held_out_films(engine, args.held_out, seed=args.seed)
+    users = simulate_users(engine, args.users, held_out, seed=args.seed)
+    # The workers (forked with it, or init_engine in _init_worker) evaluate the engine without the held out casts
+    set_engine(training_engine(engine, held_out))
+    grid = weight_grid({name: parse_values(getattr(args, name)) for name in DEFAULT_WEIGHTS})
+    drop_fractions = parse_values(args.drop)
+    print(f"Engine and {len(users)} users ready in {time.perf_counter() - start:.1f}s, evaluating "
+          f"{len(grid) * len(drop_fractions)} configurations on {args.workers} workers")
+
+    start = time.perf_counter()
+    results = run_grid(users, grid, drop_fractions, args.k, args.workers, options, held_out)
+    print(f"Evaluated in {time.perf_counter() - start:.1f}s\n")
+    names = list(DEFAULT_WEIGHTS)
+    print("  ".join(f"{name:>20}" for name in names + ["drop_fraction"]) + f"  {'hit@' + str(args.k):>8}  "
+          f"{'ndcg@' + str(args.k):>8}")
+    for r in results[:args.top]:
+        print("  ".join(f"{r['weights'][name]:>20g}" for name in names) + f"  {r['drop_fraction']:>20g}  "
+              f"{r['hit_rate']:>8.4f}  {r['ndcg']:>8.4f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"users": len(users), "k": args.k, "seed": args.seed, "results": results}, f, indent=2)
+    set_engine(None)
+
+
+if __name__ == "__main__":
+    main()
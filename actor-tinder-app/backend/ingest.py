@@ -0,0 +1,86 @@
+"""
+File: backend/ingest.py
+Description: command line tool that applies a catalog delta (CSV of new, changed or removed films, see
+embeddings3.DELTA_ACTIONS) to final_films.csv and to the stored film embeddings, encoding only the affected films.
+With --server, the delta is also sent to a running server, which patches its engine without a restart (a server with
+several workers refuses it, restart it instead).
+Usage (from the backend folder): python ingest.py delta.csv [--server http://localhost:8080]
+"""
+import argparse
+import os
+import urllib.request
+
+import pandas as pd
+
+from embeddings3 import (ACTORS_CSV, EMBEDDINGS_DIR, FILMS_CSV, apply_delta_to_table, load_catalog, load_encoder,
+                         load_or_encode_embeddings, normalize_rows, split_delta)
+
+
+def write_csv_atomically(table, path):
+    """
+    Write the table next to path first, so a crash never leaves a half written catalog
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def refresh_embeddings(films_path, actors_path, encoder, cache_dir):
+    """
+    Bring the preprocessed catalog and the embeddings artifact up to date with the films CSV (only new descriptions
+    are encoded)
+    return: number of films in the artifact
+    """
+    films, _, _ = load_catalog(films_path, actors_path, cache_dir)
+    model = load_encoder(encoder)
+    vectors = load_or_encode_embeddings(
+        films['description'].tolist(),
+        lambda texts: normalize_rows(model.encode(texts, show_progress_bar=True)),
+        model.name,
+        cache_dir,
+    )
+    return len(vectors)
+
+def send_delta(delta_path, server, token=None):
+    """
+    POST the delta CSV to the /catalog/delta route of a running server
+    return: the JSON answer of the server, as text
+    """
+    with open(delta_path, 'rb') as f:
+        body = f.read()
+    headers = {"Content-Type": "text/csv"}
+    if token:
+        headers["X-Catalog-Token"] = token
+    request = urllib.request.Request(f"{server.rstrip('/')}/catalog/delta", data=body, headers=headers,
+                                     method="POST")
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("delta", help="CSV with the columns of final_films.csv and an optional Action column")
+    parser.add_argument("--films", default=FILMS_CSV, help="catalog to patch")
+    parser.add_argument("--actors", default=ACTORS_CSV)
+    parser.add_argument("--encoder", default=os.environ.get("ENCODER", "minilm"),
+                        help="encoder of the embeddings artifact to refresh")
+    parser.add_argument("--cache-dir", default=EMBEDDINGS_DIR)
+    parser.add_argument("--no-encode", action="store_true", help="only patch the CSV, leave the artifact as is")
+    parser.add_argument("--server", help="URL of a running server that should pick up the delta")
+    parser.add_argument("--token", default=os.environ.get("CATALOG_TOKEN"), help="value of the X-Catalog-Token header")
+    args = parser.parse_args()
+
+    # Read as text, so untouched values are written back exactly as they were (no 163 -> 163.0)
+    delta = pd.read_csv(args.delta, dtype=str)
+    upserts, removed = split_delta(delta)
+    films = apply_delta_to_table(pd.read_csv(args.films, dtype=str), delta)
+    write_csv_atomically(films, args.films)
+    print(f"{len(upserts)} films added or changed, {len(removed)} removed, {len(films)} films in {args.films}")
+
+    if not args.no_encode:
+        count = refresh_embeddings(args.films, args.actors, args.encoder, args.cache_dir)
+        print(f"Embeddings artifact up to date ({count} films)")
+    if args.server:
+        print(send_delta(args.delta, args.server, args.token))
+
+
+if __name__ == "__main__":
+    main()
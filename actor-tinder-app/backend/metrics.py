@@ -0,0 +1,211 @@
+"""
+File: backend/metrics.py
+Description: counters and latency histograms of the recommendation service, exposed in the Prometheus text format
+by the /metrics route of server.py. Recording a value is a lock and a bisect (about a microsecond), so the metrics
+stay enabled in production. Each process has its own values: with serve.py every scrape reads one worker.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets, in seconds (Prometheus adds +Inf)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds of the batch size buckets
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Value that only goes up (requests, errors...), one per combination of label values
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values (durations, batch sizes) in cumulative buckets, one per combination of label values
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket (last one is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the with block, in seconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels[name] for name in self.labelnames))
+        return 0 if series is None else sum(series[0])
+
+    def total(self, **labels):
+        series = self._series.get(tuple(labels[name] for name in self.labelnames))
+        return 0.0 if series is None else series[1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _label_text(self.labelnames + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackCounter:
+    """
+    Counter whose value is read when the metrics are rendered (e.g. hits counted by the query cache itself)
+    """
+
+    def __init__(self, name, documentation, read):
+        """
+        param read: function without arguments returning the current value, or None when there is none yet
+        """
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        value = self.read()
+        if value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Set of metrics rendered together
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        return: every metric in the Prometheus text exposition format
+        """
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+class HTTPMetricsMiddleware:
+    """
+    ASGI middleware counting and timing every HTTP request by route. Routes are labelled with their template
+    ("/recommend"), never the raw path, so label values stay bounded; paths without a route are "unmatched".
+    A plain ASGI middleware costs less per request than an @app.middleware("http") function.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]  # if the app raises before answering
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")  # set by the router on the scope it was given
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route=path)
+            REQUESTS.inc(route=path, status=str(status[0]))
+            if status[0] >= 500 and status[0] != 503:  # 503 is the expected answer while the engine loads
+                ERRORS.inc(route=path)
+
+
+REGISTRY = Registry()
+
+# Stages of RecommenderEngine.rank_batch, observed once per batch of users:
+# preferences (query building), encode, similarity, bonus, top_k (selection and result tables), ann (whole scoring
+# with the approximate index)
+RECOMMEND_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "watchorpass_recommend_stage_seconds", "Time spent in each stage of a recommendation batch", ["stage"]))
+RECOMMEND_BATCH_SIZE = REGISTRY.register(Histogram(
+    "watchorpass_recommend_batch_users", "Users scored together by one recommendation batch", buckets=BATCH_BUCKETS))
+# Steps of building or patching the engine: catalog (CSV or .npz), embeddings (artifact and encoding), engine
+# (indexes, storage, ANN), delta (with_delta)
+CATALOG_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "watchorpass_catalog_load_seconds", "Time spent loading the catalog and building the engine", ["step"]))
+REQUESTS = REGISTRY.register(Counter(
+    "watchorpass_http_requests_total", "HTTP requests answered, by route and status code", ["route", "status"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "watchorpass_http_request_seconds", "Time to answer HTTP requests, by route", ["route"]))
+ERRORS = REGISTRY.register(Counter(
+    "watchorpass_errors_total", "Requests that failed with a server error, by route", ["route"]))
@@ -0,0 +1,206 @@
+"""
+File: backend/sampling.py
+Description: sampling of the actors to swipe on. ActorSampler draws them in proportion to their weights (AliasTable),
+and SessionDecks remembers the actors each session was shown, so none comes back until every actor was shown.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Sessions whose shown actors are remembered (the least recently active one is forgotten first), and how many
+# seconds of inactivity start a new deck
+MAX_SESSIONS = 500_000
+SESSION_TTL = 3600
+
+
+class AliasTable:
+    """
+    Walker / Vose alias table: after an O(n) build, draws an index with probability proportional to its weight in
+    O(1) (one uniform integer, one uniform float and a comparison), instead of a search over the cumulative weights
+    """
+
+    def __init__(self, weights):
+        """
+        param weights: 1D array of non-negative weights (all zero means uniform)
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        if not len(weights):
+            raise ValueError("An alias table needs at least one weight")
+        if weights.sum() <= 0:
+            weights = np.ones(len(weights))
+        self.weights = weights
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n, dtype=np.int32)
+        small = np.flatnonzero(scaled < 1).tolist()
+        large = np.flatnonzero(scaled >= 1).tolist()
+        # Each column keeps its own share and is topped up to 1 by a column with too much
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # What is left is 1 up to rounding errors
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng, size):
+        """
+        param rng: numpy Generator
+        param size: number of draws (with replacement)
+        return: array of indices
+        """
+        columns = rng.integers(0, len(self.prob), size)
+        return np.where(rng.random(size) < self.prob[columns], columns, self.alias[columns])
+
+class SessionDecks:
+    """
+    Actors already shown to each session, one bit per actor (n_actors / 8 bytes per session, 125 bytes for
+    top_1000.csv) in a single uint8 matrix that grows with the number of sessions. When max_sessions is reached the
+    least recently active session gives its row to the new one; a session idle for ttl seconds starts a new deck.
+    """
+
+    def __init__(self, n_actors, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, clock=time.monotonic):
+        self.n_actors = n_actors
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+        self.bits = np.zeros((min(1024, max_sessions), (n_actors + 7) // 8), dtype=np.uint8)
+        self.touched = np.zeros(len(self.bits))  # last activity of each row
+        self.rows = OrderedDict()  # session id -> row, least recently active first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes + self.touched.nbytes
+
+    def _row(self, session_id):
+        """
+        return: row of the session (a new, empty one for an unknown or expired session); call with the lock held
+        """
+        now = self.clock()
+        row = self.rows.get(session_id)
+        if row is not None:
+            self.rows.move_to_end(session_id)
+            if now - self.touched[row] > self.ttl:
+                self.bits[row] = 0
+        else:
+            if len(self.rows) < self.max_sessions:
+                row = len(self.rows)
+                if row == len(self.bits):
+                    grown = min(2 * len(self.bits), self.max_sessions)
+                    self.bits = np.concatenate([self.bits, np.zeros((grown - row, self.bits.shape[1]), np.uint8)])
+                    self.touched = np.concatenate([self.touched, np.zeros(grown - row)])
+            else:
+                _, row = self.rows.popitem(last=False)
+            self.rows[session_id] = row
+            self.bits[row] = 0
+        self.touched[row] = now
+        return row
+
+    def seen(self, session_id):
+        """
+        return: boolean array, True for the actors already shown to the session
+        """
+        with self._lock:
+            row = self._row(session_id)  # before reading self.bits, which it may grow
+            return np.unpackbits(self.bits[row], count=self.n_actors).astype(bool)
+
+    def mark(self, session_id, positions, new_deck=False):
+        """
+        param positions: actors just shown to the session
+        param new_deck: forget the actors shown before
+        """
+        self.update(session_id, lambda seen: (None, positions, new_deck))
+
+    def update(self, session_id, choose):
+        """
+        Read, choose and mark the actors of a session under one lock, so that two batches of the same session drawn
+        at the same time never show the same actor
+        param choose: function taking the boolean array of the actors already shown and returning (result, actors to
+        mark as shown, whether they start a new deck)
+        return: the result of choose
+        """
+        with self._lock:
+            row = self._row(session_id)
+            seen = np.unpackbits(self.bits[row], count=self.n_actors)
+            result, positions, new_deck = choose(seen.astype(bool))
+            if new_deck:
+                seen[:] = 0
+            seen[positions] = 1
+            self.bits[row] = np.packbits(seen)
+            return result
+
+class ActorSampler:
+    """
+    Draws actors to show in proportion to their weights (AliasTable), without repeats within a batch and, for a
+    session, without repeating actors of its previous batches until every actor was shown (then a new deck starts)
+    """
+
+    def __init__(self, weights, decks=None, seed=None):
+        """
+        param weights: weight of each actor of RecommenderEngine.all_actors (actors with weight 0 are never shown)
+        param decks: SessionDecks to keep (e.g. from the engine before a catalog delta), new ones if None
+        """
+        self.table = AliasTable(weights)
+        self.drawable = self.table.weights > 0
+        self.decks = decks if decks is not None else SessionDecks(len(self.table))
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()  # Generators are not thread safe
+
+    def _draw_distinct(self, size, excluded):
+        """
+        param excluded: boolean array of actors that must not be drawn
+        return: up to size distinct positions, in draw order
+        """
+        available = int((self.drawable & ~excluded).sum())
+        size = min(size, available)
+        picked = np.empty(0, dtype=np.int64)
+        # Rejection: O(1) per draw while most of the weight is still available
+        for _ in range(4):
+            if len(picked) >= size:
+                break
+            with self._lock:
+                candidates = self.table.draw(self.rng, 2 * size + 8)
+            candidates = candidates[~excluded[candidates]]
+            candidates = np.concatenate([picked, candidates])
+            _, first = np.unique(candidates, return_index=True)
+            picked = candidates[np.sort(first)]
+        if len(picked) < size:
+            # Nearly exhausted deck, draw the rest among the remaining actors directly
+            remaining = np.flatnonzero(self.drawable & ~excluded)
+            remaining = remaining[~np.isin(remaining, picked)]
+            with self._lock:
+                rest = self.rng.choice(remaining, size - len(picked), replace=False,
+                                       p=self.table.weights[remaining] / self.table.weights[remaining].sum())
+            picked = np.concatenate([picked, rest])
+        return picked[:size]
+
+    def sample(self, size, session_id=None):
+        """
+        param size: number of actors
+        param session_id: session whose shown actors must not come back (none if None)
+        return: array of positions in all_actors
+        """
+        if session_id is None:
+            return self._draw_distinct(size, np.zeros(len(self.table), dtype=bool))
+
+        def choose(seen):
+            picked = self._draw_distinct(size, seen)
+            if len(picked) == size:
+                return picked, picked, False
+            # Every actor was shown: the rest comes from a new deck, which starts with only the rest
+            in_batch = np.zeros(len(self.table), dtype=bool)
+            in_batch[picked] = True
+            rest = self._draw_distinct(size - len(picked), in_batch)
+            return np.concatenate([picked, rest]), rest, True
+
+        return self.decks.update(session_id, choose)
@@ -0,0 +1,130 @@
+"""
+File: backend/serve.py
+Description: pre-fork launcher for several uvicorn workers sharing one recommendation engine. The parent process
+builds the engine (model, compact catalog, indexes; the film embeddings are already a memory-mapped file), freezes
+it out of the garbage collector and then forks the workers, which serve from the same physical pages instead of each
+loading its own copy (with `uvicorn --workers N` memory grows with N).
+With a single worker this is plain uvicorn, with the engine built in the background as usual.
+Each worker has its own copy of what changes after the fork, so with several workers POST /catalog/delta is refused
+(409): apply deltas with `python ingest.py delta.csv`, which patches the CSV and the stored embeddings, then restart.
+Usage (from the backend folder): python serve.py --workers 4 [--host 0.0.0.0 --port 8080]
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+import server
+from embeddings3 import init_engine
+
+# Pending connections the shared socket keeps (same default as uvicorn)
+BACKLOG = 2048
+
+
+def preload():
+    """
+    Build the shared engine in this process, before any fork
+    return: the engine
+    """
+    engine = init_engine(**server.ENGINE_OPTIONS)
+    # Objects alive now are never collected: the collector of a worker then never writes to their headers, which
+    # would copy the pages they live on into the worker
+    gc.collect()
+    gc.freeze()
+    return engine
+
+def bind_socket(host, port):
+    """
+    Listening socket opened once by the parent and accepted on by every worker
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(sock, threads):
+    """
+    Body of a forked worker: serve the app on the shared socket until uvicorn stops
+    param threads: torch threads of this worker (0 keeps the default)
+    """
+    # The handlers of the parent are not for the workers, uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch = sys.modules.get("torch")
+    if threads and torch is not None:
+        # N workers with all the cores each would fight over them
+        torch.set_num_threads(threads)
+    config = uvicorn.Config(server.app, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def spawn(sock, threads):
+    """
+    return: pid of a new worker
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, threads)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+def supervise(sock, workers, threads):
+    """
+    Fork the workers, start a new one when one dies and stop them all on SIGTERM / SIGINT
+    """
+    pids = {spawn(sock, threads) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        pids.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, starting a new one")
+            time.sleep(1)  # no busy loop if workers keep crashing
+            pids.add(spawn(sock, threads))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--threads", type=int, default=0,
+                        help="torch threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run(server.app, host=args.host, port=args.port)
+        return
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    server.WORKERS = args.workers  # inherited by the workers, which refuse catalog deltas
+    start = time.perf_counter()
+    engine = preload()
+    print(f"Engine built in {time.perf_counter() - start:.1f}s ({len(engine.catalog)} films), "
+          f"starting {args.workers} workers with {threads} torch threads each")
+    supervise(bind_socket(args.host, args.port), args.workers, threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,87 @@
 # server.py - UPDATED CORS CONFIGURATION
+import asyncio
+import base64
+from contextlib import asynccontextmanager
+import hmac
+import io
+import json
+import logging
 import os
 import pandas as pd
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 import uvicorn
 import gc
 import random
 
 # Import your custom logic
-from embeddings3 import get_actor, recommend_movies, bias_correction, all_actors
+from batching import MAX_BATCH, MAX_WAIT_MS, MicroBatcher
+from metrics import REGISTRY, CallbackCounter, HTTPMetricsMiddleware
+from embeddings3 import (get_engine, init_engine, is_ready, recommend_movies_batch, bias_correction,
+                         apply_catalog_delta, canonical_swipes, ranked_movies_batch, request_seed, result_key,
+                         RESULT_CACHE_SIZE, RESULT_CACHE_TTL, ResultCache, DEFAULT_WEIGHTS, reweighted_movies_batch)
+from sessions import SESSION_STORE_SIZE, SessionStore
 
-app = FastAPI()
+# "minilm" is the pretrained model, "hashing" a torch-free encoder for low-memory deployments (see embeddings3.ENCODERS)
+ENCODER = os.environ.get("ENCODER", "minilm")
+# "encode" runs the model on every request's queries, "precomputed" never does (see embeddings3.QUERY_MODES)
+QUERY_MODE = os.environ.get("QUERY_MODE", "encode")
+# Approximate search for large catalogs: number of IVF clusters (0 = exact search) and clusters searched per request
+ANN_LISTS = int(os.environ.get("ANN_LISTS", "0"))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+# Film vectors kept for scoring: "float32", or "float16"/"int8" with float32 rescoring (see vectors.STORAGE_MODES)
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "float32")
+# Arguments of init_engine, shared with serve.py which builds the engine before forking the workers
+ENGINE_OPTIONS = {"encoder": ENCODER, "query_mode": QUERY_MODE, "ann_lists": ANN_LISTS, "ann_nprobe": ANN_NPROBE,
+                  "storage": EMBEDDING_STORAGE}
+# POST /catalog/delta requires this value in the X-Catalog-Token header; without it the route is disabled (404)
+CATALOG_TOKEN = os.environ.get("CATALOG_TOKEN")
+# Processes serving the app (serve.py sets it from --workers). A delta only patches the worker that receives it, so
+# with several workers deltas are refused: patch the CSV with ingest.py and restart instead
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Largest delta CSV accepted, in bytes
+CATALOG_DELTA_MAX_BYTES = int(os.environ.get("CATALOG_DELTA_MAX_BYTES", str(10 * 1024 * 1024)))
+# Micro-batching of concurrent /recommend requests: largest batch (1 = no batching) and longest wait for it to fill
+RECOMMEND_MAX_BATCH = int(os.environ.get("RECOMMEND_MAX_BATCH", str(MAX_BATCH)))
+RECOMMEND_MAX_WAIT_MS = float(os.environ.get("RECOMMEND_MAX_WAIT_MS", str(MAX_WAIT_MS)))
+# Live recommendation sessions kept by this process (see sessions.RecommendationSession); with serve.py each
+# worker has its own, a session unknown to a worker answers 404 and the client starts a new one with its swipes
+SESSIONS = int(os.environ.get("SESSIONS", str(SESSION_STORE_SIZE)))
+# /recommend ranks this many films once and answers them page by page through a cursor (see /recommend/page);
+# ranked lists are kept by each process for RANKED_LIST_TTL seconds, at most RANKED_LISTS of them. A cursor carries
+# its request, so a worker without its ranked list ranks it again instead of answering 404
+PAGE_SIZE = 15
+RANKED_LIST_SIZE = int(os.environ.get("RANKED_LIST_SIZE", "500"))
+RANKED_LISTS = int(os.environ.get("RANKED_LISTS", str(RESULT_CACHE_SIZE)))
+RANKED_LIST_TTL = float(os.environ.get("RANKED_LIST_TTL", str(RESULT_CACHE_TTL)))
+
+logger = logging.getLogger("watchorpass")
+# Why the engine could not be built by the lifespan warm up, None while it loads or once it is built
+engine_error = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Build the recommendation engine once, in the background, so "/" answers while the model warms up.
+    Under serve.py the engine is already built by the parent process and this returns at once.
+    If the build fails, "/" answers 500 from then on so the orchestrator restarts the container."""
+    async def warm_up():
+        global engine_error
+        try:
+            await asyncio.to_thread(init_engine, **ENGINE_OPTIONS)
+        except Exception as error:
+            logger.exception("Error while loading the recommendation engine")
+            engine_error = repr(error)
+
+    task = asyncio.create_task(warm_up())
+    yield
+    task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # FIXED CORS CONFIGURATION
 # Allow requests from your Vercel domain and localhost for testing
@@ -25,34 +94,140 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Counts and times every request by route, see metrics.py
+app.add_middleware(HTTPMetricsMiddleware)
+
+def cache_count(cache, attribute):
+    """Read hits or misses of a cache of the current engine (None while it is loading)."""
+    return getattr(getattr(get_engine(), cache), attribute) if is_ready() else None
+
+REGISTRY.register(CallbackCounter("watchorpass_query_cache_hits_total", "Query vectors found in the query cache",
+                                  lambda: cache_count("query_cache", "hits")))
+REGISTRY.register(CallbackCounter("watchorpass_query_cache_misses_total", "Query vectors that had to be encoded",
+                                  lambda: cache_count("query_cache", "misses")))
+REGISTRY.register(CallbackCounter("watchorpass_result_cache_hits_total", "Recommendations answered from the cache",
+                                  lambda: cache_count("result_cache", "hits")))
+REGISTRY.register(CallbackCounter("watchorpass_result_cache_misses_total", "Recommendations that had to be scored",
+                                  lambda: cache_count("result_cache", "misses")))
+
+
+def prepare_request(liked_actors, disliked_actors, weights, top_k, filters=None):
+    """
+    Canonical form of a recommendation request: sorted swipes and a bias correction seeded by them, so the same
+    swipes always give the same request (and the same entry of the result cache)
+    """
+    liked, disliked = canonical_swipes(liked_actors, disliked_actors)
+    corrected_disliked = bias_correction(disliked, drop_fraction=0.2, seed=request_seed(liked, disliked))
+    return {"liked_actors": liked, "disliked_actors": corrected_disliked, "weights": weights, "top_k": top_k,
+            "filters": filters}
+
+# Share of the dislikes left out by the bias correction
+DISLIKE_DROP_FRACTION = 0.2
+
+def dislike_dropped(session_id, actor):
+    """
+    Bias correction of a session, one swipe at a time: each dislike is left out with probability
+    DISLIKE_DROP_FRACTION, seeded by the session and the actor so a replayed swipe gets the same answer
+    """
+    return random.Random(request_seed([session_id], [actor])).random() < DISLIKE_DROP_FRACTION
+
+
+def request_weights(overrides):
+    """Default recommendation weights (embeddings3.DEFAULT_WEIGHTS) with the ones a client sent, 400 for unknown ones."""
+    unknown = set(overrides or {}) - set(DEFAULT_WEIGHTS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown weights: {', '.join(sorted(unknown))}")
+    return {**DEFAULT_WEIGHTS, **(overrides or {})}
 
 # ... rest of your code stays the same
 # 2. DATA MODELS
+class Filters(BaseModel):
+    # Bounds on the recommended films, included (see embeddings3.FILTER_COLUMNS), e.g. max_runtime=120, min_year=1990
+    min_runtime: Optional[float] = None
+    max_runtime: Optional[float] = None
+    min_year: Optional[float] = None
+    max_year: Optional[float] = None
+    min_rating: Optional[float] = None
+    max_rating: Optional[float] = None
+
+def filter_bounds(filters):
+    """The bounds that are set, as the filters dictionary of a request (None without any)."""
+    if filters is None:
+        return None
+    return filters.model_dump(exclude_none=True) or None
+
 class RecommendRequest(BaseModel):
+    # Actor names, or actor IDs from /actor-batch (an ID picks one actor when several share a name)
     liked_actors: List[str]
     disliked_actors: List[str]
+    filters: Optional[Filters] = None
+    # Overrides some or all of DEFAULT_WEIGHTS (e.g. sliders): the same swipes with other weights are only reweighted
+    weights: Optional[Dict[str, float]] = None
+
+class BatchRecommendItem(BaseModel):
+    liked_actors: List[str]
+    disliked_actors: List[str]
+    top_k: int = Field(15, ge=1)
+    weights: Optional[Dict[str, float]] = None  # overrides some or all of DEFAULT_WEIGHTS
+    filters: Optional[Filters] = None
+
+class BatchRecommendRequest(BaseModel):
+    requests: List[BatchRecommendItem]
+
+class SessionRequest(BaseModel):
+    # Swipes already made when the session starts (e.g. to start over after a 404)
+    liked_actors: List[str] = []
+    disliked_actors: List[str] = []
+    top_k: int = Field(15, ge=1)
+    weights: Optional[Dict[str, float]] = None  # overrides some or all of DEFAULT_WEIGHTS
+    filters: Optional[Filters] = None
+
+class SwipeRequest(BaseModel):
+    actor: str  # actor name or ID
+    liked: bool
 
 # 3. ROUTES
 @app.get("/")
 def health_check():
-    """Simple endpoint to check if the server is awake."""
+    """Simple endpoint to check if the server is awake; fails once the engine could not be built."""
+    if engine_error is not None:
+        raise HTTPException(status_code=500, detail=f"Recommendation engine failed to load: {engine_error}")
     return {"status": "online", "message": "WatchOrPass Backend is Active"}
 
+@app.get("/ready")
+def readiness_check():
+    """Reports ready only once the recommendation engine is loaded."""
+    if not is_ready():
+        state = "is still loading" if engine_error is None else "failed to load"
+        raise HTTPException(status_code=503, detail=f"Recommendation engine {state}")
+    return {"status": "ready"}
+
+def engine_or_503():
+    """Return the recommendation engine, or answer 503 while it is still loading."""
+    try:
+        return get_engine()
+    except RuntimeError:
+        raise HTTPException(status_code=503, detail="Recommendation engine is still loading")
+
 @app.get("/actor-batch")
-def get_actor_batch():
-    """Returns 30 random actors in a single call"""
-    import random
-    from embeddings3 import all_actors
-    # Take a random sample of 30
-    batch = random.sample(all_actors, 30)
-    return {"actors": batch}
+def get_actor_batch(session_id: Optional[str] = None):
+    """
+    Returns 30 random actors in a single call (with their IDs, which can be sent back instead of names).
+    Actors already sent to the same session_id are not sent again until every actor was.
+    """
+    # Take a weighted sample of 30
+    batch, actor_ids = engine_or_503().actor_batch(30, with_ids=True, session_id=session_id)
+    if actor_ids is None:
+        return {"actors": batch}
+    return {"actors": batch, "actor_ids": actor_ids}
 
 
 @app.get("/actor")
 def get_random_actor():
     """Return a random actor name."""
+    engine = engine_or_503()
     try:
-        name = get_actor()
+        name = engine.get_actor()
         return {"name": name}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -62,28 +237,208 @@ def actors_alias():
     return get_actor_batch()  # or whatever function backs /actor-batch
 
 
+# Concurrent /recommend requests are encoded and scored together (see batching.py)
+recommend_batcher = MicroBatcher(lambda requests: ranked_movies_batch(requests),
+                                 max_batch=RECOMMEND_MAX_BATCH, max_wait_ms=RECOMMEND_MAX_WAIT_MS)
+
+# Cursor state -> (catalog, ranked film positions) of a /recommend request, kept by this process only
+ranked_lists = ResultCache(RANKED_LISTS, RANKED_LIST_TTL)
+
+def cursor_state(payload):
+    """
+    The request of a cursor: canonical swipes, weights sent by the client and filters, as url-safe base64 JSON.
+    Any worker can rank it again, the ranked lists kept by a process only save that work
+    """
+    liked, disliked = canonical_swipes(payload.liked_actors, payload.disliked_actors)
+    state = {"liked_actors": liked, "disliked_actors": disliked, "weights": payload.weights,
+             "filters": filter_bounds(payload.filters)}
+    text = json.dumps(state, sort_keys=True, separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+def read_cursor(cursor):
+    """The request and the offset of a cursor from recommendation_page, 400 when it is not one."""
+    state, _, offset = cursor.rpartition(":")
+    try:
+        if not offset.isdigit():
+            raise ValueError(offset)
+        payload = RecommendRequest.model_validate_json(base64.urlsafe_b64decode(state.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return state, payload, int(offset)
+
+def recommendation_page(state, catalog, ranked, offset, page_size):
+    """
+    One page of a ranked list, with the cursor of the next page (None after the last one)
+    """
+    page = catalog.records(ranked[offset:offset + page_size])
+    end = offset + page_size
+    return {"recommendations": page, "next_cursor": f"{state}:{end}" if end < len(ranked) else None}
+
+async def ranked_list(engine, payload):
+    """
+    Rank RANKED_LIST_SIZE films for a /recommend request
+    return: (catalog, ranked film positions)
+    """
+    weights = request_weights(payload.weights)
+    try:
+        # 1. Apply bias correction logic (seeded by the swipes) with the recommendation weights
+        request = prepare_request(payload.liked_actors, payload.disliked_actors, weights, RANKED_LIST_SIZE,
+                                  filter_bounds(payload.filters))
+
+        # 2. Custom weights are ranked from the per-signal scores of the swipes (scored once for all the weights
+        # tried). The two paths add up the same scores in another order, which is enough to swap films with equal
+        # scores, so the path only depends on the weights: every page of a cursor comes from the same ranking
+        if weights != DEFAULT_WEIGHTS:
+            [(catalog, ranked)] = await asyncio.to_thread(reweighted_movies_batch, [request])
+            return catalog, ranked
+
+        # 3. Swipes seen recently are answered from the result cache, the others in a batch with the requests
+        # arriving meanwhile
+        ranked = engine.result_cache.get(result_key(request), count_miss=False)
+        if ranked is not None:
+            return engine.catalog, ranked
+        return await recommend_batcher.submit(request)
+
+    except Exception:
+        logger.exception("Error in recommendation")
+        raise HTTPException(status_code=500, detail="Failed to generate recommendations.")
+
+
 @app.post("/recommend")
-def get_recommendations(payload: RecommendRequest):
+async def get_recommendations(payload: RecommendRequest):
+    engine = engine_or_503()
+    catalog, ranked = await ranked_list(engine, payload)
+    # Keep the ranked list for the next pages; the same swipes, weights and filters give the same cursor
+    state = cursor_state(payload)
+    ranked_lists.put(state, (catalog, ranked))
+    return recommendation_page(state, catalog, ranked, 0, PAGE_SIZE)
+
+
+@app.get("/recommend/page")
+async def get_recommendation_page(cursor: str, page_size: int = Query(PAGE_SIZE, ge=1, le=RANKED_LIST_SIZE)):
+    """Next recommendations of a /recommend call: a slice of its ranked list, ranked again by a worker that does
+    not have it (another process, or expired)."""
+    state, payload, offset = read_cursor(cursor)
+    entry = ranked_lists.get(state)
+    if entry is None:
+        entry = await ranked_list(engine_or_503(), payload)
+        ranked_lists.put(state, entry)
+    catalog, ranked = entry
+    return recommendation_page(state, catalog, ranked, offset, page_size)
+
+
+@app.post("/recommend/batch")
+def get_batch_recommendations(payload: BatchRecommendRequest):
+    """Recommend movies to many users in one pass, results come back in request order."""
+    engine = engine_or_503()
+    weights = [request_weights(item.weights) for item in payload.requests]
     try:
-        # 1. Apply bias correction logic
-        corrected_disliked = bias_correction(payload.disliked_actors, drop_fraction=0.2)
-
-        # 2. Set recommendation weights
-        weights = {
-            "liked_actors": 1.8,
-            "disliked_actors": 0.6,
-            "genres": 0.6,
-            "directors": 0.7,
-            "bonus_genre_director": 0.1
-        }
-
-        # 3. Generate recommendations (returns a DataFrame)
-        recs_df = recommend_movies(payload.liked_actors, corrected_disliked, weights, top_k=15)
-
-        # 4. Convert DataFrame to List of Dictionaries for JSON response
-        recommendations = recs_df.to_dict(orient="records")
-        return {"recommendations": recommendations}
-    
-    except Exception as e:
-        print(f"Error in recommendation: {e}")
+        requests = [
+            prepare_request(item.liked_actors, item.disliked_actors, item_weights, item.top_k,
+                            filter_bounds(item.filters))
+            for item, item_weights in zip(payload.requests, weights)
+        ]
+        results = recommend_movies_batch(requests, engine=engine)
+        return {"results": [{"recommendations": recs} for recs in results]}
+
+    except Exception:
+        logger.exception("Error in batch recommendation")
         raise HTTPException(status_code=500, detail="Failed to generate recommendations.")
+
+
+recommendation_sessions = SessionStore(SESSIONS)
+
+def add_swipe(session_id, session, actor, liked):
+    if liked or not dislike_dropped(session_id, actor):
+        session.swipe(actor, liked)
+
+def session_or_404(session_id):
+    """Return the session, moved to the current engine, or answer 404 when it is unknown or expired."""
+    session = recommendation_sessions.get(session_id, engine_or_503())
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return session
+
+
+@app.post("/sessions")
+def create_session(payload: SessionRequest):
+    """Start a session that takes one swipe at a time and keeps the recommendations so far up to date."""
+    engine = engine_or_503()
+    session_id, session = recommendation_sessions.create(engine, request_weights(payload.weights), payload.top_k,
+                                                         filter_bounds(payload.filters))
+    for actor in payload.liked_actors:
+        add_swipe(session_id, session, actor, True)
+    for actor in payload.disliked_actors:
+        add_swipe(session_id, session, actor, False)
+    return {"session_id": session_id, "recommendations": session.recommendations()}
+
+
+@app.post("/sessions/{session_id}/swipes")
+def post_swipe(session_id: str, payload: SwipeRequest):
+    """Add one swipe to a session, returns the recommendations with it."""
+    session = session_or_404(session_id)
+    add_swipe(session_id, session, payload.actor, payload.liked)
+    return {"recommendations": session.recommendations()}
+
+
+@app.get("/sessions/{session_id}/recommendations")
+def get_session_recommendations(session_id: str, top_k: Optional[int] = Query(None, ge=1)):
+    """Recommendations for the swipes of a session so far."""
+    session = session_or_404(session_id)
+    return {"recommendations": session.recommendations(top_k)}
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not recommendation_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"status": "deleted"}
+
+
+async def read_body(request, max_bytes):
+    """
+    The body of a request, answering 413 as soon as it is larger than max_bytes (without reading the rest)
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"The body is larger than {max_bytes} bytes")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"The body is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/catalog/delta")
+async def ingest_catalog_delta(request: Request, x_catalog_token: Optional[str] = Header(None)):
+    """Apply a CSV delta of new, changed or removed films (see embeddings3.DELTA_ACTIONS) without a restart."""
+    if not CATALOG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")  # deltas are disabled without a token
+    if not hmac.compare_digest((x_catalog_token or "").encode(), CATALOG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid catalog token")
+    if WORKERS > 1:
+        raise HTTPException(status_code=409, detail=f"{WORKERS} workers serve the catalog and a delta would only "
+                                                    "patch one of them: apply it with ingest.py and restart")
+    engine_or_503()
+    body = await read_body(request, CATALOG_DELTA_MAX_BYTES)
+    try:
+        delta = pd.read_csv(io.BytesIO(body))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read the delta CSV: {e}")
+    try:
+        # Encoding the new films takes a while, requests keep being served by the old engine meanwhile
+        engine = await asyncio.to_thread(apply_catalog_delta, delta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Error while applying the catalog delta")
+        raise HTTPException(status_code=500, detail="Failed to apply the catalog delta.")
+    return {"status": "ok", "films": len(engine.catalog)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Counters and latency histograms in the Prometheus text format (see metrics.py)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,221 @@
+"""
+File: backend/sessions.py
+Description: incremental recommendation sessions (see the /sessions routes of server.py). A RecommendationSession
+keeps the running components of the preferences of one user, so a swipe costs one scoring pass instead of rebuilding
+the queries, and a SessionStore keeps the live sessions of a process.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from vectors import normalize_rows, quantized_scores, top_k_indices
+
+# Live recommendation sessions kept by a SessionStore (each holds a few bytes per genre, director and liked director)
+# and their idle expiry
+SESSION_STORE_SIZE = 2000
+SESSION_STORE_TTL = 1800
+
+
+class RecommendationSession:
+    """
+    Swipes of one user, given one at a time, with the running components of their preferences: the sum of the entity
+    vectors behind each signal (like query_mode "precomputed"), the genre counts of the liked actors and their
+    directors. A swipe only adds its own actor, directors and genres to these; the recommendations so far then take one
+    (films x dim) @ dim product and the bonus of the films, without building or encoding queries and without going over
+    the earlier swipes again. Nothing is kept per film, so the size of a session does not grow with the catalog.
+    Sessions always score every film (the ANN index is not used).
+    """
+
+    SIGNALS = ("liked_actors", "disliked_actors", "directors", "genres")
+    SIGNS = np.array([1.0, -1.0, 1.0, 1.0])  # disliked actors are subtracted, see preference_vector
+
+    def __init__(self, engine, weights, top_k=15, filters=None):
+        """
+        param engine: RecommenderEngine whose films are scored
+        param weights: dictionary of weights for each category
+        param top_k: default number of recommendations
+        param filters: bounds on the recommended films (see RecommenderEngine.filter_mask)
+        """
+        engine.ensure_entity_vectors()  # built by from_csv, only computed here for engines built otherwise
+        self.engine = engine
+        self.weights = weights
+        self.top_k = top_k
+        self.filters = filters
+        self.mask = engine.filter_mask(filters)
+        self.liked_actors, self.disliked_actors = [], []
+        self.sums = np.zeros((len(self.SIGNALS), engine.embeddings.shape[1]))  # entity vectors of each signal
+        self.genre_counts = np.zeros(len(engine.genre_names))
+        self.seen_directors = np.zeros(len(engine.director_names), dtype=bool)
+        self.director_codes = np.array([], dtype=engine.director_value_codes.dtype)  # value codes of seen_directors
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.liked_actors) + len(self.disliked_actors)
+
+    @property
+    def nbytes(self):
+        return self.sums.nbytes + self.genre_counts.nbytes + self.seen_directors.nbytes + self.director_codes.nbytes
+
+    def swipe(self, actor, liked):
+        """
+        Add one swipe to the running components
+        param actor: actor name or ID
+        param liked: True for a like, False for a dislike
+        """
+        engine = self.engine
+        names, codes = engine.resolve_actors([actor])
+        new_entities = [("actors", name, 0 if liked else 1) for name in names]  # (kind, name, signal)
+        with self._lock:
+            if not liked:
+                self.disliked_actors.append(actor)
+            else:
+                self.liked_actors.append(actor)
+                # Directors who worked with the actor and were not in the directors query yet
+                directors = np.unique(engine.actor_directors.gather(codes))
+                directors = directors[~self.seen_directors[directors]]
+                self.seen_directors[directors] = True
+                new_entities += [("directors", name, 2) for name in engine.director_names[directors].tolist()]
+                value_codes = engine.director_value_codes[directors]
+                self.director_codes = np.concatenate([self.director_codes, value_codes[value_codes >= 0]])
+
+                # Genres of the actor's films (with counting); genres seen for the first time join the genres query
+                positions = engine.actor_genres.positions(codes)
+                added = np.bincount(engine.actor_genres.items[positions], weights=engine.actor_genres.counts[positions],
+                                    minlength=len(self.genre_counts))
+                changed = np.flatnonzero(added)
+                new_entities += [("genres", engine.genre_names[g], 3) for g in changed if self.genre_counts[g] == 0]
+                self.genre_counts += added
+
+            for kind, name, signal in new_entities:
+                index, vectors = engine.entity_vectors[kind]
+                if name in index:  # unknown entities are ignored, as in mean_entity_vector
+                    self.sums[signal] += vectors[index[name]]
+
+    def bonus(self, candidates=None):
+        """
+        Bonus of the films for the swipes so far, as in RecommenderEngine.bonus_scores: their share of the genres of the
+        liked actors plus 0.1 for the films of their directors
+        param candidates: indices of the films to compute the bonus for (all films by default)
+        return: 1D float32 array with the bonus of each film (of each candidate)
+        """
+        engine = self.engine
+        with self._lock:
+            genre_counts, director_codes = self.genre_counts.copy(), self.director_codes
+        genre_matrix = engine.genre_matrix if candidates is None else engine.genre_matrix[candidates]
+        bonus = np.asarray(genre_matrix @ (genre_counts / (genre_counts.sum() or 1)), dtype=np.float32)
+        if len(director_codes):
+            director_films = engine.director_films.gather(director_codes)
+            mask = np.zeros(len(engine.catalog), dtype=bool)
+            mask[director_films] = True
+            bonus[mask if candidates is None else mask[candidates]] += np.float32(0.1)
+        return bonus
+
+    def final_scores(self):
+        """
+        return: (score of every film for the swipes so far, unit length preference vector)
+        """
+        engine = self.engine
+        with self._lock:
+            # Each signal is the mean of its entity vectors brought to unit length, then the preference too
+            norms = np.linalg.norm(self.sums, axis=1, keepdims=True)
+            weights = np.array([self.weights[name] for name in self.SIGNALS]) * self.SIGNS
+            preference = normalize_rows((weights[:, None] * self.sums / np.where(norms > 0, norms, 1)).sum(axis=0,
+                                                                                                         keepdims=True))
+            if engine.quantized is not None:
+                similarity_scores = quantized_scores(engine.quantized, engine.scales, preference)[0]
+            else:
+                similarity_scores = engine.embeddings @ preference[0]
+        bonus_weight = np.float32(self.weights["bonus_genre_director"])
+        return similarity_scores + bonus_weight * self.bonus(), preference[0]
+
+    def recommendations(self, top_k=None):
+        """
+        param top_k: number of recommendations (the one of the session by default)
+        return: list of {"Title": title} records of the movies recommended for the swipes so far
+        """
+        engine = self.engine
+        top_k = top_k or self.top_k
+        if not len(self):
+            return engine.recommend([], [], self.weights, top_k, self.filters)
+        final_scores, preference = self.final_scores()
+        n_candidates = max(engine.rescore_k, top_k)
+        if self.mask is not None:
+            final_scores = np.where(self.mask, final_scores, -np.inf)
+            n_passing = int(np.count_nonzero(self.mask))
+            top_k, n_candidates = min(top_k, n_passing), min(n_candidates, n_passing)
+        if engine.quantized is None:
+            similar_indices = top_k_indices(final_scores, top_k)
+        else:
+            # Rescore the best approximate films with the full precision vectors, like score_batch
+            candidates = np.sort(top_k_indices(final_scores, n_candidates))
+            bonus_weight = self.weights["bonus_genre_director"]
+            rescored = engine.embeddings[candidates] @ preference + bonus_weight * self.bonus(candidates)
+            similar_indices = candidates[top_k_indices(rescored, top_k)]
+        return engine.catalog.records(similar_indices)
+
+    def rebased(self, engine):
+        """
+        return: a session over another engine (e.g. after a catalog delta) with the same swipes, replayed on it
+        """
+        session = RecommendationSession(engine, self.weights, self.top_k, self.filters)
+        with self._lock:
+            swipes = [(actor, True) for actor in self.liked_actors] + [(a, False) for a in self.disliked_actors]
+        for actor, liked in swipes:
+            session.swipe(actor, liked)
+        return session
+
+class SessionStore:
+    """
+    Bounded LRU store of RecommendationSession by session ID; sessions idle for ttl seconds are dropped
+    """
+
+    def __init__(self, maxsize=SESSION_STORE_SIZE, ttl=SESSION_STORE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = OrderedDict()  # session ID -> (last activity, session)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, engine, weights, top_k=15, filters=None):
+        """
+        return: (new session ID, the new session)
+        """
+        session_id = uuid.uuid4().hex
+        session = RecommendationSession(engine, weights, top_k, filters)
+        with self._lock:
+            self._sessions[session_id] = (self.clock(), session)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return session_id, session
+
+    def get(self, session_id, engine=None):
+        """
+        param engine: engine the session must score with; a session built on another one is replayed on it
+        return: the session, or None when it is unknown or expired
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            now = self.clock()
+            if entry is None or now - entry[0] > self.ttl:
+                return None
+            session = entry[1]
+            self._sessions[session_id] = (now, session)
+        if engine is not None and session.engine is not engine:
+            session = session.rebased(engine)
+            with self._lock:
+                if session_id in self._sessions:
+                    self._sessions[session_id] = (now, session)
+        return session
+
+    def delete(self, session_id):
+        """
+        return: True if the session existed
+        """
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
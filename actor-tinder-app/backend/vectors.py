@@ -0,0 +1,92 @@
+"""
+File: backend/vectors.py
+Description: numpy helpers of the scoring code (embeddings3.py, ann.py, sessions.py): unit length rows, top-k
+selection, and the compact float16 / int8 copies of the film vectors with their approximate scores.
+"""
+import numpy as np
+
+# How the film vectors used for scoring are kept in memory: "float32" as stored, or a compact "float16" or "int8"
+# (one scale per row) copy. With a compact copy the whole catalog is scored approximately and only the best
+# RESCORE_K films are rescored with the float32 vectors, which stay in the memory mapped artifact.
+STORAGE_MODES = ("float32", "float16", "int8")
+RESCORE_K = 300
+QUANTIZED_CHUNK_SIZE = 16384  # rows converted back to float32 at once while scoring
+
+
+def normalize_rows(vectors):
+    """
+    Scale every row to unit length, so cosine similarity becomes a plain dot product
+    param vectors: 2D array
+    return: float32 array with unit rows (all-zero rows stay zero)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def as_unit_rows(vectors):
+    """
+    Same as normalize_rows, but returns the array itself (no copy, memory map kept) when it is already normalized
+    param vectors: 2D array
+    return: float32 array with unit rows
+    """
+    if isinstance(vectors, np.ndarray) and vectors.dtype == np.float32:
+        norms = np.einsum('ij,ij->i', vectors, vectors)
+        if np.all((np.abs(norms - 1) < 1e-4) | (norms == 0)):
+            return vectors
+    return normalize_rows(vectors)
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, best first, in O(n) instead of sorting all scores.
+    Ties are broken towards the higher index, like np.argsort(scores)[::-1] did.
+    param scores: 1D array
+    param k: number of indices to return
+    return: 1D array of at most k indices
+    """
+    n = len(scores)
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < n:
+        kth_score = scores[np.argpartition(scores, n - k)[n - k]]  # k-th highest score
+        above = np.flatnonzero(scores > kth_score)
+        ties = np.flatnonzero(scores == kth_score)[::-1][:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(n)
+    # Small sort of the candidates only: by score, then by index, both descending
+    order = np.lexsort((-candidates, -scores[candidates]))
+    return candidates[order]
+
+def quantize_embeddings(embeddings, mode):
+    """
+    param embeddings: 2D float array
+    param mode: "float16" or "int8"
+    return: (compact matrix, per row scales or None); for int8 a row is approximately codes * scale
+    """
+    if mode == "float16":
+        return np.asarray(embeddings, dtype=np.float16), None
+    if mode == "int8":
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown storage mode {mode!r}, expected one of {STORAGE_MODES}")
+
+def quantized_scores(quantized, scales, queries, chunk_size=QUANTIZED_CHUNK_SIZE):
+    """
+    Dot products between compact film vectors and float queries, converting a bounded chunk of rows at a time
+    param quantized, scales: result of quantize_embeddings
+    param queries: 2D array (users x dim)
+    return: 2D float32 array (users x films)
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    scores = np.empty((len(queries), len(quantized)), dtype=np.float32)
+    for start in range(0, len(quantized), chunk_size):
+        block = quantized[start:start + chunk_size].astype(np.float32)
+        scores[:, start:start + chunk_size] = queries @ block.T
+    if scales is not None:
+        scores *= scales
+    return scores
@@ -0,0 +1,59 @@
+"""
+File: conftest.py
+Description: makes the backend modules (embeddings3.py, server.py and their helpers) importable from the tests folder,
+and builds the small random engines several test files use.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "actor-tinder-app", "backend"))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+from embeddings3 import HashingEncoder, RecommenderEngine
+
+GENRES = ["Drama", "Comedy", "Action", "Horror", "Romance"]
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "random_catalog(**options): options of the random catalog of the engine "
+                                       "fixture (see random_films)")
+
+def random_films(n_films=60, n_actors=12, n_directors=9, n_genres=5, seed=0):
+    """
+    param n_films: number of films, "Film 0", "Film 1"...
+    param n_actors: actors "Actor 0", "Actor 1"... playing 3 by 3 in random films
+    param n_directors: directors "Director 0", "Director 1"... taking turns
+    param n_genres: number of the GENRES given 2 by 2 to random films
+    param seed: seed of the random choices, the same options give the same films
+    return: films table with random runtimes, release years and ratings (the ratings of films 3 and 17 missing)
+    """
+    rng = np.random.default_rng(seed)
+    actors = [f"Actor {a}" for a in range(n_actors)]
+    films = pd.DataFrame({
+        "Title": [f"Film {i}" for i in range(n_films)],
+        "Genres": [",".join(rng.choice(GENRES[:n_genres], 2, replace=False)) for _ in range(n_films)],
+        "Director": [f"Director {i % n_directors}" for i in range(n_films)],
+        "Actor_Names": [list(rng.choice(actors, 3, replace=False)) for _ in range(n_films)],
+        "Runtime": rng.integers(80, 180, n_films),
+        "releaseYear": rng.integers(1960, 2020, n_films),
+        "AverageRating": rng.uniform(4, 9, n_films).round(1),
+    })
+    films.loc[[3, 17], "AverageRating"] = np.nan
+    films["description"] = films["Title"] + " " + films["Genres"] + " " + films["Director"]
+    return films
+
+@pytest.fixture()
+def engine(request):
+    """
+    Engine over random_films, with the options of the random_catalog marker of the test (or of its file), and
+    64 dimensional hashing vectors. Test files with their own engine fixture use theirs.
+    """
+    marker = request.node.get_closest_marker("random_catalog")
+    films = random_films(**(marker.kwargs if marker else {}))
+    model = HashingEncoder(dim=64)
+    return RecommenderEngine(films, model.encode(films["description"].tolist()), model)
@@ -0,0 +1,130 @@
+"""
+File: test_actor_sampling.py
+Description: this file contains unittests for the weighted actor sampling from sampling.py module (AliasTable,
+SessionDecks, ActorSampler), the session_id of RecommenderEngine.actor_batch() and the /actor-batch route
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+from embeddings3 import HashingEncoder, RecommenderEngine
+from sampling import ActorSampler, AliasTable, SessionDecks
+from server import app
+
+
+@pytest.fixture()
+def engine():
+    """
+    Engine over 4 films: Tom Hanks plays in 3 of them, Meg Ryan in 2, Bill Pullman in 1
+    """
+    films = pd.DataFrame({
+        "Title": ["Big", "Sleepless in Seattle", "You've Got Mail", "Independence Day"],
+        "Genres": ["Comedy", "Romance", "Romance", "Action"],
+        "Director": ["Marshall", "Ephron", "Ephron", "Emmerich"],
+        "Actor_Names": [["Tom Hanks"], ["Tom Hanks", "Meg Ryan", "Bill Pullman"], ["Tom Hanks", "Meg Ryan"],
+                        ["Jeff Goldblum"]],
+        "AverageRating": [7.3, 6.8, 6.7, 7.0],
+    })
+    films["description"] = films["Title"]
+    model = HashingEncoder(dim=32)
+    return RecommenderEngine(films, model.encode(films["description"].tolist()), model)
+
+def test_alias_table_frequencies():
+    """
+    Test scenario: 200000 draws from weights 1, 2, 0 and 7
+    Should draw each index in proportion to its weight and never the one with weight 0
+    """
+    table = AliasTable([1, 2, 0, 7])
+
+    counts = np.bincount(table.draw(np.random.default_rng(0), 200_000), minlength=4) / 200_000
+
+    assert counts[2] == 0
+    assert np.allclose(counts, [0.1, 0.2, 0.0, 0.7], atol=0.01)
+
+def test_session_never_repeats_until_deck_is_exhausted():
+    """
+    Test scenario: batches of 3 out of 10 actors for one session, and a batch without a session
+    Should show the 10 actors once over the first batches, then start a new deck; other calls are unaffected
+    """
+    sampler = ActorSampler(np.arange(1, 11), seed=0)
+
+    batches = [sampler.sample(3, "s1").tolist() for _ in range(3)]
+    shown = sum(batches, [])
+    assert len(set(shown)) == 9
+    last = sampler.sample(3, "s1").tolist()
+
+    # The last unseen actor comes first, then two from the new deck, which are not shown again right away
+    assert len(set(last)) == 3 and (set(range(10)) - set(shown)) <= set(last)
+    assert not set(last[1:]) & set(sampler.sample(8, "s1").tolist())
+    assert len(set(sampler.sample(10).tolist())) == 10
+
+def test_concurrent_batches_of_a_session(monkeypatch):
+    """
+    Test scenario: 8 threads drawing a batch of 10 out of 100 actors for the same session at the same time, with
+    slow draws so that they overlap
+    Should never show an actor twice
+    """
+    sampler = ActorSampler(np.ones(100), seed=0)
+    draw = sampler._draw_distinct
+
+    def slow_draw(size, excluded):
+        time.sleep(0.01)
+        return draw(size, excluded)
+
+    monkeypatch.setattr(sampler, "_draw_distinct", slow_draw)
+    with ThreadPoolExecutor(8) as pool:
+        batches = list(pool.map(lambda _: sampler.sample(10, "s1").tolist(), range(8)))
+
+    shown = sum(batches, [])
+    assert len(shown) == len(set(shown)) == 80
+
+def test_session_decks_evict_and_expire():
+    """
+    Test scenario: 3 sessions with room for 2, then a session idle for longer than the TTL
+    Should forget the least recently active session and reset the expired one, in 1 bit per actor
+    """
+    now = [0.0]
+    decks = SessionDecks(20, max_sessions=2, ttl=10, clock=lambda: now[0])
+    decks.mark("a", [1, 2])
+    decks.mark("b", [3])
+    decks.seen("a")  # a is now more recent than b
+    decks.mark("c", [4])
+
+    assert len(decks) == 2 and "b" not in decks.rows
+    assert np.flatnonzero(decks.seen("a")).tolist() == [1, 2]
+    assert decks.bits.shape[1] == 3  # 20 actors in 3 bytes
+    now[0] = 11.0
+    assert not decks.seen("a").any()
+
+def test_actor_weights(engine):
+    """
+    Test scenario: weights of the actors by number of films, by ratings and uniformly
+    Should count each film of an actor once and sum the ratings of their films
+    """
+    films = dict(zip(engine.all_actors, engine.actor_weights("films")))
+    ratings = dict(zip(engine.all_actors, engine.actor_weights("rating")))
+
+    assert films == {"Bill Pullman": 1, "Jeff Goldblum": 1, "Meg Ryan": 2, "Tom Hanks": 3}
+    assert ratings["Tom Hanks"] == pytest.approx(7.3 + 6.8 + 6.7)
+    assert engine.actor_weights("uniform").tolist() == [1, 1, 1, 1]
+    with pytest.raises(ValueError):
+        engine.actor_weights("popularity")
+
+def test_actor_batch_session_route(engine):
+    """
+    Test scenario: the server is asked twice for actors with the same session_id, out of only 4 actors
+    Should send each actor once in the first batch, then start over
+    """
+    embeddings3.set_engine(engine)
+    try:
+        client = TestClient(app)
+        first = client.get("/actor-batch", params={"session_id": "abc"}).json()
+        second = client.get("/actor-batch", params={"session_id": "abc"}).json()
+    finally:
+        embeddings3.set_engine(None)
+
+    assert sorted(first["actors"]) == sorted(second["actors"]) == sorted(engine.all_actors)
@@ -0,0 +1,102 @@
+"""
+File: test_ann_index.py
+Description: this file contains unittests for the approximate nearest neighbour index (IVFIndex) from ann.py module
+and for recommending with it
+"""
+import numpy as np
+import pandas as pd
+from ann import IVFIndex
+from embeddings3 import RecommenderEngine, HashingEncoder
+from vectors import normalize_rows, top_k_indices
+
+
+def random_unit_vectors(n, dim, seed=0):
+    """
+    Create n random unit vectors grouped around a few directions, like real film embeddings
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((8, dim))
+    return normalize_rows(centers[rng.integers(0, 8, size=n)] + 0.5 * rng.standard_normal((n, dim)))
+
+def test_ivf_lists_cover_every_film():
+    """
+    Test scenario: building an index over 1000 films
+    Should put every film in exactly one cluster
+    """
+    embeddings = random_unit_vectors(1000, 16)
+
+    index = IVFIndex.build(embeddings, n_lists=20)
+
+    assert index.n_lists == 20
+    assert sorted(index.list_ids.tolist()) == list(range(1000))
+    assert index.list_offsets[-1] == 1000
+
+def test_ivf_search_all_lists_is_exact():
+    """
+    Test scenario: searching every cluster
+    Should find the same top films as exact search
+    """
+    embeddings = random_unit_vectors(1000, 16)
+    index = IVFIndex.build(embeddings, n_lists=20)
+    query = random_unit_vectors(1, 16, seed=1)[0]
+
+    candidates = index.search(query, nprobe=20)
+    approximate = candidates[top_k_indices(embeddings[candidates] @ query, 10)]
+
+    assert np.array_equal(approximate, top_k_indices(embeddings @ query, 10))
+
+def test_ivf_search_returns_enough_candidates():
+    """
+    Test scenario: the closest cluster holds fewer films than requested
+    Should search more clusters until there are enough candidates
+    """
+    embeddings = random_unit_vectors(1000, 16)
+    index = IVFIndex.build(embeddings, n_lists=50)
+
+    candidates = index.search(embeddings[0], min_candidates=200, nprobe=1)
+
+    assert len(candidates) >= 200
+    assert len(np.unique(candidates)) == len(candidates)
+
+def test_ivf_save_and_load(tmp_path):
+    """
+    Test scenario: the index is stored next to the embeddings and loaded again
+    Should give the same index for the same embeddings and nothing for other embeddings
+    """
+    embeddings = random_unit_vectors(500, 8)
+    index = IVFIndex.build(embeddings, n_lists=10, fingerprint="abc")
+    path = str(tmp_path / "ann.npz")
+    index.save(path)
+
+    loaded = IVFIndex.load(path, fingerprint="abc")
+    assert np.array_equal(loaded.centroids, index.centroids)
+    assert np.array_equal(loaded.list_ids, index.list_ids)
+    assert IVFIndex.load(path, fingerprint="changed catalog") is None
+
+def test_recommend_with_ann_index():
+    """
+    Test scenario: the engine recommends through the ANN index, searching every cluster
+    Should give the same movies as exact search (the bonus is applied to the candidates)
+    """
+    rng = np.random.default_rng(0)
+    actors = [f"Actor {i}" for i in range(40)]
+    genres = ["Drama", "Comedy", "Action", "Crime"]
+    n = 300
+    films = pd.DataFrame({
+        "Title": [f"Film {i}" for i in range(n)],
+        "Genres": [",".join(rng.choice(genres, size=2, replace=False)) for _ in range(n)],
+        "Director": [f"Director {i % 30}" for i in range(n)],
+        "Actor_Names": [list(rng.choice(actors, size=3, replace=False)) for _ in range(n)],
+    })
+    films["description"] = [f"Genres: {g}. Director: {d}. Actors: {', '.join(a)}."
+                            for g, d, a in zip(films["Genres"], films["Director"], films["Actor_Names"])]
+    encoder = HashingEncoder(dim=128)
+    engine = RecommenderEngine(films, encoder.encode(films["description"].tolist()), encoder)
+    weights = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7,
+               "bonus_genre_director": 0.1}
+
+    exact = engine.recommend(["Actor 1", "Actor 2"], ["Actor 3"], weights, 10)
+    engine.build_ann_index(n_lists=8, nprobe=8)
+    approximate = engine.recommend(["Actor 1", "Actor 2"], ["Actor 3"], weights, 10)
+
+    assert approximate == exact
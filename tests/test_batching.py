@@ -0,0 +1,82 @@
+"""
+File: test_batching.py
+Description: this file contains unittests for the micro-batching of concurrent requests from batching.py module
+(MicroBatcher) and its use by the /recommend route of server.py
+"""
+import asyncio
+import threading
+
+import pytest
+from batching import MicroBatcher
+
+
+class RecordingProcess:
+    """
+    Process function that doubles its items and remembers the batches it received
+    """
+    def __init__(self, fail_on=None, delay=0.0):
+        self.batches = []
+        self.fail_on = fail_on
+        self.delay = delay
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        if self.delay:
+            threading.Event().wait(self.delay)
+        if self.fail_on in items:
+            raise ValueError(f"invalid item {self.fail_on}")
+        return [item * 2 for item in items]
+
+
+def submit_all(batcher, items):
+    """
+    Submit every item from its own coroutine at the same time
+    return: results (or exceptions) in the order of items
+    """
+    async def run():
+        return await asyncio.gather(*(batcher.submit(item) for item in items), return_exceptions=True)
+    return asyncio.run(run())
+
+def test_concurrent_items_share_one_batch():
+    """
+    Test scenario: 5 items submitted together, with room for all of them in a batch
+    Should process them in a single call and give each coroutine its own result
+    """
+    process = RecordingProcess()
+    batcher = MicroBatcher(process, max_batch=8, max_wait_ms=20)
+
+    assert submit_all(batcher, [1, 2, 3, 4, 5]) == [2, 4, 6, 8, 10]
+    assert process.batches == [[1, 2, 3, 4, 5]]
+    assert (batcher.batches, batcher.items) == (1, 5)
+
+def test_batches_bounded_by_max_batch():
+    """
+    Test scenario: 7 items submitted together with max_batch=3
+    Should never process more than 3 items at once and keep every item exactly once
+    """
+    process = RecordingProcess(delay=0.01)
+    batcher = MicroBatcher(process, max_batch=3, max_wait_ms=1000)
+
+    assert submit_all(batcher, list(range(7))) == [0, 2, 4, 6, 8, 10, 12]
+    assert max(len(batch) for batch in process.batches) == 3
+    assert sorted(item for batch in process.batches for item in batch) == list(range(7))
+
+def test_failing_item_only_fails_its_request():
+    """
+    Test scenario: one invalid item in a batch
+    Should raise its error for that item only and still answer the others
+    """
+    batcher = MicroBatcher(RecordingProcess(fail_on=2), max_batch=8, max_wait_ms=20)
+
+    results = submit_all(batcher, [1, 2, 3])
+
+    assert results[0] == 2 and results[2] == 6
+    assert isinstance(results[1], ValueError)
+
+def test_invalid_settings():
+    """
+    Test scenario: a batcher without room for a single item
+    Should raise ValueError
+    """
+    with pytest.raises(ValueError):
+        MicroBatcher(RecordingProcess(), max_batch=0)
@@ -0,0 +1,144 @@
+"""
+File: test_catalog.py
+Description: this file contains unittests for the vectorized catalog loading from embeddings3.py module:
+parse_cast_column(), movie_texts(), build_actor_mapping(), the preprocessed catalog cache of load_catalog() and the
+compact Catalog the engine keeps
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import embeddings3
+from embeddings3 import (Catalog, build_actor_mapping, create_movie_text, load_catalog, movie_texts, parse_cast,
+                         parse_cast_column)
+
+ACTOR_MAP = {"nm1": "Leonardo DiCaprio", "nm2": "Kate Winslet", "nm3": "Simon Pegg"}
+
+
+@pytest.fixture()
+def csv_files(tmp_path):
+    """
+    Small final_films.csv and top_1000.csv files, with a missing Director and a film without known actors
+    """
+    films = pd.DataFrame({
+        "Code": ["tt1", "tt2", "tt3"],
+        "Title": ["Titanic", "Hot Fuzz", "Unknown"],
+        "Runtime": [194, 121, 90],
+        "Genres": ["Drama,Romance", "Comedy, Action", "Drama"],
+        "AverageRating": [7.9, 7.8, 5.0],
+        "Cast": ["['nm1', 'nm2', 'nm1']", "['nm3', 'nm9']", "['nm9']"],
+        "Director": ["nm10", None, "nm11,nm12"],
+    })
+    films_path, actors_path = tmp_path / "films.csv", tmp_path / "actors.csv"
+    films.to_csv(films_path, index=False)
+    pd.DataFrame({"Const": list(ACTOR_MAP), "Name": list(ACTOR_MAP.values())}).to_csv(actors_path, index=False)
+    return str(films_path), str(actors_path)
+
+def test_parse_cast_column_matches_parse_cast():
+    """
+    Test scenario: casts with repeated, unknown and missing IDs and an invalid string
+    Should give the same lists as parse_cast on every row
+    """
+    cast = pd.Series(["['nm1', 'nm2', 'nm1']", "['nm9', 'nm3']", None, "not a list", "[]"])
+
+    assert parse_cast_column(cast, ACTOR_MAP) == [parse_cast(c, ACTOR_MAP) for c in cast]
+
+def test_movie_texts_matches_create_movie_text():
+    """
+    Test scenario: films with and without Genres and Director
+    Should give the same descriptions as create_movie_text
+    """
+    films = pd.DataFrame({
+        "Genres": ["Drama", None],
+        "Director": [None, "Nolan"],
+        "Actor_Names": [["Kate Winslet", "Leonardo DiCaprio"], []],
+    })
+
+    assert movie_texts(films).tolist() == [create_movie_text(row) for _, row in films.iterrows()]
+
+def test_build_actor_mapping_order_and_duplicates():
+    """
+    Test scenario: an actor listed twice in a cast and a film with 2 directors
+    Should keep genres in table order (once per listing) and split the directors
+    """
+    films = pd.DataFrame({
+        "Genres": ["Drama", "Comedy,Drama"],
+        "Director": ["Cameron", "Wright, Frost"],
+        "Actor_Names": [["Kate Winslet", "Kate Winslet"], ["Simon Pegg", "Kate Winslet"]],
+    })
+
+    actor_to_directors, actor_to_genres = build_actor_mapping(films)
+
+    assert actor_to_genres["Kate Winslet"] == ["Drama", "Drama", "Comedy", "Drama"]
+    assert actor_to_directors["Kate Winslet"] == {"Cameron", "Wright", "Frost"}
+    assert actor_to_directors["Simon Pegg"] == {"Wright", "Frost"}
+
+def test_load_catalog_cache_round_trip(csv_files, tmp_path, monkeypatch):
+    """
+    Test scenario: the catalog is loaded twice from unchanged CSV files
+    Should write the cache the first time and give back the same table and indexes without parsing the second time
+    """
+    films, actor_map, indexes = load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"))
+    monkeypatch.setattr(embeddings3, "prepare_films", lambda *args: pytest.fail("the CSV was parsed again"))
+
+    cached_films, cached_map, cached_indexes = load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"))
+
+    pd.testing.assert_frame_equal(cached_films, films)
+    assert cached_map == actor_map
+    assert cached_films['Actor_Names'].tolist() == [["Leonardo DiCaprio", "Kate Winslet", "Leonardo DiCaprio"],
+                                                    ["Simon Pegg"], []]
+    assert cached_indexes["genre_index"] == indexes["genre_index"]
+    assert (cached_indexes["genre_matrix"] != indexes["genre_matrix"]).nnz == 0
+    assert cached_indexes["director_index"] == indexes["director_index"]
+    assert np.array_equal(cached_indexes["film_directors"], indexes["film_directors"])
+
+def test_load_catalog_cache_invalidated(csv_files, tmp_path):
+    """
+    Test scenario: the films CSV changed after the cache was written
+    Should parse the CSV again instead of using the stale cache
+    """
+    load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"))
+    films = pd.read_csv(csv_files[0])
+    films.loc[0, "Title"] = "Titanic (1997)"
+    films.to_csv(csv_files[0], index=False)
+
+    reloaded, _, _ = load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"))
+
+    assert reloaded.loc[0, "Title"] == "Titanic (1997)"
+
+def test_compact_catalog_round_trip(csv_files, tmp_path):
+    """
+    Test scenario: a prepared table (missing Director, film without known actors, a title listed twice) kept as a
+    Catalog
+    Should rebuild the same table, read columns and casts without pandas and store the repeated title once
+    """
+    films, _, _ = load_catalog(*csv_files, cache_dir=None)
+    films = pd.concat([films, films.iloc[[0]]], ignore_index=True)
+
+    catalog = Catalog.from_frame(films)
+
+    pd.testing.assert_frame_equal(catalog.to_frame(), films)
+    assert len(catalog) == 4 and "Runtime" in catalog and "Actor_Names" in catalog and "Plot" not in catalog
+    assert catalog.column("Director") == ["nm10", None, "nm11,nm12", "nm10"]
+    assert catalog.column("Runtime").tolist() == [194, 121, 90, 194]
+    assert catalog.casts() == films["Actor_Names"].tolist()
+    assert catalog.titles == ["Titanic", "Hot Fuzz", "Unknown"]
+    assert catalog.records([3, 1]) == [{"Title": "Titanic"}, {"Title": "Hot Fuzz"}]
+    with pytest.raises(KeyError):
+        catalog.column("Plot")
+
+def test_load_compact_catalog(csv_files, tmp_path, monkeypatch):
+    """
+    Test scenario: the catalog loaded as a Catalog from the CSV files, then from the cache
+    Should give the same films as the table both times, the second time without building a table
+    """
+    films, _, _ = load_catalog(*csv_files, cache_dir=None)
+    parsed, _, _ = load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"), compact=True)
+    monkeypatch.setattr(embeddings3, "catalog_frame", lambda *args: pytest.fail("the table was built"))
+
+    cached, _, _ = load_catalog(*csv_files, cache_dir=str(tmp_path / "cache"), compact=True)
+
+    assert cached.titles == parsed.titles and cached.casts() == parsed.casts() == films["Actor_Names"].tolist()
+    assert cached["description"] == films["description"].tolist()
+    assert np.array_equal(cached.title_codes, parsed.title_codes)
+    monkeypatch.undo()
+    pd.testing.assert_frame_equal(cached.to_frame(), films)
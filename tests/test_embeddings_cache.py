@@ -0,0 +1,78 @@
+"""
+File: test_embeddings_cache.py
+Description: this file contains unittests for the on-disk film embeddings artifact from embeddings3.py module:
+load_or_encode_embeddings(), load_embeddings_artifact()
+"""
+import numpy as np
+from embeddings3 import load_or_encode_embeddings, load_embeddings_artifact
+
+
+class CountingEncoder:
+    """
+    Fake encoder that remembers which texts it had to encode
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        # Deterministic 2D vector per text so rows can be compared
+        return np.array([[len(t), sum(map(ord, t)) % 97] for t in texts], dtype=np.float32)
+
+
+def test_artifact_created_and_memory_mapped(tmp_path):
+    """
+    Test scenario: no artifact exists yet
+    Should encode every description once and return a memory mapped array
+    """
+    encoder = CountingEncoder()
+    descriptions = ["Sad movie", "Funny movie", "Interesting movie"]
+
+    result = load_or_encode_embeddings(descriptions, encoder, "fake-model", cache_dir=str(tmp_path))
+
+    assert encoder.calls == [descriptions]
+    assert isinstance(result, np.memmap)
+    assert np.array_equal(result, encoder(descriptions))
+
+def test_artifact_reused_without_encoding(tmp_path):
+    """
+    Test scenario: the catalog did not change since the last run
+    Should not call the encoder at all
+    """
+    descriptions = ["Sad movie", "Funny movie"]
+    load_or_encode_embeddings(descriptions, CountingEncoder(), "fake-model", cache_dir=str(tmp_path))
+
+    encoder = CountingEncoder()
+    result = load_or_encode_embeddings(descriptions, encoder, "fake-model", cache_dir=str(tmp_path))
+
+    assert encoder.calls == []
+    assert result.shape == (2, 2)
+
+def test_artifact_only_encodes_changed_rows(tmp_path):
+    """
+    Test scenario: one description changed, one film was added and the order of films changed
+    Should encode only the new texts and keep the stored vectors for the rest
+    """
+    load_or_encode_embeddings(["Sad movie", "Funny movie", "Old movie"], CountingEncoder(), "fake-model",
+                              cache_dir=str(tmp_path))
+
+    encoder = CountingEncoder()
+    descriptions = ["Funny movie", "Sad movie", "Remastered movie", "Brand new movie"]
+    result = load_or_encode_embeddings(descriptions, encoder, "fake-model", cache_dir=str(tmp_path))
+
+    assert encoder.calls == [["Remastered movie", "Brand new movie"]]
+    assert np.array_equal(result, CountingEncoder()(descriptions))
+
+def test_artifact_keyed_by_model(tmp_path):
+    """
+    Test scenario: the artifact was built by another model
+    Should not be reused
+    """
+    load_or_encode_embeddings(["Sad movie"], CountingEncoder(), "fake-model", cache_dir=str(tmp_path))
+
+    vectors, hashes = load_embeddings_artifact("other-model", cache_dir=str(tmp_path))
+    assert vectors is None and hashes is None
+
+    encoder = CountingEncoder()
+    load_or_encode_embeddings(["Sad movie"], encoder, "other-model", cache_dir=str(tmp_path))
+    assert encoder.calls == [["Sad movie"]]
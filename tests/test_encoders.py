@@ -0,0 +1,82 @@
+"""
+File: test_encoders.py
+Description: this file contains unittests for the torch-free HashingEncoder from embeddings3.py module and for
+building a whole engine with it, offline and without model weights
+"""
+import numpy as np
+import pytest
+from embeddings3 import HashingEncoder, RecommenderEngine, load_encoder
+
+
+def test_hashing_encoder_unit_vectors():
+    """
+    Test scenario: encoding a few texts
+    Should give one unit length float32 vector per text, the same in every call
+    """
+    encoder = HashingEncoder(dim=64)
+    texts = ["Movies featuring actors like Tom Hanks.", "Genres: Drama. Director: Nolan. Actors: Tom Hanks."]
+
+    vectors = encoder.encode(texts)
+
+    assert vectors.shape == (2, 64)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), [1.0, 1.0], rtol=1e-5)
+    assert np.array_equal(vectors, encoder.encode(texts))
+
+def test_hashing_encoder_matches_names():
+    """
+    Test scenario: a query about an actor and two film descriptions
+    Should find the film with this actor more similar than the film with another actor sharing the first name
+    """
+    encoder = HashingEncoder()
+    query, with_actor, other_actor = encoder.encode([
+        "Movies featuring actors like Tom Hanks.",
+        "Genres: Comedy. Director: Zemeckis. Actors: Tom Hanks, Robin Wright.",
+        "Genres: Comedy. Director: Zemeckis. Actors: Tom Cruise, Robin Williams.",
+    ])
+
+    assert query @ with_actor > query @ other_actor
+
+def test_load_encoder_unknown():
+    """
+    Test scenario: asking for an encoder backend that does not exist
+    Should raise a ValueError
+    """
+    with pytest.raises(ValueError):
+        load_encoder("word2vec")
+
+def test_engine_from_csv_with_hashing_encoder(tmp_path):
+    """
+    Test scenario: building the engine from the real CSV files with the lightweight encoder
+    Should work offline and recommend films with the liked actor first
+    """
+    engine = RecommenderEngine.from_csv(encoder="hashing", cache_dir=str(tmp_path))
+    weights = {
+        "liked_actors": 1.8,
+        "disliked_actors": 0.6,
+        "genres": 0.6,
+        "directors": 0.7,
+        "bonus_genre_director": 0.1
+    }
+
+    recs = engine.recommend(["Tom Hanks"], [], weights, top_k=3)
+
+    top_film = engine.films[engine.films["Title"] == recs[0]["Title"]].iloc[0]
+    assert "Tom Hanks" in top_film["Actor_Names"]
+
+def test_engine_from_csv_without_cache(tmp_path):
+    """
+    Test scenario: building the engine with cache_dir=None, with and without the ANN index
+    Should encode every film without storing anything and recommend like an engine built with a cache
+    """
+    cached = RecommenderEngine.from_csv(encoder="hashing", cache_dir=str(tmp_path))
+    weights = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7,
+               "bonus_genre_director": 0.1}
+
+    for ann_lists in (0, 4):
+        engine = RecommenderEngine.from_csv(encoder="hashing", cache_dir=None, ann_lists=ann_lists)
+
+        assert engine.cache_dir is None
+        np.testing.assert_allclose(engine.embeddings, cached.embeddings, atol=1e-6)
+        assert engine.recommend(["Tom Hanks"], [], weights, top_k=3) == cached.recommend(["Tom Hanks"], [], weights,
+                                                                                         top_k=3)
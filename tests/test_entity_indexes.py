@@ -0,0 +1,135 @@
+"""
+File: test_entity_indexes.py
+Description: this file contains unittests for the integer-coded actor / director / genre indexes from embeddings3.py
+module: PostingLists, build_entity_indexes() and how RecommenderEngine uses them for the preferences of a user
+"""
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+from embeddings3 import (HashingEncoder, PostingLists, RecommenderEngine, build_actor_mapping, load_catalog,
+                         prepare_films)
+from server import app
+
+# Two different actors called "Chris Evans"
+ACTOR_MAP = {"nm1": "Chris Evans", "nm2": "Chris Evans", "nm3": "Scarlett Johansson"}
+
+
+@pytest.fixture()
+def engine():
+    """
+    Engine over 3 films, where each Chris Evans plays in a different film
+    """
+    raw = pd.DataFrame({
+        "Code": ["tt1", "tt2", "tt3"],
+        "Title": ["Captain America", "Not Another Teen Movie", "Lost in Translation"],
+        "Genres": ["Action,Adventure", "Comedy", "Drama,Comedy"],
+        "Cast": ["['nm1', 'nm3']", "['nm2']", "['nm3']"],
+        "Director": ["Johnston", "Gallen", "Coppola"],
+    })
+    films = prepare_films(raw, ACTOR_MAP)
+    model = HashingEncoder(dim=32)
+    return RecommenderEngine(films, model.encode(films['description'].tolist()), model, actor_map=ACTOR_MAP)
+
+def test_posting_lists_from_pairs_and_gather():
+    """
+    Test scenario: pairs given out of key order, a key without items and a key asked twice
+    Should keep the items of each key in order and concatenate them in the order of the keys
+    """
+    lists = PostingLists.from_pairs([2, 0, 2, 0], [5, 1, 6, 3], n_keys=3)
+
+    assert len(lists) == 3
+    assert lists[0].tolist() == [1, 3] and lists[1].tolist() == [] and lists[2].tolist() == [5, 6]
+    assert lists.gather([2, 1, 0, 2]).tolist() == [5, 6, 1, 3, 5, 6]
+    assert lists.gather([]).tolist() == []
+
+def test_posting_lists_distinct():
+    """
+    Test scenario: genres reached through the films of each actor
+    Should keep every genre once, in order of first appearance, with how often it appears
+    """
+    actor_films = PostingLists.from_pairs([0, 0, 0, 1], [0, 1, 0, 2], n_keys=2)
+    film_genres = PostingLists.from_pairs([0, 0, 1, 2], [3, 1, 1, 0], n_keys=3)
+
+    actor_genres = PostingLists.distinct(actor_films, film_genres)
+
+    assert actor_genres[0].tolist() == [3, 1]
+    assert actor_genres.counts[actor_genres.offsets[0]:actor_genres.offsets[1]].tolist() == [2, 3]
+    assert actor_genres[1].tolist() == [0]
+
+def test_actors_sharing_a_name(engine):
+    """
+    Test scenario: two actors with the same name
+    Should list both in the batch with their IDs, pick one by ID and both by name
+    """
+    assert engine.all_actors == ["Chris Evans", "Chris Evans", "Scarlett Johansson"]
+    assert engine.all_actor_ids == ["nm1", "nm2", "nm3"]
+
+    by_id = engine.build_preferences(["nm1"], [])
+    by_name = engine.build_preferences(["Chris Evans"], [])
+
+    assert by_id["entities"]["liked_actors"] == ["Chris Evans"]
+    assert by_id["bonus_directors"] == {"Johnston"}
+    assert by_id["genre_distribution"] == {"Action": 0.5, "Adventure": 0.5}
+    assert by_name["bonus_directors"] == {"Johnston", "Gallen"}
+    assert by_name["genre_distribution"] == pytest.approx({"Action": 1 / 3, "Adventure": 1 / 3, "Comedy": 1 / 3})
+
+def test_preferences_match_name_dictionaries(engine):
+    """
+    Test scenario: an engine keyed by name (no actor map) and the old actor_to_directors / actor_to_genres maps
+    Should give the same directors and genre distribution as counting the genres of every listing
+    """
+    films = engine.films.drop(columns=['Cast'])
+    by_name = RecommenderEngine(films, engine.embeddings, engine.model)
+    actor_to_directors, actor_to_genres = build_actor_mapping(films)
+    liked = ["Scarlett Johansson", "Chris Evans"]
+
+    preferences = by_name.build_preferences(liked, [])
+
+    counter = Counter(g for actor in liked for g in actor_to_genres[actor])
+    total = sum(counter.values())
+    assert preferences["genre_distribution"] == pytest.approx({g: c / total for g, c in counter.items()})
+    assert list(preferences["genre_distribution"]) == list(counter)
+    assert preferences["bonus_directors"] == set().union(*(actor_to_directors[actor] for actor in liked))
+    genre_columns = [by_name.genre_index[g] for g in counter]
+    np.testing.assert_allclose(preferences["genre_weights"][genre_columns], [c / total for c in counter.values()])
+
+def test_entity_indexes_cached(tmp_path):
+    """
+    Test scenario: the catalog is loaded twice from unchanged CSV files
+    Should give back the same posting lists and actor IDs from the cache
+    """
+    pd.DataFrame({
+        "Code": ["tt1", "tt2"], "Title": ["Captain America", "Not Another Teen Movie"],
+        "Genres": ["Action", "Comedy"], "Cast": ["['nm1', 'nm3']", "['nm2']"], "Director": ["Johnston", None],
+    }).to_csv(tmp_path / "films.csv", index=False)
+    pd.DataFrame({"Const": list(ACTOR_MAP), "Name": list(ACTOR_MAP.values())}).to_csv(tmp_path / "actors.csv",
+                                                                                     index=False)
+    paths = str(tmp_path / "films.csv"), str(tmp_path / "actors.csv")
+
+    _, _, indexes = load_catalog(*paths, cache_dir=str(tmp_path / "cache"))
+    _, _, cached = load_catalog(*paths, cache_dir=str(tmp_path / "cache"))
+
+    assert cached["actor_ids"].tolist() == indexes["actor_ids"].tolist() == ["nm1", "nm3", "nm2"]
+    assert cached["actor_names"].tolist() == indexes["actor_names"].tolist()
+    for name in embeddings3.ENTITY_POSTING_LISTS:
+        assert np.array_equal(cached[name].offsets, indexes[name].offsets)
+        assert np.array_equal(cached[name].items, indexes[name].items)
+
+def test_actor_batch_returns_ids(engine):
+    """
+    Test scenario: the server asks for a batch of actors from an engine that knows their IDs
+    Should return one ID per actor name
+    """
+    embeddings3.set_engine(engine)
+    try:
+        batch = TestClient(app).get("/actor-batch").json()
+
+        assert sorted(batch["actors"]) == ["Chris Evans", "Chris Evans", "Scarlett Johansson"]
+        assert sorted(batch["actor_ids"]) == ["nm1", "nm2", "nm3"]
+        assert all(ACTOR_MAP[i] == name for i, name in zip(batch["actor_ids"], batch["actors"]))
+    finally:
+        embeddings3.set_engine(None)
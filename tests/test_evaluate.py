@@ -0,0 +1,115 @@
+"""
+File: test_evaluate.py
+Description: this file contains unittests for the offline evaluation from evaluate.py module (held_out_films,
+training_engine, simulate_users, weight_grid, run_grid)
+"""
+import pytest
+import embeddings3
+from embeddings3 import DEFAULT_WEIGHTS, RecommenderEngine, bias_correction, request_seed
+from evaluate import held_out_films, run_grid, simulate_users, training_engine, weight_grid
+
+# 60 films with random casts of 20 actors, see conftest.random_films
+pytestmark = pytest.mark.random_catalog(n_actors=20, seed=2)
+
+
+@pytest.fixture()
+def held_out(engine):
+    return held_out_films(engine, seed=1)
+
+@pytest.fixture()
+def training(engine, held_out):
+    """
+    Engine without the casts of the held out films, shared by the processes of run_grid
+    """
+    training = training_engine(engine, held_out)
+    embeddings3.set_engine(training)
+    yield training
+    embeddings3.set_engine(None)
+
+def test_simulated_users(engine, held_out):
+    """
+    Test scenario: 50 users simulated twice with the same seed
+    Should give the same users, each liking an actor of their held out film and co-stars from the known films of
+    the actor only, and disliking actors who never played with them
+    """
+    users = simulate_users(engine, 50, held_out, seed=3)
+
+    assert users == simulate_users(engine, 50, held_out, seed=3)
+    casts = engine.films["Actor_Names"].tolist()
+    for user in users:
+        actor = user["liked_actors"][0]
+        films = [f for f, cast in enumerate(casts) if actor in cast]
+        assert actor in casts[user["held_out"]] and user["held_out"] in held_out
+        assert user["known"] == [f for f in films if f not in held_out] and user["known"]
+        assert set(user["liked_actors"]) <= {name for f in user["known"] for name in casts[f]}
+        assert not set(user["disliked_actors"]) & {name for f in films for name in casts[f]}
+
+def test_simulated_users_ignore_actor_order(engine, held_out):
+    """
+    Test scenario: the same films loaded twice with the swipeable actors in another order (from_csv shuffles them)
+    Should simulate the same users with the same seed
+    """
+    reloaded = RecommenderEngine(engine.films, engine.embeddings, engine.model, all_actors=engine.all_actors[::-1])
+
+    assert simulate_users(reloaded, 50, held_out, seed=3) == simulate_users(engine, 50, held_out, seed=3)
+
+def test_training_engine_forgets_held_out_casts(engine, held_out, training):
+    """
+    Test scenario: the preferences of actors of held out films, from the engine without the held out casts
+    Should only get genres and directors from their known films, like an engine built without these casts, and
+    still rank every film
+    """
+    films = engine.films
+    films["Actor_Names"] = [[] if f in held_out else cast for f, cast in enumerate(films["Actor_Names"])]
+    expected = RecommenderEngine(films, engine.embeddings, engine.model)
+    actors = sorted({name for f in held_out for name in engine.films["Actor_Names"][f]})
+
+    changed = 0
+    for actor in actors:
+        preferences = training.build_preferences([actor], [])
+        assert preferences["genre_distribution"] == expected.build_preferences([actor], [])["genre_distribution"]
+        assert preferences["bonus_directors"] == expected.build_preferences([actor], [])["bonus_directors"]
+        changed += preferences["genre_distribution"] != engine.build_preferences([actor], [])["genre_distribution"]
+    assert changed > 0
+    assert len(training.rank_batch([{"liked_actors": actors[:2], "disliked_actors": [], "weights": DEFAULT_WEIGHTS,
+                                     "top_k": 60}])[0]) == 60
+
+def test_weight_grid():
+    """
+    Test scenario: values for 2 of the weights
+    Should give every combination, the other weights keeping their default value
+    """
+    grid = weight_grid({"liked_actors": [1.0, 2.0], "genres": [0.0, 0.5, 1.0]})
+
+    assert len(grid) == 6
+    assert {(w["liked_actors"], w["genres"]) for w in grid} == {(l, g) for l in (1.0, 2.0) for g in (0.0, 0.5, 1.0)}
+    assert all(w["directors"] == DEFAULT_WEIGHTS["directors"] for w in grid)
+
+def test_run_grid_matches_ranking(engine, held_out, training, monkeypatch):
+    """
+    Test scenario: 40 users evaluated over 2 weights and 2 drop fractions, in this process and in 2 forked workers,
+    with chunks smaller than the users
+    Should give the same results both ways, equal to the hit rate of rank_batch on the same corrected swipes once the
+    known films are left out
+    """
+    monkeypatch.setattr("evaluate.CHUNK_SIZE", 15)
+    users = simulate_users(engine, 40, held_out, seed=4)
+    grid = weight_grid({"bonus_genre_director": [0.0, 1.0]})
+
+    results = run_grid(users, grid, [0.0, 0.5], 5)
+    forked = run_grid(users, grid, [0.0, 0.5], 5, workers=2)
+
+    key = lambda r: (r["drop_fraction"], r["weights"]["bonus_genre_director"])
+    assert sorted(map(key, results)) == sorted(map(key, forked))
+    for r in forked:
+        same, = [s for s in results if key(s) == key(r)]
+        assert same["hit_rate"] == r["hit_rate"] and same["ndcg"] == pytest.approx(r["ndcg"])
+    for r in results:
+        requests = [{"liked_actors": u["liked_actors"], "weights": r["weights"], "top_k": 5 + len(u["known"]),
+                     "disliked_actors": bias_correction(u["disliked_actors"], r["drop_fraction"],
+                                                        seed=request_seed(u["liked_actors"], u["disliked_actors"]))}
+                    for u in users]
+        hits = sum(u["held_out"] in [f for f in ranked if f not in u["known"]][:5]
+                   for u, ranked in zip(users, training.rank_batch(requests)))
+        assert r["hit_rate"] == hits / len(users)
+    assert [r["ndcg"] for r in results] == sorted((r["ndcg"] for r in results), reverse=True)
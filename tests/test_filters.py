@@ -0,0 +1,94 @@
+"""
+File: test_filters.py
+Description: this file contains unittests for the runtime / year / rating filters from embeddings3.py module
+(build_filter_columns, RecommenderEngine.filter_mask and the filtered top-k selection) and for the filters of the
+/recommend route of server.py
+"""
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+import server
+from sessions import RecommendationSession
+
+WEIGHTS = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7, "bonus_genre_director": 0.1}
+FILTERS = {"max_runtime": 140, "min_year": 1980, "min_rating": 6.5}
+
+# 60 films with random runtimes, years and ratings (a few ratings missing), see conftest.random_films
+pytestmark = pytest.mark.random_catalog(n_genres=4, seed=0)
+
+
+def within(films, filters):
+    return ((films["Runtime"] <= filters["max_runtime"]) & (films["releaseYear"] >= filters["min_year"])
+            & (films["AverageRating"] >= filters["min_rating"]))
+
+def test_filter_mask(engine):
+    """
+    Test scenario: bounds on the 3 columns, bounds set to None, no filter and an unknown filter
+    Should mark the films within every bound (not the ones without a rating), ignore None and reject unknown names
+    """
+    mask = engine.filter_mask({**FILTERS, "max_year": None})
+
+    assert mask.tolist() == within(engine.films, FILTERS).tolist()
+    assert not mask[[3, 17]].any()
+    assert engine.filter_mask(None) is None and engine.filter_mask({"min_year": None}) is None
+    with pytest.raises(ValueError):
+        engine.filter_mask({"min_budget": 10})
+
+@pytest.mark.parametrize("mode", ["exact", "float16", "ann"])
+def test_filtered_top_k(engine, mode):
+    """
+    Test scenario: the same swipes with and without filters, with exact, compact and approximate search
+    Should return the best films within the filters (as many as asked), the same as the unfiltered ranking with the
+    other films taken out
+    """
+    if mode == "float16":
+        engine.set_storage("float16", rescore_k=5)
+    elif mode == "ann":
+        engine.build_ann_index(n_lists=6, nprobe=1)
+    request = {"liked_actors": ["Actor 1", "Actor 4"], "disliked_actors": ["Actor 7"], "weights": WEIGHTS}
+
+    everything, = engine.rank_batch([{**request, "top_k": 60}])
+    filtered, = engine.rank_batch([{**request, "top_k": 5, "filters": FILTERS}])
+
+    passing = within(engine.films, FILTERS).to_numpy()
+    assert len(filtered) == 5 and passing[filtered].all()
+    if mode == "exact":
+        assert filtered.tolist() == [i for i in everything if passing[i]][:5]
+
+def test_filters_leave_fewer_films_than_top_k(engine):
+    """
+    Test scenario: filters that only 2 films pass, in a batch and in a session
+    Should return only those 2 films, and keep the result cache apart from the unfiltered request
+    """
+    ratings = engine.films["AverageRating"]
+    filters = {"min_rating": ratings.nlargest(2).iloc[-1]}
+    expected = set(engine.films["Title"][ratings >= filters["min_rating"]])
+    assert len(expected) == 2
+
+    recs = engine.recommend(["Actor 2"], [], WEIGHTS, 10, filters)
+    session = RecommendationSession(engine, WEIGHTS, top_k=10, filters=filters)
+    session.swipe("Actor 2", True)
+
+    assert {r["Title"] for r in recs} == expected and {r["Title"] for r in session.recommendations()} == expected
+    assert len(engine.recommend(["Actor 2"], [], WEIGHTS, 10)) == 10
+
+def test_recommend_route_filters(engine, monkeypatch):
+    """
+    Test scenario: /recommend with filters and 3 films per page, then every next page with the cursors
+    Should answer every film within the filters once, and no other film
+    """
+    monkeypatch.setattr(server, "PAGE_SIZE", 3)
+    embeddings3.set_engine(engine)
+    try:
+        client = TestClient(server.app)
+        page = client.post("/recommend", json={"liked_actors": ["Actor 3"], "disliked_actors": [],
+                                               "filters": FILTERS}).json()
+        titles = [r["Title"] for r in page["recommendations"]]
+        while page["next_cursor"] is not None:
+            page = client.get("/recommend/page", params={"cursor": page["next_cursor"], "page_size": 3}).json()
+            titles += [r["Title"] for r in page["recommendations"]]
+    finally:
+        embeddings3.set_engine(None)
+
+    allowed = set(engine.films["Title"][within(engine.films, FILTERS)])
+    assert len(allowed) > 3 and len(titles) == len(allowed) and set(titles) == allowed
@@ -0,0 +1,187 @@
+"""
+File: test_ingest.py
+Description: this file contains unittests for catalog deltas from embeddings3.py module (split_delta(),
+apply_delta_to_table(), RecommenderEngine.with_delta()) and for the POST /catalog/delta route of server.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+from embeddings3 import HashingEncoder, RecommenderEngine, apply_delta_to_table, prepare_films, split_delta
+import server
+from server import app
+
+ACTOR_MAP = {"nm1": "Leonardo DiCaprio", "nm2": "Kate Winslet", "nm3": "Simon Pegg", "nm4": "Nick Frost"}
+
+
+class CountingEncoder(HashingEncoder):
+    """
+    HashingEncoder that remembers which texts it had to encode
+    """
+    def __init__(self):
+        super().__init__(dim=64)
+        self.calls = []
+
+    def encode(self, texts, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return super().encode(texts)
+
+
+@pytest.fixture()
+def raw_films():
+    """
+    Small films table with the raw columns of final_films.csv
+    """
+    return pd.DataFrame({
+        "Code": ["tt1", "tt2", "tt3"],
+        "Title": ["Titanic", "Hot Fuzz", "Django Unchained"],
+        "Genres": ["Drama,Romance", "Comedy", "Western"],
+        "Cast": ["['nm1', 'nm2']", "['nm3', 'nm4']", "['nm1']"],
+        "Director": ["Cameron", "Wright", "Tarantino"],
+    })
+
+@pytest.fixture()
+def delta():
+    """
+    Delta that changes the cast of Hot Fuzz, removes Django Unchained and adds Inception
+    """
+    return pd.DataFrame({
+        "Code": ["tt2", "tt3", "tt4"],
+        "Title": ["Hot Fuzz", None, "Inception"],
+        "Genres": ["Comedy,Action", None, "Sci-Fi"],
+        "Cast": ["['nm3']", None, "['nm1']"],
+        "Director": ["Wright", None, "Nolan"],
+        "Action": ["upsert", "delete", None],
+    })
+
+def make_engine(raw, model):
+    """
+    Engine built from a raw films table, like RecommenderEngine.from_csv without the artifact
+    """
+    films = prepare_films(raw, ACTOR_MAP)
+    return RecommenderEngine(films, model.encode(films['description'].tolist()), model, actor_map=ACTOR_MAP)
+
+def test_split_delta(delta):
+    """
+    Test scenario: a delta with an upsert, a delete and a row without action
+    Should return the rows to add or replace and the codes to remove, and reject unknown actions
+    """
+    upserts, removed = split_delta(delta)
+
+    assert upserts['Code'].tolist() == ["tt2", "tt4"]
+    assert 'Action' not in upserts.columns
+    assert removed == {"tt3"}
+    with pytest.raises(ValueError):
+        split_delta(delta.assign(Action="rename"))
+
+def test_apply_delta_to_table(raw_films, delta):
+    """
+    Test scenario: patching the raw catalog
+    Should keep unchanged films first, in order, and append the new versions
+    """
+    patched = apply_delta_to_table(raw_films, delta)
+
+    assert patched['Code'].tolist() == ["tt1", "tt2", "tt4"]
+    assert patched.loc[1, 'Cast'] == "['nm3']"
+    assert list(patched.columns) == list(raw_films.columns)
+
+def test_with_delta_matches_full_rebuild(raw_films, delta):
+    """
+    Test scenario: a delta applied to a running engine
+    Should give the same vectors, actor preferences and recommendations as an engine rebuilt from the patched catalog
+    """
+    model = HashingEncoder(dim=64)
+    patched = make_engine(raw_films, model).with_delta(delta)
+    rebuilt = make_engine(apply_delta_to_table(raw_films, delta), model)
+
+    assert patched.films['Title'].tolist() == rebuilt.films['Title'].tolist()
+    np.testing.assert_allclose(patched.embeddings, rebuilt.embeddings, rtol=1e-6)
+    for actor in ACTOR_MAP.values():
+        # genre_weights / director_films are positions in each engine, so compare what they stand for
+        patched_preferences = patched.build_preferences([actor], [])
+        rebuilt_preferences = rebuilt.build_preferences([actor], [])
+        for key in ("queries", "entities", "genre_distribution", "bonus_directors"):
+            assert patched_preferences[key] == rebuilt_preferences[key]
+        assert (patched.films['Title'].iloc[patched_preferences["director_films"]].tolist() ==
+                rebuilt.films['Title'].iloc[rebuilt_preferences["director_films"]].tolist())
+    genre_distribution = {"Comedy": 2, "Sci-Fi": 1}
+    np.testing.assert_allclose(patched.bonus_scores(genre_distribution, {"Nolan"}),
+                               rebuilt.bonus_scores(genre_distribution, {"Nolan"}))
+    weights = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7,
+               "bonus_genre_director": 0.1}
+    assert (patched.recommend(["Leonardo DiCaprio"], ["Nick Frost"], weights, 3) ==
+            rebuilt.recommend(["Leonardo DiCaprio"], ["Nick Frost"], weights, 3))
+
+def test_with_delta_encodes_only_affected_films(raw_films, delta):
+    """
+    Test scenario: a delta with a changed film, a removed film, a new film and a film resent without changes
+    Should only encode the descriptions that did not exist before and leave the old engine untouched
+    """
+    model = CountingEncoder()
+    engine = make_engine(raw_films, model)
+    model.calls = []
+    unchanged = raw_films.iloc[[0]]
+
+    patched = engine.with_delta(pd.concat([delta, unchanged], ignore_index=True))
+
+    descriptions = patched.films.set_index('Title')['description']
+    assert model.calls == [[descriptions["Hot Fuzz"], descriptions["Inception"]]]
+    assert len(engine.films) == 3 and engine.films['Code'].tolist() == ["tt1", "tt2", "tt3"]
+    assert "Django Unchained" not in patched.films['Title'].tolist()
+
+def test_with_delta_patches_ann_and_quantized(raw_films, delta):
+    """
+    Test scenario: an engine with an approximate index and int8 storage
+    Should keep one cluster per film and one compact row per film after the delta
+    """
+    engine = make_engine(raw_films, HashingEncoder(dim=64))
+    engine.set_storage("int8")
+    engine.build_ann_index(n_lists=2, nprobe=2)
+
+    patched = engine.with_delta(delta)
+
+    assert sorted(patched.ann_index.list_ids.tolist()) == [0, 1, 2]
+    assert patched.quantized.shape == (3, 64) and patched.scales.shape == (3,)
+    weights = {"liked_actors": 1.0, "disliked_actors": 0.0, "genres": 0.0, "directors": 0.0,
+               "bonus_genre_director": 0.0}
+    assert len(patched.recommend(["Simon Pegg"], [], weights, 2)) == 2
+
+def test_catalog_delta_route(raw_films, delta, monkeypatch):
+    """
+    Test scenario: a running server receives a delta CSV with the catalog token
+    Should swap in the patched engine without a restart
+    """
+    monkeypatch.setattr(server, "CATALOG_TOKEN", "secret")
+    embeddings3.set_engine(make_engine(raw_films, HashingEncoder(dim=64)))
+    try:
+        response = TestClient(app).post("/catalog/delta", content=delta.to_csv(index=False),
+                                        headers={"Content-Type": "text/csv", "X-Catalog-Token": "secret"})
+
+        assert response.status_code == 200
+        assert response.json()["films"] == 3
+        assert "Inception" in embeddings3.get_engine().films['Title'].tolist()
+    finally:
+        embeddings3.set_engine(None)
+
+def test_catalog_delta_route_refused(raw_films, delta, monkeypatch):
+    """
+    Test scenario: deltas posted without a configured token, with a wrong token and larger than the limit
+    Should answer 404, 403 and 413 and keep serving the catalog unchanged
+    """
+    engine = make_engine(raw_films, HashingEncoder(dim=64))
+    embeddings3.set_engine(engine)
+    body = delta.to_csv(index=False)
+    try:
+        client = TestClient(app)
+        monkeypatch.setattr(server, "CATALOG_TOKEN", None)
+        disabled = client.post("/catalog/delta", content=body)
+        monkeypatch.setattr(server, "CATALOG_TOKEN", "secret")
+        forbidden = client.post("/catalog/delta", content=body, headers={"X-Catalog-Token": "guess"})
+        monkeypatch.setattr(server, "CATALOG_DELTA_MAX_BYTES", len(body) - 1)
+        too_large = client.post("/catalog/delta", content=body, headers={"X-Catalog-Token": "secret"})
+
+        assert [disabled.status_code, forbidden.status_code, too_large.status_code] == [404, 403, 413]
+        assert embeddings3.get_engine() is engine
+    finally:
+        embeddings3.set_engine(None)
@@ -0,0 +1,79 @@
+"""
+File: test_metrics.py
+Description: this file contains unittests for the Prometheus metrics from metrics.py module (Counter, Histogram)
+and for the /metrics route of server.py
+"""
+import numpy as np
+import pandas as pd
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+import embeddings3
+import metrics
+from embeddings3 import RecommenderEngine
+from metrics import Counter, Histogram
+from server import app
+
+
+def test_histogram_render():
+    """
+    Test scenario: 3 observations, one of them exactly on a bucket bound and one above every bound
+    Should render cumulative buckets (bounds included), +Inf, the sum and the count, and give the same count and sum
+    """
+    histogram = Histogram("test_seconds", "Test durations", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.1, 0.5, 3.0):
+        histogram.observe(value, stage="encode")
+
+    lines = histogram.render()
+
+    assert lines[:2] == ["# HELP test_seconds Test durations", "# TYPE test_seconds histogram"]
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="encode",le="0.1"} 1',
+        'test_seconds_bucket{stage="encode",le="1.0"} 2',
+        'test_seconds_bucket{stage="encode",le="+Inf"} 3',
+        'test_seconds_sum{stage="encode"} 3.6',
+        'test_seconds_count{stage="encode"} 3',
+    ]
+    assert histogram.count(stage="encode") == 3 and histogram.total(stage="encode") == 3.6
+    assert histogram.count(stage="ann") == 0 and histogram.total(stage="ann") == 0.0
+
+def test_counter_labels_escaped():
+    """
+    Test scenario: a counter increased with label values containing quotes
+    Should keep one value per label combination and escape the quotes
+    """
+    counter = Counter("test_total", "Test counter", ["route"])
+    counter.inc(route='/a"b')
+    counter.inc(2, route='/a"b')
+    counter.inc(route="/c")
+
+    assert counter.render()[2:] == ['test_total{route="/a\\"b"} 3', 'test_total{route="/c"} 1']
+
+def test_metrics_route(monkeypatch):
+    """
+    Test scenario: a recommendation then a scrape of /metrics
+    Should expose the stage timings of the batch, the request count by route and the query cache counters
+    """
+    films = pd.DataFrame({
+        "Title": ["Titanic", "Hot Fuzz"],
+        "Genres": ["Drama", "Comedy"],
+        "Director": ["Cameron", "Wright"],
+        "Actor_Names": [["Kate Winslet"], ["Simon Pegg"]],
+        "description": ["Sad movie", "Funny movie"],
+    })
+    model = MagicMock()
+    model.encode.side_effect = lambda texts: np.tile([1.0, 0.0], (len(texts), 1))
+    embeddings3.set_engine(RecommenderEngine(films, np.array([[1.0, 0.0], [0.0, 1.0]]), model))
+    similarity_count = metrics.RECOMMEND_STAGE_SECONDS.count(stage="similarity")
+    try:
+        client = TestClient(app)
+        assert client.post("/recommend", json={"liked_actors": ["Kate Winslet"], "disliked_actors": []}).status_code == 200
+
+        text = client.get("/metrics").text
+    finally:
+        embeddings3.set_engine(None)
+
+    assert metrics.RECOMMEND_STAGE_SECONDS.count(stage="similarity") == similarity_count + 1
+    assert 'watchorpass_recommend_stage_seconds_count{stage="encode"}' in text
+    assert 'watchorpass_http_requests_total{route="/recommend",status="200"}' in text
+    # One miss per query of the request (liked actors, genres, directors)
+    assert "watchorpass_query_cache_misses_total 3" in text
@@ -5,10 +5,17 @@ Description: this file contains unittests for simpler functions from embeddings3
 parse_cast(), create_movie_text(), get_actor(), mapping actors to directors and genres
 """
 import pandas as pd
-from embeddings3 import parse_cast, create_movie_text, get_actor, build_actor_mapping
+from embeddings3 import parse_cast, create_movie_text, get_actor, build_actor_mapping, RecommenderEngine
 
 
-def test_parse_cast_valid_input(monkeypatch):
+def make_engine(all_actors):
+    """
+    Build a tiny engine with no films, only the list of actors to swipe on
+    """
+    films = pd.DataFrame({"Title": [], "Genres": [], "Director": [], "Actor_Names": [], "description": []})
+    return RecommenderEngine(films, embeddings=None, model=None, all_actors=all_actors)
+
+def test_parse_cast_valid_input():
     """
     Test scenario: input is valid, all IDs are in a database
     Should convert a valid string of actor's IDs into the correct list of actor's names.
@@ -21,15 +28,13 @@ def test_parse_cast_valid_input(monkeypatch):
                       105: "Brad Pitt"}
     # Cast IDs we want to process
     mock_cast_str = "[103,101,102]"
-    # Temporarily placing our mock dictionary on the place of a real actors dic
-    monkeypatch.setattr("embeddings3.actor_map", mock_actor_map)
-    # Applying the function we want to test
-    result = parse_cast(mock_cast_str)
+    # Applying the function we want to test with our mock dictionary instead of a real actors dic
+    result = parse_cast(mock_cast_str, mock_actor_map)
 
     # Expected output
     assert result == ["Heath Ledger", "Gary Oldman", "Christian Bale"]
 
-def test_parse_cast_invalid_input(monkeypatch):
+def test_parse_cast_invalid_input():
     """
     Test scenario: input is invalid
     Should return an empty list
@@ -39,15 +44,13 @@ def test_parse_cast_invalid_input(monkeypatch):
                       102: "Christian Bale"}
     # Invalid string we want to process
     mock_cast_str = "The cast consists of 101 and 102"
-    # Temporarily placing our mock dictionary on the place of a real actors dic
-    monkeypatch.setattr("embeddings3.actor_map", mock_actor_map)
-    # Applying the function we want to test
-    result = parse_cast(mock_cast_str)
+    # Applying the function we want to test with our mock dictionary instead of a real actors dic
+    result = parse_cast(mock_cast_str, mock_actor_map)
 
     # Expected output
     assert result == []
 
-def test_parse_cast_unknown_id(monkeypatch):
+def test_parse_cast_unknown_id():
     """
     Test scenario: casts includes IDs of actors that are not in the database
     Should return a list of actor's names, excluding the unknown ones
@@ -60,10 +63,8 @@ def test_parse_cast_unknown_id(monkeypatch):
                       105: "Brad Pitt"}
     # Cast IDs we want to process, ID 999 and 111 are imposters
     mock_cast_str = "[103,999,102,111]"
-    # Temporarily placing our mock dictionary on the place of a real actors dic
-    monkeypatch.setattr("embeddings3.actor_map", mock_actor_map)
-    # Applying the function we want to test
-    result = parse_cast(mock_cast_str)
+    # Applying the function we want to test with our mock dictionary instead of a real actors dic
+    result = parse_cast(mock_cast_str, mock_actor_map)
 
     # Expected output
     assert result == ["Heath Ledger", "Christian Bale"]
@@ -109,26 +110,26 @@ def test_get_actor_random(monkeypatch):
     """
     # Creating a temporary list of actors
     mock_all_actors = ["Ellen Burstyn", "Jared Leto", "Jennifer Connelly"]
-    monkeypatch.setattr("embeddings3.all_actors", mock_all_actors)
+    engine = make_engine(mock_all_actors)
 
-    # Force random.randint to always return index 2 (to control the result)
-    monkeypatch.setattr("random.randint", lambda a, b: 2)
+    # Give all the weight to the actor at index 2 (to control the result)
+    monkeypatch.setattr(engine, "actor_weights", lambda weighting: [0, 0, 1])
 
-    result = get_actor()
+    result = get_actor(engine)
 
     # Expected result
     assert result == "Jennifer Connelly"
 
-def test_get_single_actor_(monkeypatch):
+def test_get_single_actor_():
     """
     Test scenario: only one available actor in the database
     Should return this actor's name
     """
     # Creating a temporary list with only 1 actor
     mock_all_actors = ["Jared Leto"]
-    monkeypatch.setattr("embeddings3.all_actors", mock_all_actors)
+    engine = make_engine(mock_all_actors)
 
-    result = get_actor()
+    result = get_actor(engine)
 
     # Expected result
     assert result == "Jared Leto"
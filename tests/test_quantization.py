@@ -0,0 +1,77 @@
+"""
+File: test_quantization.py
+Description: this file contains unittests for the compact (float16 / int8) storage of film vectors from vectors.py
+module (quantize_embeddings(), quantized_scores()) and for recommending with rescoring from embeddings3.py module
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from embeddings3 import RecommenderEngine, HashingEncoder
+from vectors import normalize_rows, quantize_embeddings, quantized_scores
+
+
+def test_int8_quantization_error_is_small():
+    """
+    Test scenario: quantizing unit vectors to int8 with one scale per row
+    Should use 4 times less memory and keep dot products within a small error
+    """
+    rng = np.random.default_rng(0)
+    embeddings = normalize_rows(rng.standard_normal((500, 64)))
+    queries = normalize_rows(rng.standard_normal((3, 64)))
+
+    codes, scales = quantize_embeddings(embeddings, "int8")
+
+    assert codes.dtype == np.int8
+    assert codes.nbytes * 4 == embeddings.nbytes
+    np.testing.assert_allclose(quantized_scores(codes, scales, queries, chunk_size=128), queries @ embeddings.T,
+                               atol=0.02)
+
+def test_float16_quantization():
+    """
+    Test scenario: quantizing to float16
+    Should give the same scores up to float16 precision, without scales
+    """
+    rng = np.random.default_rng(0)
+    embeddings = normalize_rows(rng.standard_normal((100, 32)))
+    query = normalize_rows(rng.standard_normal((1, 32)))
+
+    compact, scales = quantize_embeddings(embeddings, "float16")
+
+    assert scales is None
+    np.testing.assert_allclose(quantized_scores(compact, scales, query), query @ embeddings.T, atol=2e-3)
+
+def test_unknown_storage_mode():
+    """
+    Test scenario: asking for a storage mode that does not exist
+    Should raise a ValueError
+    """
+    with pytest.raises(ValueError):
+        quantize_embeddings(np.zeros((1, 2)), "int4")
+
+@pytest.mark.parametrize("mode", ["float16", "int8"])
+def test_recommend_with_compact_storage(mode):
+    """
+    Test scenario: the engine scores with compact vectors and rescores the best candidates in float32
+    Should give the same movies as float32 scoring
+    """
+    rng = np.random.default_rng(0)
+    actors = [f"Actor {i}" for i in range(40)]
+    n = 300
+    films = pd.DataFrame({
+        "Title": [f"Film {i}" for i in range(n)],
+        "Genres": [rng.choice(["Drama", "Comedy", "Action"]) for _ in range(n)],
+        "Director": [f"Director {i % 30}" for i in range(n)],
+        "Actor_Names": [list(rng.choice(actors, size=3, replace=False)) for _ in range(n)],
+    })
+    films["description"] = [f"Genres: {g}. Director: {d}. Actors: {', '.join(a)}."
+                            for g, d, a in zip(films["Genres"], films["Director"], films["Actor_Names"])]
+    encoder = HashingEncoder(dim=128)
+    engine = RecommenderEngine(films, encoder.encode(films["description"].tolist()), encoder)
+    weights = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7,
+               "bonus_genre_director": 0.1}
+
+    exact = engine.recommend(["Actor 1", "Actor 2"], ["Actor 3"], weights, 15)
+    engine.set_storage(mode, rescore_k=100)
+    compact = engine.recommend(["Actor 1", "Actor 2"], ["Actor 3"], weights, 15)
+
+    assert compact == exact
@@ -7,10 +7,12 @@ import numpy as np
 import pandas as pd
 import pytest
 from unittest.mock import MagicMock
-from embeddings3 import recommend_movies, build_actor_mapping, bias_correction
+from embeddings3 import recommend_movies, recommend_movies_batch, bias_correction, RecommenderEngine, QueryCache
+from embeddings3 import ResultCache, request_seed
+from vectors import top_k_indices
 
 @pytest.fixture()
-def mock_films(monkeypatch):
+def mock_films():
     """
     Create a small fake films dataframe to use instead of our big dataset
     """
@@ -25,12 +27,10 @@ def mock_films(monkeypatch):
         ],
         "description": ["Sad movie", "Funny movie", "Interesting movie"],
     })
-
-    monkeypatch.setattr("embeddings3.films", data)
     return data
 
 @pytest.fixture()
-def mock_embeddings(monkeypatch):
+def mock_embeddings():
     """
     Create 3 simple mock embeddings manually (not using a built-in package for that)
     """
@@ -39,44 +39,27 @@ def mock_embeddings(monkeypatch):
         [0.5, 0.5], # Hot Fuzz
         [0.0, 1.0] # Django Unchained
     ])
-    monkeypatch.setattr("embeddings3.embeddings", embeddings)
     return embeddings
 
 @pytest.fixture()
-def mock_actor_maps(monkeypatch):
+def mock_model():
     """
-    Create mock actor-to-director and actor-to-genre maps
+    Mock SentenceTransformer.encode so the real model is not loaded
     """
-    data = pd.DataFrame({
-        "Title": ["Titanic", "Hot Fuzz", "Django Unchained"],
-        "Genres": ["Action, Drama", "Comedy", "Action"],
-        "Director": ["Cameron", "Wright", "Tarantino"],
-        "Actor_Names": [
-            ["Leonardo DiCaprio", "Kate Winslet"],
-            ["Simon Pegg"],
-            ["Leonardo DiCaprio"]
-        ],
-        "description": ["Sad movie", "Funny movie", "Interesting movie"],
-    })
-    act_dir, act_gen = build_actor_mapping(data)
-
-    monkeypatch.setattr("embeddings3.actor_to_directors", act_dir)
-    monkeypatch.setattr("embeddings3.actor_to_genres", act_gen)
-
-    return act_dir, act_gen
+    mock_model = MagicMock()
+    # Every query text is encoded as [1, 1]
+    mock_model.encode.side_effect = lambda texts: np.ones((len(texts), 2))
+    return mock_model
 
 @pytest.fixture()
-def mock_model(monkeypatch):
+def mock_engine(mock_films, mock_embeddings, mock_model):
     """
-    Mock SentenceTransformer.encode so the real model is not loaded
+    Build the engine from the small in-memory tables (actor-to-director and actor-to-genre maps are built by it)
     """
-    mock_model = MagicMock()
-    mock_model.encode.return_value = np.array([[1.0, 1.0]])
-    monkeypatch.setattr("embeddings3.model", mock_model)
-    return mock_model
+    return RecommenderEngine(mock_films, mock_embeddings, mock_model)
 
 # Actual testing
-def test_recommend_movies_basic(mock_films, mock_embeddings, mock_actor_maps, mock_model):
+def test_recommend_movies_basic(mock_engine):
     """
     Test scenario: general case
     Should output the movies that have the actor a user likes
@@ -93,18 +76,19 @@ def test_recommend_movies_basic(mock_films, mock_embeddings, mock_actor_maps, mo
         liked_actors=["Leonardo DiCaprio"],
         disliked_actors=[],
         weights=weights,
-        top_k=2
+        top_k=2,
+        engine=mock_engine
     )
 
     # Should return 2 movies
     assert len(recs) == 2
 
     # Movies "Titanic" and "Django Unchained" both have Leonardo DiCaprio → they should score highest
-    titles = recs["Title"].tolist()
+    titles = [rec["Title"] for rec in recs]
     assert "Titanic" in titles
     assert "Django Unchained" in titles
 
-def test_recommend_movies_empty_input(mock_films, mock_embeddings, mock_actor_maps, mock_model):
+def test_recommend_movies_empty_input(mock_engine):
     """
     Test scenario: no preferences
     Should output the most "basic" movie (from the perspective of vector embeddings)
@@ -121,15 +105,16 @@ def test_recommend_movies_empty_input(mock_films, mock_embeddings, mock_actor_ma
         liked_actors=[],
         disliked_actors=[],
         weights=weights,
-        top_k=1
+        top_k=1,
+        engine=mock_engine
     )
 
     # With no preferences, highest cosine similarity (vector [1,1]) is "Hot Fuzz" (vector [0.5,0.5])
-    titles = recs["Title"].tolist()
+    titles = [rec["Title"] for rec in recs]
     assert len(recs) == 1
     assert "Hot Fuzz" in titles
 
-def test_recommend_movies_zero_weights(mock_films, mock_embeddings, mock_actor_maps, mock_model):
+def test_recommend_movies_zero_weights(mock_engine):
     """
     Test scenario: zero weights
     Should output the movies in reversed index order
@@ -147,11 +132,12 @@ def test_recommend_movies_zero_weights(mock_films, mock_embeddings, mock_actor_m
         liked_actors=["Simon Pegg"],
         disliked_actors=["Leonardo DiCaprio"],
         weights=weights,
-        top_k=1
+        top_k=1,
+        engine=mock_engine
     )
 
     # Should return "Django Unchained" even though the user dislikes Leonardo DiCaprio and likes Simon Pegg
-    titles = recs["Title"].tolist()
+    titles = [rec["Title"] for rec in recs]
     assert len(recs) == 1
     assert "Django Unchained" in titles
 
@@ -175,7 +161,7 @@ def test_bias_correction_empty():
     """
     assert bias_correction([], 0.5) == []
 
-def test_recommend_movies_missing_fields(monkeypatch, mock_model):
+def test_recommend_movies_missing_fields(mock_model):
     """
     Test scenario: films dataframe is missing expected fields
     Code should not crash
@@ -188,11 +174,7 @@ def test_recommend_movies_missing_fields(monkeypatch, mock_model):
         "description": ["disgusting"]
     })
     mock_embeddings = np.array([[0.5, 0.5]])
-    mock_actor_to_directors, mock_actor_to_genres = build_actor_mapping(df)
-    monkeypatch.setattr("embeddings3.films", df)
-    monkeypatch.setattr("embeddings3.embeddings", mock_embeddings)
-    monkeypatch.setattr("embeddings3.actor_to_directors", mock_actor_to_directors)
-    monkeypatch.setattr("embeddings3.actor_to_genres", mock_actor_to_genres)
+    engine = RecommenderEngine(df, mock_embeddings, mock_model)
 
     weights = {
         "liked_actors": 1.0,
@@ -202,8 +184,257 @@ def test_recommend_movies_missing_fields(monkeypatch, mock_model):
         "bonus_genre_director": 1.0
     }
 
-    recs = recommend_movies(["Actor1"], [], weights, 1)
+    recs = recommend_movies(["Actor1"], [], weights, 1, engine=engine)
 
     assert len(recs) == 1
-    assert recs.iloc[0]["Title"] == "Very bad movie"
+    assert recs[0]["Title"] == "Very bad movie"
+
+def test_recommend_movies_single_batched_encode(mock_engine, mock_model):
+    """
+    Test scenario: liked and disliked actors, so 4 queries (actors, dislikes, directors, genres) are needed
+    Should call the model only once, with all queries in the same batch
+    """
+    weights = {
+        "liked_actors": 1.0,
+        "disliked_actors": 1.0,
+        "genres": 1.0,
+        "directors": 1.0,
+        "bonus_genre_director": 0.5
+    }
+
+    recommend_movies(["Leonardo DiCaprio"], ["Simon Pegg"], weights, 2, engine=mock_engine)
+
+    assert mock_model.encode.call_count == 1
+    queries = mock_model.encode.call_args[0][0]
+    assert queries == [
+        "Movies featuring actors like Leonardo DiCaprio.",
+        "Movies featuring actors like Simon Pegg.",
+        "Movies directed by Cameron, Tarantino.",
+        "Movies in genres like Action, Drama.",
+    ]
+
+def test_recommend_movies_query_cache(mock_engine, mock_model):
+    """
+    Test scenario: the same preferences are sent twice (with another top_k, so the result cache does not answer)
+    Should skip the model the second time and count the cache hits
+    """
+    weights = {
+        "liked_actors": 1.0,
+        "disliked_actors": 1.0,
+        "genres": 1.0,
+        "directors": 1.0,
+        "bonus_genre_director": 0.5
+    }
+
+    first = recommend_movies(["Leonardo DiCaprio"], [], weights, 3, engine=mock_engine)
+    second = recommend_movies(["Leonardo DiCaprio"], [], weights, 2, engine=mock_engine)
+
+    assert mock_model.encode.call_count == 1
+    assert mock_engine.query_cache.hits == 3
+    assert mock_engine.query_cache.misses == 3
+    assert first[:2] == second
+
+def test_query_cache_bounded():
+    """
+    Test scenario: more distinct queries than the cache can hold
+    Should drop the least recently used query first
+    """
+    cache = QueryCache(maxsize=2)
+    cache.put("a", np.zeros(2))
+    cache.put("b", np.zeros(2))
+    cache.get("a")  # "a" is now more recent than "b"
+    cache.put("c", np.zeros(2))
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+def loop_bonus_scores(films, genre_distribution, bonus_directors):
+    """
+    The original bonus loop over all films, kept here as the reference for the vectorized version
+    """
+    bonus_scores = np.zeros(len(films))
+    for i, row in films.iterrows():
+        if isinstance(row['Genres'], str):
+            for g in [x.strip() for x in row['Genres'].split(",") if x.strip()]:
+                bonus_scores[i] += genre_distribution.get(g, 0)
+        if row['Director'] in bonus_directors:
+            bonus_scores[i] += 0.1
+    return bonus_scores
+
+def test_bonus_scores_match_loop():
+    """
+    Test scenario: random catalog with missing fields, repeated genres, spaces and several directors per film
+    Should give the same bonuses and the same ranking as the original loop
+    """
+    rng = np.random.default_rng(0)
+    genres = ["Drama", "Comedy", " Action", "Crime ", "Sci-Fi"]
+    directors = ["Nolan", "Wright", "Nolan, Thomas", "Cameron", None]
+    n = 200
+    films = pd.DataFrame({
+        "Title": [f"Film {i}" for i in range(n)],
+        "Genres": [None if i % 17 == 0 else ",".join(rng.choice(genres, size=rng.integers(1, 4))) for i in range(n)],
+        "Director": [directors[i % len(directors)] for i in range(n)],
+        "Actor_Names": [["Actor"] for _ in range(n)],
+        "description": ["" for _ in range(n)],
+    })
+    engine = RecommenderEngine(films, np.ones((n, 2)), model=None)
+    genre_distribution = {"Drama": 0.5, "Action": 0.3, "Crime": 0.2, "Western": 0.4}
+    bonus_directors = {"Nolan", "Thomas", "Unknown"}
+
+    expected = loop_bonus_scores(films, genre_distribution, bonus_directors)
+    result = engine.bonus_scores(genre_distribution, bonus_directors)
+
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+    assert np.array_equal(np.argsort(result, kind="stable"), np.argsort(expected, kind="stable"))
+
+def test_top_k_indices_matches_argsort():
+    """
+    Test scenario: scores with many ties (rounded values)
+    Should return the same indices, in the same order, as a full reversed argsort
+    """
+    rng = np.random.default_rng(1)
+    scores = np.round(rng.random(1000), 2)
+
+    for k in [1, 15, 100, 1000, 5000]:
+        expected = np.argsort(scores, kind="stable")[::-1][:k]
+        assert np.array_equal(top_k_indices(scores, k), expected)
+
+def test_engine_normalizes_embeddings(mock_films, mock_model):
+    """
+    Test scenario: raw (not normalized) embeddings are given to the engine
+    Should store them once as unit length float32 rows
+    """
+    engine = RecommenderEngine(mock_films, np.array([[3.0, 4.0], [0.0, 2.0], [0.0, 0.0]]), mock_model)
+
+    assert engine.embeddings.dtype == np.float32
+    np.testing.assert_allclose(engine.embeddings, [[0.6, 0.8], [0.0, 1.0], [0.0, 0.0]])
+
+def test_recommend_movies_batch_matches_single(mock_films, mock_embeddings):
+    """
+    Test scenario: several users with different swipes, weights and top_k in one batch
+    Should give every user the same movies as separate calls, in request order, with one model call
+    """
+    model = MagicMock()
+    # Distinct vector per query text, so users really get different preference vectors
+    model.encode.side_effect = lambda texts: np.array([[len(t) % 5 + 1.0, len(t) % 3 + 1.0] for t in texts])
+    engine = RecommenderEngine(mock_films, mock_embeddings, model)
+    weights = {
+        "liked_actors": 1.0,
+        "disliked_actors": 1.0,
+        "genres": 1.0,
+        "directors": 1.0,
+        "bonus_genre_director": 0.5
+    }
+    requests = [
+        {"liked_actors": ["Leonardo DiCaprio"], "disliked_actors": [], "weights": weights, "top_k": 2},
+        {"liked_actors": [], "disliked_actors": [], "weights": weights, "top_k": 1},
+        {"liked_actors": ["Simon Pegg"], "disliked_actors": ["Kate Winslet"],
+         "weights": {**weights, "bonus_genre_director": 0.0}, "top_k": 3},
+    ]
+
+    results = recommend_movies_batch(requests, engine=engine)
+    assert model.encode.call_count == 1
+
+    assert [len(recs) for recs in results] == [2, 1, 3]
+    for request, recs in zip(requests, results):
+        single = recommend_movies(request["liked_actors"], request["disliked_actors"], request["weights"],
+                                  request["top_k"], engine=engine)
+        assert recs == single
+
+def test_recommend_movies_precomputed_mode(mock_films, mock_embeddings):
+    """
+    Test scenario: the engine runs with precomputed actor, director and genre vectors
+    Should not call the model at request time, and give the same movies as the encode mode when every query has
+    only one entity (so the texts are the same)
+    """
+    model = MagicMock()
+    model.encode.side_effect = lambda texts: np.array([[len(t) % 5 + 1.0, len(t) % 3 + 1.0] for t in texts])
+    weights = {
+        "liked_actors": 1.0,
+        "disliked_actors": 1.0,
+        "genres": 1.0,
+        "directors": 1.0,
+        "bonus_genre_director": 0.5
+    }
+    encode_engine = RecommenderEngine(mock_films, mock_embeddings, model)
+    precomputed_engine = RecommenderEngine(mock_films, mock_embeddings, model, query_mode="precomputed")
+    precomputed_engine.precompute_entity_vectors()
+    model.encode.reset_mock()
+
+    swipes = [(["Simon Pegg"], ["Kate Winslet"]), ([], [])]
+    results = [recommend_movies(liked, disliked, weights, 3, engine=precomputed_engine) for liked, disliked in swipes]
+    assert model.encode.call_count == 0
+
+    for (liked, disliked), recs in zip(swipes, results):
+        expected = recommend_movies(liked, disliked, weights, 3, engine=encode_engine)
+        assert recs == expected
+
+def test_bias_correction_deterministic():
+    """
+    Test scenario: the same disliked actors sent twice in a different order
+    Should ignore the same actors both times
+    """
+    disliked = ["A", "B", "C", "D", "E", "F"]
+
+    first = bias_correction(disliked, drop_fraction=0.5)
+    second = bias_correction(list(reversed(disliked)), drop_fraction=0.5)
+
+    assert sorted(first) == sorted(second)
+    assert bias_correction(disliked, 0.5, seed=request_seed(["X"], disliked)) == \
+        bias_correction(disliked, 0.5, seed=request_seed(["X"], list(reversed(disliked))))
+
+def test_result_cache_expiry_and_eviction():
+    """
+    Test scenario: a cache of 2 tables with a 10 second lifetime and a fake clock
+    Should return copies, drop the least recently used table and forget tables older than the lifetime
+    """
+    now = [0.0]
+    cache = ResultCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    table = pd.DataFrame({"Title": ["Titanic"]})
+    cache.put("a", table)
+    cache.put("b", table)
+
+    cached = cache.get("a")
+    cached.loc[0, "Title"] = "changed"
+    assert cache.get("a")["Title"].tolist() == ["Titanic"]
+    cache.put("c", table)  # "b" is the least recently used
+    assert cache.get("b") is None
+    now[0] = 10.0
+    assert cache.get("a") is None and len(cache) == 1
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_ranked_batch_shared_read_only(mock_engine):
+    """
+    Test scenario: the same request ranked twice
+    Should score it once and hand out read-only ranked positions that match the recommended titles
+    """
+    weights = {"liked_actors": 1.0, "disliked_actors": 1.0, "genres": 1.0, "directors": 1.0,
+               "bonus_genre_director": 0.5}
+    request = {"liked_actors": ["Leonardo DiCaprio"], "disliked_actors": [], "weights": weights, "top_k": 3}
+
+    first, = mock_engine.ranked_batch([request])
+    second, = mock_engine.ranked_batch([request])
+
+    assert not first.flags.writeable and second is first  # the cached array itself, not a copy
+    assert mock_engine.result_cache.hits == 1
+    assert mock_engine.films[["Title"]].iloc[first].to_dict(orient="records") == \
+        mock_engine.recommend(["Leonardo DiCaprio"], [], weights, 3)
+
+def test_recommend_movies_result_cache(mock_engine, mock_model):
+    """
+    Test scenario: the same request twice, then the engine switches to int8 storage
+    Should score the second request from the cache, and score again once the vectors changed
+    """
+    weights = {"liked_actors": 1.0, "disliked_actors": 1.0, "genres": 1.0, "directors": 1.0,
+               "bonus_genre_director": 0.5}
+    first = recommend_movies(["Leonardo DiCaprio"], ["Kate Winslet"], weights, 3, engine=mock_engine)
+    scored = mock_engine.query_cache.misses + mock_engine.query_cache.hits
+
+    second = recommend_movies(["Leonardo DiCaprio"], ["Kate Winslet"], weights, 3, engine=mock_engine)
 
+    assert mock_engine.query_cache.misses + mock_engine.query_cache.hits == scored
+    assert mock_engine.result_cache.hits == 1
+    assert first == second
+    mock_engine.set_storage("int8")
+    assert len(mock_engine.result_cache) == 0
@@ -0,0 +1,108 @@
+"""
+File: test_reweight.py
+Description: this file contains unittests for the per-signal score cache from embeddings3.py module (SignalScores,
+RecommenderEngine.signal_scores and reweighted_batch) and for the custom weights of the /recommend route of server.py
+"""
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+import server
+from embeddings3 import DEFAULT_WEIGHTS
+
+SLIDERS = [DEFAULT_WEIGHTS,
+           {**DEFAULT_WEIGHTS, "genres": 2.0, "bonus_genre_director": 0.0},
+           {**DEFAULT_WEIGHTS, "liked_actors": 0.2, "disliked_actors": 1.5, "directors": 0.0}]
+
+# 50 films with random casts of 10 actors, genres and directors, see conftest.random_films
+pytestmark = pytest.mark.random_catalog(n_films=50, n_actors=10, n_directors=7, seed=1)
+
+
+@pytest.mark.parametrize("storage", ["float32", "float16"])
+@pytest.mark.parametrize("swipes", [(["Actor 1", "Actor 5"], ["Actor 2"]), ([], [])])
+def test_reweighted_matches_full_ranking(engine, storage, swipes):
+    """
+    Test scenario: the same swipes ranked with several weights (and a filter), from the per-signal scores and from
+    scratch, with exact and compact film vectors, with and without preferences
+    Should give the same films in the same order
+    """
+    engine.set_storage(storage, rescore_k=8)
+    liked, disliked = swipes
+    for weights in SLIDERS:
+        for filters in (None, {"min_year": 1990}):
+            request = {"liked_actors": liked, "disliked_actors": disliked, "weights": weights, "top_k": 10,
+                       "filters": filters}
+
+            reweighted, = engine.reweighted_batch([request])
+            ranked, = engine.rank_batch([request])
+
+            assert reweighted.tolist() == ranked.tolist()
+
+def test_reweighting_reuses_signal_scores(engine):
+    """
+    Test scenario: one user moving a slider 3 times
+    Should encode the queries and score the films once, then only reweight the cached scores
+    """
+    request = {"liked_actors": ["Actor 3"], "disliked_actors": ["Actor 4"], "top_k": 5}
+    engine.reweighted_batch([{**request, "weights": SLIDERS[0]}])
+    encoded = engine.query_cache.hits + engine.query_cache.misses
+
+    for weights in SLIDERS[1:]:
+        engine.reweighted_batch([{**request, "weights": weights}])
+
+    assert engine.query_cache.hits + engine.query_cache.misses == encoded
+    assert engine.signal_cache.hits == 2 and len(engine.signal_cache) == 1
+    signals, = engine.signal_scores([request])
+    coefficients, preference = signals.coefficients(SLIDERS[1])
+    assert np.linalg.norm(preference) == pytest.approx(1.0)
+    assert not signals.scores.flags.writeable
+
+def test_recommend_route_custom_weights(engine):
+    """
+    Test scenario: /recommend with the same swipes and two slider positions, then an unknown weight
+    Should answer the ranking of each weights from a single scoring of the swipes, and 400 for the unknown weight
+    """
+    embeddings3.set_engine(engine)
+    swipes = {"liked_actors": ["Actor 6"], "disliked_actors": []}
+    try:
+        client = TestClient(server.app)
+        first = client.post("/recommend", json={**swipes, "weights": {"genres": 2.0}}).json()
+        second = client.post("/recommend", json={**swipes, "weights": {"liked_actors": 0.1}}).json()
+        unknown = client.post("/recommend", json={**swipes, "weights": {"popularity": 1.0}})
+    finally:
+        embeddings3.set_engine(None)
+
+    expected = engine.recommend(["Actor 6"], [], {**DEFAULT_WEIGHTS, "liked_actors": 0.1}, 15)
+    assert second["recommendations"] == expected
+    assert first["recommendations"] != second["recommendations"]
+    assert engine.signal_cache.hits == 1
+    assert unknown.status_code == 400
+
+def test_recommend_route_ranking_path(engine):
+    """
+    Test scenario: /recommend with the default weights sent explicitly, then with custom weights whose ranking is
+    already in the result cache, and the second page of both
+    Should rank the default weights like a request without weights (never from the signal scores), and the custom
+    ones from the signal scores on every page, whatever the result cache holds
+    """
+    embeddings3.set_engine(engine)
+    swipes = {"liked_actors": ["Actor 2", "Actor 7"], "disliked_actors": ["Actor 3"]}
+    custom = {**DEFAULT_WEIGHTS, "genres": 1.5}
+    try:
+        client = TestClient(server.app)
+        plain = client.post("/recommend", json=swipes).json()
+        default = client.post("/recommend", json={**swipes, "weights": DEFAULT_WEIGHTS}).json()
+        assert len(engine.signal_cache) == 0
+        request = server.prepare_request(swipes["liked_actors"], swipes["disliked_actors"], custom,
+                                         server.RANKED_LIST_SIZE)
+        engine.result_cache.put(embeddings3.result_key(request), np.arange(server.RANKED_LIST_SIZE))
+        first = client.post("/recommend", json={**swipes, "weights": custom}).json()
+        server.ranked_lists.clear()
+        second = client.get("/recommend/page", params={"cursor": first["next_cursor"]}).json()
+    finally:
+        embeddings3.set_engine(None)
+
+    assert default["recommendations"] == plain["recommendations"]
+    [ranked] = engine.reweighted_batch([request])
+    titles = [{"Title": f"Film {i}"} for i in ranked]
+    assert first["recommendations"] + second["recommendations"] == titles[:2 * server.PAGE_SIZE]
@@ -0,0 +1,59 @@
+"""
+File: test_serve.py
+Description: this file contains unittests for the pre-fork launcher from serve.py module
+"""
+import gc
+import socket
+
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+import serve
+
+
+@pytest.fixture()
+def unfrozen():
+    yield
+    gc.unfreeze()
+    embeddings3.set_engine(None)
+
+def test_preload_builds_engine_once_and_freezes(monkeypatch, unfrozen):
+    """
+    Test scenario: the parent process preloads the engine before forking
+    Should build the shared engine with the server settings and move the live objects out of the collector
+    """
+    calls = []
+    monkeypatch.setattr(embeddings3.RecommenderEngine, "from_csv",
+                        classmethod(lambda cls, **kwargs: calls.append(kwargs) or "engine"))
+    embeddings3.set_engine(None)
+
+    assert serve.preload() == "engine"
+    assert serve.preload() == "engine"
+    assert calls == [serve.server.ENGINE_OPTIONS]
+    assert gc.get_freeze_count() > 0
+
+def test_bind_socket_shared_with_workers():
+    """
+    Test scenario: the listening socket opened by the parent
+    Should be listening and inherited by forked workers
+    """
+    sock = serve.bind_socket("127.0.0.1", 0)
+    try:
+        assert sock.get_inheritable()
+        with socket.create_connection(sock.getsockname(), timeout=1):
+            pass
+    finally:
+        sock.close()
+
+def test_catalog_delta_refused_with_several_workers(monkeypatch):
+    """
+    Test scenario: a delta posted with the catalog token to a server run with 2 workers
+    Should answer 409 without reading the delta, since only the receiving worker would be patched
+    """
+    monkeypatch.setattr(serve.server, "CATALOG_TOKEN", "secret")
+    monkeypatch.setattr(serve.server, "WORKERS", 2)
+
+    response = TestClient(serve.server.app).post("/catalog/delta", content="Code,Title\n",
+                                                 headers={"X-Catalog-Token": "secret"})
+
+    assert response.status_code == 409
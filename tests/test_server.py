@@ -0,0 +1,179 @@
+"""
+File: test_server.py
+Description: this file contains unittests for the FastAPI routes from server.py, using a small in-memory engine
+"""
+import asyncio
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+import embeddings3
+from embeddings3 import RecommenderEngine
+import server
+from server import app
+
+
+@pytest.fixture()
+def client():
+    """
+    Test client without the lifespan hook, so the real model is never loaded
+    """
+    embeddings3.set_engine(None)
+    yield TestClient(app)
+    embeddings3.set_engine(None)
+
+@pytest.fixture()
+def small_engine():
+    """
+    Engine built from a 2 film table and a mock model
+    """
+    films = pd.DataFrame({
+        "Title": ["Titanic", "Hot Fuzz"],
+        "Genres": ["Drama", "Comedy"],
+        "Director": ["Cameron", "Wright"],
+        "Actor_Names": [["Kate Winslet"], ["Simon Pegg"]],
+        "description": ["Sad movie", "Funny movie"],
+    })
+    model = MagicMock()
+    model.encode.side_effect = lambda texts: np.tile([1.0, 0.0], (len(texts), 1))
+    return RecommenderEngine(films, np.array([[1.0, 0.0], [0.0, 1.0]]), model)
+
+def test_health_before_engine_is_ready(client):
+    """
+    Test scenario: the engine is still loading
+    "/" should answer, "/ready" and the routes that need the engine should answer 503
+    """
+    assert client.get("/").status_code == 200
+    assert client.get("/ready").status_code == 503
+    assert client.get("/actor-batch").status_code == 503
+
+def test_health_fails_when_engine_can_not_be_built(monkeypatch):
+    """
+    Test scenario: the lifespan warm up fails to build the engine
+    "/" should answer 500 so the container is restarted, and "/ready" should keep answering 503
+    """
+    def broken_init_engine(**options):
+        raise OSError("final_films.csv not found")
+
+    embeddings3.set_engine(None)
+    monkeypatch.setattr(server, "init_engine", broken_init_engine)
+    monkeypatch.setattr(server, "engine_error", None)
+    with TestClient(app) as client:
+        for _ in range(100):  # the warm up runs in the background
+            if client.get("/").status_code != 200:
+                break
+            time.sleep(0.01)
+
+        response = client.get("/")
+        assert response.status_code == 500
+        assert "final_films.csv not found" in response.json()["detail"]
+        assert client.get("/ready").json()["detail"] == "Recommendation engine failed to load"
+
+def test_ready_once_engine_is_built(client, small_engine):
+    """
+    Test scenario: the engine is built
+    "/ready" should answer 200 and the routes should use the engine
+    """
+    embeddings3.set_engine(small_engine)
+
+    assert client.get("/ready").json() == {"status": "ready"}
+    assert sorted(client.get("/actor-batch").json()["actors"]) == ["Kate Winslet", "Simon Pegg"]
+
+    response = client.post("/recommend", json={"liked_actors": ["Kate Winslet"], "disliked_actors": []})
+    assert response.status_code == 200
+    assert response.json()["recommendations"][0] == {"Title": "Titanic"}
+
+def test_batch_recommend(client, small_engine):
+    """
+    Test scenario: a batch of two users with their own top_k
+    Should answer one result per user, in request order
+    """
+    embeddings3.set_engine(small_engine)
+
+    response = client.post("/recommend/batch", json={"requests": [
+        {"liked_actors": ["Kate Winslet"], "disliked_actors": [], "top_k": 1},
+        {"liked_actors": ["Simon Pegg"], "disliked_actors": [], "top_k": 2, "weights": {"bonus_genre_director": 5.0}},
+    ]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["recommendations"] == [{"Title": "Titanic"}]
+    assert results[1]["recommendations"][0] == {"Title": "Hot Fuzz"}
+    assert len(results[1]["recommendations"]) == 2
+
+def test_concurrent_recommend_batched(client, small_engine):
+    """
+    Test scenario: 6 users ask for recommendations at the same time
+    Should answer each of them and encode their queries in fewer model calls than requests
+    """
+    embeddings3.set_engine(small_engine)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*(
+                async_client.post("/recommend", json={"liked_actors": [actor], "disliked_actors": []})
+                for actor in ["Kate Winslet", "Simon Pegg"] * 3
+            ))
+    batches_before = server.recommend_batcher.batches
+    responses = asyncio.run(run())
+
+    assert [r.status_code for r in responses] == [200] * 6
+    assert all(len(r.json()["recommendations"]) == 2 for r in responses)
+    assert server.recommend_batcher.batches - batches_before < len(responses)
+    assert small_engine.model.encode.call_count < len(responses)
+
+def test_recommend_same_swipes_cached(client, small_engine):
+    """
+    Test scenario: the same swipes sent twice in a different order
+    Should answer the same recommendations, the second time from the result cache
+    """
+    embeddings3.set_engine(small_engine)
+    swipes = {"liked_actors": ["Kate Winslet", "Simon Pegg"], "disliked_actors": ["A", "B", "C", "D", "E"]}
+    reordered = {key: list(reversed(actors)) for key, actors in swipes.items()}
+
+    first = client.post("/recommend", json=swipes).json()
+    second = client.post("/recommend", json=reordered).json()
+
+    assert first == second
+    assert small_engine.result_cache.hits == 1
+    assert small_engine.model.encode.call_count == 1
+
+def test_recommend_pages_through_cursor(client, small_engine, monkeypatch):
+    """
+    Test scenario: recommendations one film per page, the second page asked with the cursor of the first
+    Should rank the films once and answer the next page from the kept ranked list, then no cursor after the last
+    """
+    embeddings3.set_engine(small_engine)
+    monkeypatch.setattr(server, "PAGE_SIZE", 1)
+
+    first = client.post("/recommend", json={"liked_actors": ["Kate Winslet"], "disliked_actors": []}).json()
+    second = client.get("/recommend/page", params={"cursor": first["next_cursor"], "page_size": 1}).json()
+
+    assert first["recommendations"] == [{"Title": "Titanic"}]
+    assert second == {"recommendations": [{"Title": "Hot Fuzz"}], "next_cursor": None}
+    assert small_engine.model.encode.call_count == 1
+    for cursor in ("nope", "unknown:1", first["next_cursor"].replace(":", ":x")):
+        assert client.get("/recommend/page", params={"cursor": cursor}).status_code == 400
+
+def test_recommend_page_on_another_worker(client, small_engine, monkeypatch):
+    """
+    Test scenario: the second page asked from a process that does not have the ranked list (another worker, or
+    expired), with and without custom weights and filters
+    Should rank the request carried by the cursor again and answer the same page as the worker that ranked it
+    """
+    embeddings3.set_engine(small_engine)
+    monkeypatch.setattr(server, "PAGE_SIZE", 1)
+    swipes = {"liked_actors": ["Simon Pegg"], "disliked_actors": ["Kate Winslet"]}
+
+    for payload in (swipes, {**swipes, "weights": {"genres": 2.0}, "filters": {"min_year": 1900}}):
+        first = client.post("/recommend", json=payload).json()
+        kept = client.get("/recommend/page", params={"cursor": first["next_cursor"]}).json()
+        server.ranked_lists.clear()
+        small_engine.result_cache.clear()
+
+        assert client.get("/recommend/page", params={"cursor": first["next_cursor"]}).json() == kept
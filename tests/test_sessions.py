@@ -0,0 +1,155 @@
+"""
+File: test_sessions.py
+Description: this file contains unittests for the incremental recommendation sessions from sessions.py module
+(RecommendationSession, SessionStore) and for the /sessions routes of server.py
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import embeddings3
+import server
+from embeddings3 import HashingEncoder, RecommenderEngine
+from sessions import RecommendationSession, SessionStore
+
+WEIGHTS = {"liked_actors": 1.8, "disliked_actors": 0.6, "genres": 0.6, "directors": 0.7, "bonus_genre_director": 0.1}
+
+
+@pytest.fixture()
+def engine():
+    """
+    Engine over 8 films with overlapping casts, directors and genres, using precomputed entity vectors
+    """
+    films = pd.DataFrame({
+        "Title": ["Heat", "Ronin", "The Irishman", "Casino", "Inception", "Titanic", "Shutter Island", "Collateral"],
+        "Genres": ["Crime,Drama", "Action,Thriller", "Crime,Drama", "Crime,Drama", "Action,Sci-Fi", "Drama,Romance",
+                   "Mystery,Thriller", "Crime,Thriller"],
+        "Director": ["Mann", "Frankenheimer", "Scorsese", "Scorsese", "Nolan", "Cameron", "Scorsese", "Mann"],
+        "Actor_Names": [["Al Pacino", "Robert De Niro"], ["Robert De Niro", "Jean Reno"],
+                        ["Robert De Niro", "Al Pacino", "Joe Pesci"], ["Robert De Niro", "Joe Pesci"],
+                        ["Leonardo DiCaprio"], ["Leonardo DiCaprio", "Kate Winslet"], ["Leonardo DiCaprio"],
+                        ["Tom Cruise", "Jamie Foxx"]],
+    })
+    films["description"] = films["Title"] + " " + films["Genres"] + " " + films["Director"]
+    model = HashingEncoder(dim=64)
+    return RecommenderEngine(films, model.encode(films["description"].tolist()), model, query_mode="precomputed")
+
+class CountingEncoder(HashingEncoder):
+    """
+    Slow HashingEncoder counting the texts it encodes
+    """
+    def __init__(self):
+        super().__init__(dim=64)
+        self.texts = 0
+
+    def encode(self, texts, show_progress_bar=False):
+        time.sleep(0.01)
+        self.texts += len(texts)
+        return super().encode(texts)
+
+def titles(recs):
+    return [rec["Title"] for rec in recs]
+
+@pytest.mark.parametrize("storage", ["float32", "float16"])
+def test_session_matches_full_recompute(engine, storage):
+    """
+    Test scenario: swipes given one by one to a session, including an unknown actor and a repeated like
+    Should recommend, after every swipe, the same films as scoring all the swipes so far from scratch
+    """
+    engine.set_storage(storage, rescore_k=4)
+    session = RecommendationSession(engine, WEIGHTS, top_k=5)
+    swipes = [("Robert De Niro", True), ("Kate Winslet", False), ("Nobody", True), ("Leonardo DiCaprio", True),
+              ("Jean Reno", False), ("Robert De Niro", True)]
+    liked, disliked = [], []
+    for actor, is_liked in swipes:
+        session.swipe(actor, is_liked)
+        (liked if is_liked else disliked).append(actor)
+
+        assert titles(session.recommendations()) == titles(engine.score_batch(
+            [{"liked_actors": liked, "disliked_actors": disliked, "weights": WEIGHTS, "top_k": 5}])[0])
+
+def test_session_without_swipes_and_rebased(engine):
+    """
+    Test scenario: a session before any swipe, then moved to another engine over the same films
+    Should give the generic recommendations first, and the same recommendations on the new engine
+    """
+    session = RecommendationSession(engine, WEIGHTS, top_k=3)
+    assert titles(session.recommendations()) == titles(engine.recommend([], [], WEIGHTS, 3))
+    session.swipe("Al Pacino", True)
+    other = RecommenderEngine(engine.films, engine.embeddings, engine.model, query_mode="precomputed")
+
+    rebased = session.rebased(other)
+
+    assert rebased.engine is other and rebased.liked_actors == ["Al Pacino"]
+    assert titles(rebased.recommendations()) == titles(session.recommendations())
+
+def test_session_store_expiry_and_eviction(engine):
+    """
+    Test scenario: a store with room for 2 sessions and a TTL of 10 seconds
+    Should drop the least recently used session, then expire the idle one
+    """
+    now = [0.0]
+    store = SessionStore(maxsize=2, ttl=10, clock=lambda: now[0])
+    first, _ = store.create(engine, WEIGHTS)
+    second, _ = store.create(engine, WEIGHTS)
+    store.get(first)
+    third, _ = store.create(engine, WEIGHTS)
+
+    assert store.get(second) is None and store.get(first) is not None
+    now[0] = 11.0
+    assert store.get(third) is None
+
+def test_session_routes(engine):
+    """
+    Test scenario: a session started with one like, then a swipe, a read with another top_k and a delete
+    Should answer with the recommendations after each swipe and 404 once the session is deleted
+    """
+    embeddings3.set_engine(engine)
+    try:
+        client = TestClient(server.app)
+        created = client.post("/sessions", json={"liked_actors": ["Robert De Niro"], "top_k": 4}).json()
+        session_id = created["session_id"]
+        swiped = client.post(f"/sessions/{session_id}/swipes", json={"actor": "Leonardo DiCaprio", "liked": True})
+        read = client.get(f"/sessions/{session_id}/recommendations", params={"top_k": 2})
+        deleted = client.delete(f"/sessions/{session_id}")
+        missing = client.post(f"/sessions/{session_id}/swipes", json={"actor": "Jean Reno", "liked": False})
+    finally:
+        embeddings3.set_engine(None)
+
+    assert len(created["recommendations"]) == 4
+    expected = engine.score_batch([{"liked_actors": ["Robert De Niro", "Leonardo DiCaprio"], "disliked_actors": [],
+                                    "weights": server.DEFAULT_WEIGHTS, "top_k": 4}])[0]
+    assert swiped.json()["recommendations"] == expected
+    assert read.json()["recommendations"] == expected[:2]
+    assert deleted.status_code == 200 and missing.status_code == 404
+
+def test_entity_vectors_computed_once(engine):
+    """
+    Test scenario: 4 sessions started at the same time on an engine without entity vectors (query mode "encode")
+    Should encode the entities once for all of them
+    """
+    model = CountingEncoder()
+    fresh = RecommenderEngine(engine.films, engine.embeddings, model)
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: RecommendationSession(fresh, WEIGHTS), range(4)))
+
+    n_entities = sum(len(index) for index, _ in fresh.entity_vectors.values()) + 1  # and the generic query
+    assert model.texts == n_entities
+
+def test_from_csv_builds_entity_vectors(tmp_path):
+    """
+    Test scenario: the engine built twice from the CSV files in query mode "encode"
+    Should have the entity vectors after the warm up, the second time from the stored artifact
+    """
+    first = RecommenderEngine.from_csv(model=CountingEncoder(), cache_dir=str(tmp_path))
+    model = CountingEncoder()
+
+    second = RecommenderEngine.from_csv(model=model, cache_dir=str(tmp_path))
+
+    assert first.entity_vectors is not None and second.entity_vectors is not None
+    assert model.texts == 0
+    RecommendationSession(second, WEIGHTS)
+    assert model.texts == 0